@@ -0,0 +1,351 @@
+"""
+Assemble the paired .a3m inputs of ColabFold predictions from per-chain MSAs.
+
+Parameters:
+- pairs:          pair fasta file written by make_input_fasta (plain or gzipped), or a folder of such files (shards)
+- msa_folder:     folder of per-chain MSAs <chain_id>.a3m, searched for {target_name}_unique_chains.fasta
+- output_folder:  path to an existing folder where the results will be saved (one .a3m per pair)
+- taxonomy_map:   (optional) TSV mapping UniProt / UniRef accessions of MSA hits to taxonomy ids
+- unpaired_only:  (optional) do not pair MSAs, only write the unpaired MSA of each chain
+
+Workflow:
+1. make_input_fasta --msa_plan writes the pairs along with {target_name}_unique_chains.fasta
+2. colabfold search is run once on {target_name}_unique_chains.fasta (a3m files renamed after the fasta ids)
+3. this script writes one <pair_id>.a3m per pair, which colabfold batch predicts directly
+   When `pairs` is a folder of shards, the .a3m files of each shard go to a subfolder named after the shard,
+   so that each shard remains one GPU job.
+
+The assembled MSAs have the layout of ColabFold complex MSAs (see example_data/Q9Y8I2__Q5JI66.a3m):
+a '#len_a,len_b<TAB>1,1' header, the concatenated query, the paired rows, then the MSA of each chain
+padded with gaps over the other chains (unpaired rows).
+
+Paired rows are rebuilt from the per-chain MSAs the way ColabFold's pairing step does: hits are matched by
+taxonomy, and for each taxon with hits in every chain, the best hit of each chain is concatenated into one row.
+The taxonomy id of a hit is read from its header (TaxID=, OX= or tax= tags), or looked up by accession in
+--taxonomy_map: a TSV of accession<TAB>taxonomy id, or the UniProt idmapping format (accession, NCBI_TaxID, id).
+Hits of colabfold search only carry their UniRef accession, so a taxonomy map is needed for these.
+Pairs without paired rows are counted and reported; if no pair has any, the script exits with status 1.
+With --unpaired_only, pairing is skipped (with a warning) and only unpaired rows are written, which gives
+AlphaFold-Multimer weaker evidence of the interface.
+"""
+import argparse
+import functools
+import gzip
+import logging
+from pathlib import Path
+import re
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+from src.make_input_fasta import get_chain_id
+from src.metrics import add_metrics_arguments, finish_metrics, metrics, start_profiler
+
+
+logger = logging.getLogger(__name__)
+
+FASTA_SUFFIXES = ('.fasta', '.fa', '.faa', '.fasta.gz', '.fa.gz', '.faa.gz')
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)-10s (%(levelname)s) %(message)s')
+
+    parser = argparse.ArgumentParser(description='Assemble paired .a3m inputs from per-chain MSAs')
+    parser.add_argument(
+        '-p', '--pairs',
+        type=Path,
+        required=True,
+        help='Path to pair fasta file written by make_input_fasta, or to a folder of pair fasta shards',
+    )
+    parser.add_argument(
+        '-m', '--msa_folder',
+        type=Path,
+        required=True,
+        help='Path to folder of per-chain MSAs named <chain_id>.a3m',
+    )
+    parser.add_argument(
+        '-o', '--output_folder',
+        type=Path,
+        required=True,
+        help='Path to existing output folder where the .a3m files will be saved',
+    )
+    parser.add_argument(
+        '-t', '--taxonomy_map',
+        type=Path,
+        required=False,
+        default=None,
+        help='Path to TSV mapping accessions of MSA hits to taxonomy ids (plain or gzipped), used to pair MSAs',
+    )
+    parser.add_argument(
+        '--unpaired_only',
+        action='store_true',
+        help='Do not pair MSAs by taxonomy: only write unpaired rows (weaker inputs for AlphaFold-Multimer)',
+    )
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    pairs_path = args.pairs
+    msa_folder = args.msa_folder
+    output_folder = args.output_folder
+    taxonomy_map_path = args.taxonomy_map
+    unpaired_only = args.unpaired_only
+    metrics_out = args.metrics_out
+    profile_out = args.profile_out
+
+    if not pairs_path.exists():
+        logger.error(f'Pair fasta file or folder does not exist: {pairs_path}')
+        sys.exit(1)
+    elif not msa_folder.is_dir():
+        logger.error(f'MSA folder does not exist: {msa_folder}')
+        sys.exit(1)
+    elif not output_folder.is_dir():
+        logger.error(f'Output folder does not exist: {output_folder}')
+        sys.exit(1)
+    elif taxonomy_map_path is not None and not taxonomy_map_path.is_file():
+        logger.error(f'Taxonomy map does not exist: {taxonomy_map_path}')
+        sys.exit(1)
+    elif taxonomy_map_path is not None and unpaired_only:
+        logger.error('A taxonomy map (--taxonomy_map) is only used to pair MSAs, not with --unpaired_only')
+        sys.exit(1)
+
+    profiler = start_profiler(profile_out)
+
+    taxonomy_map = None
+    if unpaired_only:
+        logger.warning('Pairing disabled (--unpaired_only): assembled MSAs only hold unpaired rows')
+    elif taxonomy_map_path is not None:
+        with metrics.timer('read_taxonomy_map'):
+            taxonomy_map = read_taxonomy_map(taxonomy_map_path, collect_msa_accessions(msa_folder))
+        logger.info(f'Taxonomy ids of {len(taxonomy_map):,} MSA hits read from {taxonomy_map_path}')
+
+    @functools.lru_cache(maxsize=256)
+    def read_chain_hits(msa_path, chain_seq):
+        return index_taxonomy_hits(read_chain_msa(msa_path, chain_seq), taxonomy_map)
+
+    if pairs_path.is_dir():
+        fasta_paths = sorted(p for p in pairs_path.iterdir() if p.name.endswith(FASTA_SUFFIXES))
+        jobs = [(p, output_folder / strip_fasta_suffix(p.name)) for p in fasta_paths]
+    else:
+        jobs = [(pairs_path, output_folder)]
+    logger.info(f'Assembling MSAs of {len(jobs):,} pair fasta files')
+
+    n_pairs, n_unpaired_pairs, missing_chains = 0, 0, set()
+    for fasta_path, job_folder in jobs:
+        job_folder.mkdir(exist_ok=True)
+        logger.info(f'Assembling MSAs of pairs in {fasta_path} into {job_folder}')
+
+        with open_fasta(fasta_path) as f:
+            for pair_id, seq in SimpleFastaParser(f):
+                pair_id = pair_id.split(None, 1)[0]
+                chain_seqs = seq.upper().split(':')
+                chain_msas = []
+                for chain_seq in chain_seqs:
+                    chain_id = get_chain_id(chain_seq)
+                    chain_msa = read_chain_msa(msa_folder / f'{chain_id}.a3m', chain_seq)
+                    if chain_msa is None:
+                        if chain_id not in missing_chains:
+                            logger.warning(f'No valid MSA for chain {chain_id} of pair {pair_id}, pairs with this chain are skipped')
+                            missing_chains.add(chain_id)
+                        break
+                    chain_msas.append(chain_msa)
+                else:
+                    paired_rows = []
+                    if not unpaired_only:
+                        with metrics.timer('pair_msas'):
+                            paired_rows = pair_chain_msas([
+                                read_chain_hits(msa_folder / f'{get_chain_id(chain_seq)}.a3m', chain_seq)
+                                for chain_seq in chain_seqs
+                            ])
+                        metrics.count('paired_rows', len(paired_rows))
+                        if len(paired_rows) == 0:
+                            n_unpaired_pairs += 1
+                    with metrics.timer('write_a3m', pair_id):
+                        write_pair_msa(job_folder / f'{pair_id}.a3m', pair_id, chain_seqs, chain_msas, paired_rows)
+                    n_pairs += 1
+                    continue
+
+                metrics.count('pairs_failed')
+
+    metrics.count('pairs', n_pairs)
+    cache_info = read_chain_msa.cache_info()
+    metrics.count('chain_msas_read', cache_info.misses)
+    metrics.count('chain_msas_reused', cache_info.hits)
+
+    logger.info(f'Assembled {n_pairs:,} pair MSAs from {cache_info.misses:,} per-chain MSA reads')
+    if n_unpaired_pairs > 0:
+        logger.warning(f'{n_unpaired_pairs:,} / {n_pairs:,} pairs have no paired rows (no taxon with hits in every chain)')
+    finish_metrics(metrics_out, profiler, profile_out)
+    if len(missing_chains) > 0:
+        logger.error(f'{len(missing_chains):,} chains have no valid MSA in {msa_folder}, e.g. {sorted(missing_chains)[:5]}')
+        sys.exit(1)
+    elif n_pairs > 0 and n_unpaired_pairs == n_pairs:
+        logger.error(
+            'No pair has paired rows: taxonomy ids of MSA hits are missing. '
+            'Provide a taxonomy map (--taxonomy_map), or pass --unpaired_only to assemble unpaired MSAs'
+        )
+        sys.exit(1)
+
+    logger.info('DONE')
+    sys.exit(0)
+
+
+def strip_fasta_suffix(name : str) -> str:
+    for suffix in FASTA_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def open_fasta(path : Path):
+    if path.name.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return path.open()
+
+
+@functools.lru_cache(maxsize=256)
+def read_chain_msa(msa_path : Path, chain_seq : str) -> Optional[List[Tuple[str, str]]]:
+    """
+    Read the (header, aligned sequence) records of a per-chain MSA, query excluded.
+    The per-chain MSAs of baits are read once and reused for all their pairs.
+    Returns None if the MSA does not exist or was not searched for `chain_seq`.
+    """
+    if not msa_path.is_file():
+        return None
+
+    with metrics.timer('read_a3m'), msa_path.open() as f:
+        lines = [
+            line for line in f.read().replace('\x00', '').splitlines()
+            if len(line) > 0 and not line.startswith('#')
+        ]
+    metrics.count('files_read')
+
+    records = []
+    for i in range(0, len(lines) - 1, 2):
+        records.append((lines[i][1:], lines[i + 1]))
+
+    if len(records) == 0 or records[0][1] != chain_seq:
+        logger.warning(f'Query of {msa_path} does not match the chain sequence')
+        return None
+    return records[1:]
+
+
+TAXONOMY_TAG_RE = re.compile(r'(?:TaxID|OX|tax)=(\d+)')
+UNIREF_PREFIX_RE = re.compile(r'^UniRef\d+_')
+
+
+def get_accession(header : str) -> str:
+    """
+    Accession of an MSA hit: first field of its header, without UniRef cluster prefix (UniRef100_P12345 -> P12345).
+    """
+    fields = header.split(None, 1)
+    return UNIREF_PREFIX_RE.sub('', fields[0]) if len(fields) > 0 else ''
+
+
+def collect_msa_accessions(msa_folder : Path) -> Set[str]:
+    """
+    Accessions of all hits of the per-chain MSAs in `msa_folder`.
+    """
+    accessions = set()
+    for msa_path in msa_folder.glob('*.a3m'):
+        with msa_path.open() as f:
+            for line in f:
+                if line.startswith('>'):
+                    accessions.add(get_accession(line[1:]))
+    return accessions
+
+
+def read_taxonomy_map(map_path : Path, accessions : Optional[Set[str]] = None) -> Dict[str, str]:
+    """
+    Read a mapping of accessions to taxonomy ids: TSV of accession<TAB>taxonomy id, or UniProt idmapping
+    (accession<TAB>NCBI_TaxID<TAB>taxonomy id, other id types are ignored). Only `accessions` are kept if given.
+    """
+    taxonomy_map = {}
+    with open_fasta(map_path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 3 and fields[1] == 'NCBI_TaxID':
+                accession, tax_id = fields[0], fields[2]
+            elif len(fields) == 2:
+                accession, tax_id = fields
+            else:
+                continue
+            accession = UNIREF_PREFIX_RE.sub('', accession)
+            if accessions is None or accession in accessions:
+                taxonomy_map[accession] = tax_id
+    return taxonomy_map
+
+
+def get_taxonomy_id(header : str, taxonomy_map : Optional[Dict[str, str]] = None) -> Optional[str]:
+    match = TAXONOMY_TAG_RE.search(header)
+    if match is not None:
+        return match[1]
+    elif taxonomy_map is not None:
+        return taxonomy_map.get(get_accession(header))
+    return None
+
+
+def index_taxonomy_hits(
+    chain_msa : List[Tuple[str, str]], 
+    taxonomy_map : Optional[Dict[str, str]] = None,
+) -> Dict[str, Tuple[str, str]]:
+    """
+    Best hit of each taxon in a per-chain MSA: {taxonomy_id: (header, aligned sequence)}, ordered by rank of
+    the hit (hits are sorted by score in the MSA). Hits without taxonomy id are left out.
+    """
+    hits = {}
+    for header, aligned_seq in chain_msa:
+        tax_id = get_taxonomy_id(header, taxonomy_map)
+        if tax_id is not None and tax_id not in hits:
+            hits[tax_id] = (header, aligned_seq)
+    return hits
+
+
+def pair_chain_msas(chain_hits : List[Dict[str, Tuple[str, str]]]) -> List[List[Tuple[str, str]]]:
+    """
+    Paired rows of a complex, as in ColabFold's pairing step: for each taxon with hits in every chain,
+    the best hit of each chain. Rows are ordered by rank of the hit of the first chain.
+    """
+    return [
+        [hits[tax_id] for hits in chain_hits]
+        for tax_id in chain_hits[0]
+        if all(tax_id in hits for hits in chain_hits[1:])
+    ]
+
+
+def write_pair_msa(
+    output_path : Path, 
+    pair_id : str, 
+    chain_seqs : List[str], 
+    chain_msas : List[List[Tuple[str, str]]],
+    paired_rows : List[List[Tuple[str, str]]] = (),
+):
+    """
+    Write the MSA of a complex: paired rows, with the hits of all chains concatenated, 
+    then the unpaired MSA of each chain padded with gaps over the other chains.
+    """
+    lengths = [len(seq) for seq in chain_seqs]
+    lines = [
+        '#' + ','.join(str(length) for length in lengths) + '\t' + ','.join('1' for _ in lengths),
+        f'>{pair_id}\t{pair_id}',
+        ''.join(chain_seqs),
+    ]
+    for row in paired_rows:
+        lines.append('>' + '\t'.join(header for header, _ in row))
+        lines.append(''.join(aligned_seq for _, aligned_seq in row))
+    for i, (chain_seq, chain_msa) in enumerate(zip(chain_seqs, chain_msas)):
+        left_gaps = '-' * sum(lengths[:i])
+        right_gaps = '-' * sum(lengths[i + 1:])
+        lines.append(f'>{pair_id}')
+        lines.append(left_gaps + chain_seq + right_gaps)
+        for header, aligned_seq in chain_msa:
+            lines.append(f'>{header}')
+            lines.append(left_gaps + aligned_seq + right_gaps)
+
+    with output_path.open('w') as f_out:
+        f_out.write('\n'.join(lines) + '\n')
+    metrics.count('files_written')
+
+
+if __name__ == '__main__':
+    main()
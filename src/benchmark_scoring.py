@@ -0,0 +1,364 @@
+"""
+Benchmark the scoring hot paths on synthetic AlphaFold outputs.
+
+Generates a library of synthetic ColabFold (PDB, JSON scores, PAE) and AlphaFold 3 (mmCIF, summary
+confidences) outputs for each combination of number of chains and chain length, then times each
+scoring stage separately and reports throughput (complexes per second) and peak memory.
+
+The peak memory of a stage is measured with `tracemalloc` in a second, untimed run of the stage
+(tracing slows down allocations): it is the peak of memory allocated by the stage, outputs included,
+above what was allocated before it. The peak RSS of the benchmark process is reported once per record.
+
+Before timing anything, the scores of `example_data` are checked against `example_data/docking_scores.csv`
+so that a speedup cannot silently change results.
+
+Results are appended as one JSON record per configuration to the output path (JSON lines),
+so that runs can be compared over time.
+"""
+import argparse
+import csv
+import datetime
+import json
+import logging
+from pathlib import Path
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from src.score_af3 import calc_model_dockq, read_cif_atoms
+from src.score_protein_complex import (
+    calc_interface_pae,
+    calc_pdockq,
+    get_chain_lengths,
+    load_protein_complex_files,
+    read_pae_matrix,
+    read_pdb_atoms,
+    read_plddt_per_chain,
+    read_scores_from_json_file,
+    score_complex,
+    score_protein_complex_files,
+    split_chains_from_atoms,
+    split_pdockq_chains_from_atoms,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+EXAMPLE_DATA = Path(__file__).resolve().parent.parent / 'example_data'
+
+BACKBONE = [('N', 'N'), ('CA', 'C'), ('C', 'C'), ('O', 'O')]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)-10s (%(levelname)s) %(message)s')
+
+    parser = argparse.ArgumentParser(description='Benchmark scoring hot paths on synthetic AlphaFold outputs')
+    parser.add_argument(
+        '-o', '--output_path',
+        type=Path,
+        required=True,
+        help='Path to JSON lines file where benchmark results are appended.',
+    )
+    parser.add_argument(
+        '--n_complexes',
+        type=int,
+        required=False,
+        default=20,
+        help='Number of synthetic complexes per configuration (library size).',
+    )
+    parser.add_argument(
+        '--n_chains',
+        type=int,
+        nargs='+',
+        required=False,
+        default=[2, 4],
+        help='Numbers of chains per complex to benchmark.',
+    )
+    parser.add_argument(
+        '--chain_lengths',
+        type=int,
+        nargs='+',
+        required=False,
+        default=[200, 800],
+        help='Chain lengths (number of residues) to benchmark.',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        required=False,
+        default=0,
+        help='Random seed used to generate synthetic complexes.',
+    )
+    args = parser.parse_args()
+
+    output_path = args.output_path
+    n_complexes = args.n_complexes
+
+    if not output_path.parent.is_dir():
+        logger.error(f'Output folder does not exist: {output_path.parent}')
+        sys.exit(1)
+    elif n_complexes < 1:
+        logger.error(f'Number of complexes must be at least 1: {n_complexes}')
+        sys.exit(1)
+
+    logger.info('Check scores of example data')
+    if not check_example_data():
+        logger.error('Scores of example data do not match docking_scores.csv')
+        sys.exit(1)
+
+    git_commit = get_git_commit()
+    rng = np.random.default_rng(args.seed)
+    for n_chains in args.n_chains:
+        for chain_length in args.chain_lengths:
+            logger.info(f'Benchmark {n_complexes:,} complexes with {n_chains} chains of {chain_length:,} residues')
+
+            tempdir = Path(tempfile.mkdtemp(prefix='afpd_benchmark_'))
+            try:
+                generate_library(tempdir, n_complexes, n_chains, chain_length, rng)
+                stages = run_benchmark(tempdir, n_chains)
+            finally:
+                shutil.rmtree(tempdir)
+
+            record = {
+                'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                'git_commit': git_commit,
+                'config': {
+                    'n_complexes': n_complexes,
+                    'n_chains': n_chains,
+                    'chain_length': chain_length,
+                    'seed': args.seed,
+                },
+                'stages': stages,
+                'peak_rss_mb': get_peak_rss_mb(),
+            }
+            for name, stage in stages.items():
+                logger.info(
+                    f'{name:<24} {stage["seconds"]:>9.3f} s  {stage["complexes_per_second"]:>10,.1f} complexes/s  '
+                    f'{stage["peak_alloc_mb"]:>9,.1f} MB'
+                )
+
+            with output_path.open('a') as f_out:
+                f_out.write(json.dumps(record) + '\n')
+
+    logger.info(f'Peak RSS: {get_peak_rss_mb():,.1f} MB')
+    logger.info('DONE')
+    sys.exit(0)
+
+
+def check_example_data() -> bool:
+    """
+    Score example data and compare with the reference scores in docking_scores.csv.
+    """
+    with (EXAMPLE_DATA / 'docking_scores.csv').open(newline='') as f:
+        expected = {row['id']: row for row in csv.DictReader(f)}
+
+    is_ok = True
+    for files in load_protein_complex_files(EXAMPLE_DATA):
+        complex_id, scores, error = score_protein_complex_files(files)
+        if error is not None:
+            logger.error(f'Failed to score {complex_id}: {error}')
+            is_ok = False
+            continue
+
+        for key in ['plddt', 'ptm', 'iptm', 'dockq']:
+            if scores[key] != float(expected[complex_id][key]):
+                logger.error(f'{complex_id}: {key} = {scores[key]} but expected {expected[complex_id][key]}')
+                is_ok = False
+
+    return is_ok
+
+
+def run_benchmark(folder : Path, n_chains : int) -> Dict[str, dict]:
+    """
+    Time each scoring stage over all complexes in the folder.
+    Inputs of a stage are prepared by the previous stages, outside of the timed section.
+    """
+    protein_complex_files = load_protein_complex_files(folder)
+    pdb_paths = [pdb_path for _, pdb_path, _ in protein_complex_files]
+    scores_paths = [scores_path for _, _, scores_path in protein_complex_files]
+    pae_paths = [folder / f'{complex_id}_predicted_aligned_error_v1.json' for complex_id, _, _ in protein_complex_files]
+    cif_paths = sorted(folder.glob('af3/*/*_model.cif'))
+
+    stages = {}
+    json_scores = time_stage(stages, 'read_scores_json', read_scores_from_json_file, scores_paths)
+    paes = time_stage(stages, 'read_pae', lambda p: read_pae_matrix(p, 'predicted_aligned_error'), pae_paths)
+    atoms = time_stage(stages, 'parse_pdb', read_pdb_atoms, pdb_paths)
+    chains = time_stage(stages, 'read_pdb', split_chains_from_atoms, atoms)
+    chains_pdockq = time_stage(stages, 'read_pdb_pdockq', split_pdockq_chains_from_atoms, atoms)
+
+    plddts = [
+        read_plddt_per_chain(plddt, chain_CA_inds)
+        for (plddt, *_), (_, chain_CA_inds, _) in zip(json_scores, chains)
+    ]
+    time_stage(
+        stages, 'score_complex',
+        lambda args: score_complex(args[0][0], args[0][2], args[1]),
+        list(zip(chains, plddts)),
+    )
+    if n_chains == 2:
+        time_stage(stages, 'calc_pdockq', lambda args: calc_pdockq(*args, t=8), chains_pdockq)
+
+    time_stage(
+        stages, 'interface_pae',
+        lambda args: calc_interface_pae(args[0], get_chain_lengths(args[1][1])),
+        list(zip(paes, chains)),
+    )
+    time_stage(stages, 'score_end_to_end', score_protein_complex_files, protein_complex_files)
+    time_stage(stages, 'af3_read_cif', read_cif_atoms, cif_paths)
+    time_stage(stages, 'af3_dockq', calc_model_dockq, cif_paths)
+
+    return stages
+
+
+def time_stage(stages : Dict[str, dict], name : str, fn : Callable, inputs : list) -> list:
+    start = time.perf_counter()
+    outputs = [fn(x) for x in inputs]
+    seconds = time.perf_counter() - start
+    stages[name] = {
+        'seconds': round(seconds, 6),
+        'complexes_per_second': round(len(inputs) / seconds, 3) if seconds > 0 else None,
+        'peak_alloc_mb': round(measure_peak_alloc_mb(fn, inputs), 1),
+    }
+    return outputs
+
+
+def measure_peak_alloc_mb(fn : Callable, inputs : list) -> float:
+    """
+    Peak memory allocated while running `fn` over all inputs (outputs included), in MB.
+    NumPy arrays are traced by `tracemalloc` along with Python objects.
+    """
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        outputs = [fn(x) for x in inputs]
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del outputs
+    return (peak - baseline) / 1024 ** 2
+
+
+def get_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_git_commit() -> str:
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=EXAMPLE_DATA.parent,
+            capture_output=True,
+            text=True,
+        )
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def generate_library(folder : Path, n_complexes : int, n_chains : int, chain_length : int, rng : np.random.Generator):
+    """
+    Write synthetic ColabFold outputs (rank 1 PDB, JSON scores, PAE) in `folder`
+    and AlphaFold 3 outputs (mmCIF model, summary confidences) in `folder/af3`.
+    """
+    model_name = 'rank_001_alphafold2_multimer_v3_model_1_seed_000'
+    for i in range(n_complexes):
+        complex_id = f'BAIT{i:06d}__TARGET{i:06d}'
+        residues = generate_complex(n_chains, chain_length, rng)
+        n_residues = n_chains * chain_length
+        plddt = np.round(rng.uniform(30, 95, size=n_residues), 2)
+        pae = np.round(rng.uniform(0.5, 31, size=(n_residues, n_residues)), 2)
+
+        write_pdb(folder / f'{complex_id}_unrelaxed_{model_name}.pdb', residues, plddt)
+        with (folder / f'{complex_id}_scores_{model_name}.json').open('w') as f_out:
+            json.dump({
+                'plddt': plddt.tolist(),
+                'max_pae': 31.75,
+                'pae': pae.tolist(),
+                'ptm': round(float(rng.uniform(0.2, 0.9)), 2),
+                'iptm': round(float(rng.uniform(0.1, 0.9)), 2),
+            }, f_out)
+        with (folder / f'{complex_id}_predicted_aligned_error_v1.json').open('w') as f_out:
+            json.dump({'predicted_aligned_error': pae.tolist(), 'max_predicted_aligned_error': 31.75}, f_out)
+
+        af3_id = complex_id.lower()
+        af3_folder = folder / 'af3' / af3_id
+        af3_folder.mkdir(parents=True)
+        write_cif(af3_folder / f'{af3_id}_model.cif', residues, plddt)
+        with (af3_folder / f'{af3_id}_summary_confidences.json').open('w') as f_out:
+            json.dump({
+                'fraction_disordered': 0.0,
+                'has_clash': 0.0,
+                'iptm': round(float(rng.uniform(0.1, 0.9)), 2),
+                'ptm': round(float(rng.uniform(0.2, 0.9)), 2),
+                'ranking_score': round(float(rng.uniform(0.1, 0.9)), 2),
+            }, f_out)
+
+
+def generate_complex(n_chains : int, chain_length : int, rng : np.random.Generator) -> List[tuple]:
+    """
+    Random walk CA traces (3.8 Å steps) for each chain, with chains packed next to each other
+    so that they form interfaces. Returns residues as (chain, res_no, res_name, [(atom_name, element, xyz)]).
+    """
+    residues = []
+    for c in range(n_chains):
+        chain = chr(ord('A') + c)
+        steps = rng.normal(size=(chain_length, 3))
+        steps = 3.8 * steps / np.linalg.norm(steps, axis=1, keepdims=True)
+        ca = np.cumsum(steps, axis=0)
+        ca = ca - ca.mean(axis=0) + np.array([12.0 * c, 0, 0])
+        for r in range(chain_length):
+            res_name = 'GLY' if rng.random() < 0.08 else 'ALA'
+            atoms = [
+                (atom_name, element, ca[r] + (rng.normal(size=3) if atom_name != 'CA' else 0))
+                for atom_name, element in BACKBONE
+            ]
+            if res_name != 'GLY':
+                atoms.append(('CB', 'C', ca[r] + rng.normal(size=3)))
+            residues.append((chain, r + 1, res_name, atoms))
+    return residues
+
+
+def write_pdb(path : Path, residues : List[tuple], plddt : np.ndarray):
+    lines = ['MODEL     1']
+    atom_no = 0
+    for (chain, res_no, res_name, atoms), res_plddt in zip(residues, plddt):
+        for atom_name, element, (x, y, z) in atoms:
+            atom_no += 1
+            lines.append(
+                f'ATOM  {atom_no:>5d}  {atom_name:<3s} {res_name:>3s} {chain}{res_no:>4d}    '
+                f'{x:8.3f}{y:8.3f}{z:8.3f}{1.0:6.2f}{res_plddt:6.2f}           {element}  '
+            )
+    lines += ['ENDMDL', 'END']
+    path.write_text('\n'.join(lines) + '\n')
+
+
+def write_cif(path : Path, residues : List[tuple], plddt : np.ndarray):
+    columns = [
+        'group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_alt_id', 'label_comp_id', 'label_seq_id',
+        'label_asym_id', 'Cartn_x', 'Cartn_y', 'Cartn_z', 'occupancy', 'B_iso_or_equiv', 'auth_seq_id',
+        'auth_asym_id', 'pdbx_PDB_model_num',
+    ]
+    lines = ['data_synthetic', '#', 'loop_'] + [f'_atom_site.{c}' for c in columns]
+    atom_no = 0
+    for (chain, res_no, res_name, atoms), res_plddt in zip(residues, plddt):
+        for atom_name, element, (x, y, z) in atoms:
+            atom_no += 1
+            lines.append(
+                f'ATOM {atom_no} {element} {atom_name} . {res_name} {res_no} {chain} '
+                f'{x:.3f} {y:.3f} {z:.3f} 1.00 {res_plddt:.2f} {res_no} {chain} 1'
+            )
+    lines.append('#')
+    path.write_text('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Compact binary cache of the coordinates needed to recompute pDockQ / mpDockQ without parsing PDB files.
+
+For each scored model, the CB coordinates (CA for glycine) of each chain are stored along with their pLDDT
+from the B-factor column (pDockQ), the per-residue pLDDT of each chain from the JSON scores (mpDockQ),
+chain boundaries, ipTM and pTM. Models are written in bundles <cache_folder>/coords_00000/, ...
+of a fixed number of models, as flat arrays with offsets, one <name>.npy file per array:
+
+- ids, models, iptm, ptm       one value per model (model name is empty unless all models are scored)
+- chain_offsets                (n_models + 1,) start of the chains of each model in the chain arrays
+- chain_names                  one value per chain
+- cb_offsets, res_offsets      (n_chains + 1,) start of each chain in the CB and residue arrays
+- cb_coords, cb_plddt          (n_cb, 3) and (n_cb,) float64, as read from the PDB files
+- res_plddt                    (n_residues,) float32, as read from the JSON scores
+
+Values are stored at the precision they are scored at, so that rescoring from the cache gives the same
+pDockQ / mpDockQ as scoring the PDB files (about 40 bytes per residue instead of ~650 bytes of PDB text).
+Arrays are not compressed and are memory-mapped when read, so that only the pages of the models being
+rescored are held in memory. Bundles written as coords_00000.npz by earlier versions are still read
+(loaded in memory).
+"""
+import logging
+import os
+from pathlib import Path
+import re
+import shutil
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_RE = re.compile(r'^coords_(\d+)(\.npz)?$')
+
+
+class CachedModel(NamedTuple):
+    id        : str
+    model     : str
+    iptm      : Optional[float]
+    ptm       : Optional[float]
+    chains    : List[str]
+    cb_coords : List[np.ndarray]  # (l, 3) per chain
+    cb_plddt  : List[np.ndarray]  # (l,) per chain
+    res_plddt : List[np.ndarray]  # (n_residues,) per chain
+
+
+class CoordsCacheWriter:
+    """
+    Append models to numbered bundles of `bundle_size` models, after the bundles already in `cache_folder`.
+    """
+
+    def __init__(self, cache_folder : Path, bundle_size : int = 10_000):
+        self.cache_folder = Path(cache_folder)
+        self.bundle_size = bundle_size
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        self.n_bundles = len(list_coords_bundles(self.cache_folder))
+        self.n_models = 0
+        self._models : List[CachedModel] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, model : CachedModel):
+        self._models.append(model)
+        self.n_models += 1
+        if len(self._models) >= self.bundle_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._models) == 0:
+            return
+
+        models = self._models
+        chains = [chain for m in models for chain in m.chains]
+        cb_coords = [c for m in models for c in m.cb_coords]
+        res_plddt = [p for m in models for p in m.res_plddt]
+        arrays = {
+            'ids': np.array([m.id for m in models]),
+            'models': np.array([m.model for m in models]),
+            'iptm': np.array([np.nan if m.iptm is None else m.iptm for m in models], dtype=np.float64),
+            'ptm': np.array([np.nan if m.ptm is None else m.ptm for m in models], dtype=np.float64),
+            'chain_offsets': offsets([len(m.chains) for m in models]),
+            'chain_names': np.array(chains),
+            'cb_offsets': offsets([len(c) for c in cb_coords]),
+            'res_offsets': offsets([len(p) for p in res_plddt]),
+            'cb_coords': concatenate(cb_coords, np.float64, (0, 3)),
+            'cb_plddt': concatenate([p for m in models for p in m.cb_plddt], np.float64, (0,)),
+            'res_plddt': concatenate(res_plddt, np.float32, (0,)),
+        }
+
+        path = self.cache_folder / f'coords_{self.n_bundles:05d}'
+        tmp_path = path.with_name(path.name + '.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir()
+        for name, array in arrays.items():
+            np.save(tmp_path / f'{name}.npy', array)
+        os.replace(tmp_path, path)
+
+        self.n_bundles += 1
+        self._models = []
+
+    def close(self):
+        self.flush()
+
+
+def offsets(counts : List[int]) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+
+
+def concatenate(arrays : List[np.ndarray], dtype, empty_shape) -> np.ndarray:
+    if len(arrays) == 0:
+        return np.empty(empty_shape, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
+
+
+def list_coords_bundles(cache_folder : Path) -> List[Path]:
+    """
+    Bundles of a cache folder, in the order they were written.
+    """
+    bundles = [
+        (int(m[1]), entry.path)
+        for entry in os.scandir(cache_folder)
+        if (m := BUNDLE_RE.match(entry.name)) is not None
+    ]
+    return [Path(path) for _, path in sorted(bundles)]
+
+
+def read_cached_ids(cache_folder : Path) -> Set[str]:
+    """
+    Ids of the complexes of all bundles of a cache folder (only the ids array of each bundle is read).
+    """
+    cached_ids = set()
+    for bundle_path in list_coords_bundles(cache_folder):
+        cached_ids.update(load_bundle_array(bundle_path, 'ids').tolist())
+    return cached_ids
+
+
+def load_bundle_array(bundle_path : Path, name : str) -> np.ndarray:
+    """
+    Array `name` of a bundle, memory-mapped (read-only) from its .npy file.
+    """
+    if bundle_path.is_dir():
+        return np.load(bundle_path / f'{name}.npy', mmap_mode='r')
+    with np.load(bundle_path) as bundle:
+        return bundle[name]
+
+
+def load_bundle(bundle_path : Path) -> Dict[str, np.ndarray]:
+    """
+    All arrays of a bundle, memory-mapped (read-only). Bundles of earlier versions (.npz) are loaded in memory.
+    """
+    if bundle_path.is_dir():
+        return {path.stem: np.load(path, mmap_mode='r') for path in bundle_path.glob('*.npy')}
+    with np.load(bundle_path) as bundle:
+        return {key: bundle[key] for key in bundle.files}
+
+
+def read_coords_bundle(bundle_path : Path) -> Iterator[CachedModel]:
+    """
+    Models of a bundle. Per chain arrays are views on the (memory-mapped) arrays of the bundle.
+    """
+    arrays = load_bundle(bundle_path)
+
+    chain_offsets = arrays['chain_offsets']
+    cb_offsets, res_offsets = arrays['cb_offsets'], arrays['res_offsets']
+    for i, (model_id, model) in enumerate(zip(arrays['ids'].tolist(), arrays['models'].tolist())):
+        chain_inds = range(chain_offsets[i], chain_offsets[i + 1])
+        iptm, ptm = float(arrays['iptm'][i]), float(arrays['ptm'][i])
+        yield CachedModel(
+            id=model_id,
+            model=model,
+            iptm=None if np.isnan(iptm) else iptm,
+            ptm=None if np.isnan(ptm) else ptm,
+            chains=[str(arrays['chain_names'][c]) for c in chain_inds],
+            cb_coords=[arrays['cb_coords'][cb_offsets[c]:cb_offsets[c + 1]] for c in chain_inds],
+            cb_plddt=[arrays['cb_plddt'][cb_offsets[c]:cb_offsets[c + 1]] for c in chain_inds],
+            res_plddt=[arrays['res_plddt'][res_offsets[c]:res_offsets[c + 1]] for c in chain_inds],
+        )
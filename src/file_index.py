@@ -0,0 +1,183 @@
+"""
+Fast listing of prediction output folders with millions of files.
+
+Folders are listed with `os.scandir`, which returns file types along with names so that no `stat`
+call is needed per entry, and file names are filtered with a precompiled pattern. Subdirectories
+can be walked in parallel with a pool of threads (listing is I/O bound on network filesystems).
+
+The list of matching files can be saved to an on-disk manifest and reused by later runs to skip
+the directory listing altogether. By default a manifest is only reused while the modification
+time of the root folder is unchanged, i.e. no entry was added to or removed from it. In recursive mode,
+the modification times of all subdirectories are checked too (one `stat` per directory instead of
+a listing), since files written into an existing subdirectory do not change the root folder.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+from pathlib import Path
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+def list_files(
+    folder : Path,
+    pattern : re.Pattern,
+    recursive : bool = False,
+    workers : int = 1,
+    manifest_path : Optional[Path] = None,
+    refresh : bool = False,
+) -> List[Path]:
+    """
+    List files in `folder` whose name matches `pattern` (searched anywhere in the name), sorted by path.
+    If `manifest_path` is given, the listing is read from the manifest when it is up to date,
+    otherwise the folder is scanned and the manifest (re)written.
+    """
+    folder = Path(folder)
+    if manifest_path is not None and not refresh:
+        paths = read_manifest(manifest_path, folder, pattern, recursive, workers)
+        if paths is not None:
+            logger.info(f'Loaded {len(paths):,} files from manifest {manifest_path}')
+            return paths
+
+    root_mtime_ns = folder.stat().st_mtime_ns
+    dir_mtimes = {} if recursive else None
+    paths = scan_folder(folder, pattern, recursive, workers, dir_mtimes)
+
+    if manifest_path is not None:
+        write_manifest(manifest_path, folder, pattern, recursive, root_mtime_ns, paths, dir_mtimes)
+        logger.info(f'Saved {len(paths):,} files to manifest {manifest_path}')
+
+    return paths
+
+
+def scan_folder(
+    folder : Path,
+    pattern : re.Pattern,
+    recursive : bool = False,
+    workers : int = 1,
+    dir_mtimes : Optional[Dict[str, int]] = None,
+) -> List[Path]:
+    """
+    Scan `folder` with `os.scandir`, walking subdirectories level by level if `recursive`.
+    Directories of the same level are listed in parallel when `workers > 1`.
+    If `dir_mtimes` is given, it is filled with the modification time of each listed directory
+    (taken before listing it), by path relative to `folder`.
+    """
+    def scan_dir(path : str) -> Tuple[List[str], List[str]]:
+        files, subdirs = [], []
+        if dir_mtimes is not None:
+            dir_mtimes[os.path.relpath(path, folder)] = os.stat(path).st_mtime_ns
+        with os.scandir(path) as it:
+            for entry in it:
+                if recursive and entry.is_dir():
+                    subdirs.append(entry.path)
+                elif pattern.search(entry.name) is not None and entry.is_file():
+                    files.append(entry.path)
+        return files, subdirs
+
+    output = []
+    level = [os.fspath(folder)]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        while len(level) > 0:
+            if workers > 1 and len(level) > 1:
+                results = executor.map(scan_dir, level)
+            else:
+                results = map(scan_dir, level)
+
+            next_level = []
+            for files, subdirs in results:
+                output.extend(files)
+                next_level.extend(subdirs)
+            level = next_level
+
+    return [Path(p) for p in sorted(output)]
+
+
+def read_manifest(
+    manifest_path : Path,
+    folder : Path,
+    pattern : re.Pattern,
+    recursive : bool,
+    workers : int = 1,
+) -> Optional[List[Path]]:
+    """
+    Read the file listing from a manifest.
+    Returns None if there is no manifest, if it does not match the folder and scan parameters,
+    or if the folder (or in recursive mode, any of its subdirectories) was modified since the manifest was written.
+    """
+    manifest_path = Path(manifest_path)
+    if not manifest_path.is_file():
+        return None
+
+    with manifest_path.open() as f:
+        header = json.loads(f.readline())
+        if (
+            header.get('root') != folder.resolve().as_posix() or
+            header.get('pattern') != pattern.pattern or
+            header.get('recursive') != recursive
+        ):
+            logger.info(f'Manifest {manifest_path} was built with other parameters: rescanning')
+            return None
+        elif header.get('root_mtime_ns') != folder.stat().st_mtime_ns:
+            logger.info(f'Folder {folder} changed since manifest {manifest_path} was written: rescanning')
+            return None
+        elif recursive and not dir_mtimes_unchanged(folder, header.get('dir_mtimes_ns'), workers):
+            logger.info(f'Subdirectories of {folder} changed since manifest {manifest_path} was written: rescanning')
+            return None
+
+        return [folder / line.rstrip('\n') for line in f]
+
+
+def dir_mtimes_unchanged(folder : Path, dir_mtimes : Optional[Dict[str, int]], workers : int = 1) -> bool:
+    """
+    Whether all directories of a manifest still exist with the same modification time.
+    """
+    if dir_mtimes is None:
+        return False
+
+    def get_mtime(rel_path : str) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(folder, rel_path)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    rel_paths = list(dir_mtimes)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            mtimes = list(executor.map(get_mtime, rel_paths, chunksize=256))
+    else:
+        mtimes = list(map(get_mtime, rel_paths))
+    return all(mtime == dir_mtimes[p] for p, mtime in zip(rel_paths, mtimes))
+
+
+def write_manifest(
+    manifest_path : Path,
+    folder : Path,
+    pattern : re.Pattern,
+    recursive : bool,
+    root_mtime_ns : int,
+    paths : List[Path],
+    dir_mtimes : Optional[Dict[str, int]] = None,
+):
+    """
+    Write the manifest atomically: header line in JSON followed by one path per line, relative to the folder.
+    """
+    manifest_path = Path(manifest_path)
+    header = {
+        'root': folder.resolve().as_posix(),
+        'pattern': pattern.pattern,
+        'recursive': recursive,
+        'root_mtime_ns': root_mtime_ns,
+    }
+    if dir_mtimes is not None:
+        header['dir_mtimes_ns'] = dir_mtimes
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with tmp_path.open('w') as f_out:
+        f_out.write(json.dumps(header) + '\n')
+        for p in paths:
+            f_out.write(p.relative_to(folder).as_posix() + '\n')
+    os.replace(tmp_path, manifest_path)
@@ -0,0 +1,69 @@
+"""
+Bulk parsing of large numeric arrays stored in JSON files (PAE matrices, AlphaFold 3 full confidences).
+
+Arrays are located in the raw bytes of the file and their numbers parsed in bulk by NumPy, avoiding
+the millions of Python floats that `json.load` would create. Any JSON layout is accepted (compact or
+indented), as long as strings in the parsed arrays contain no commas or brackets.
+"""
+import math
+import re
+from typing import Optional
+
+import numpy as np
+
+
+MATRIX_END_RE = re.compile(rb'\]\s*\]')
+VECTOR_END_RE = re.compile(rb'\]')
+
+
+def find_json_array(raw : bytes, key : str) -> bytes:
+    """
+    Raw bytes of the (flat or nested) JSON array stored under `key`, brackets included.
+    """
+    key_start = raw.find(f'"{key}"'.encode())
+    if key_start < 0:
+        raise ValueError(f'No {key} in JSON file')
+
+    start = raw.index(b'[', key_start)
+    is_nested = raw[start+1:start+64].lstrip().startswith(b'[')
+    end_re = MATRIX_END_RE if is_nested else VECTOR_END_RE
+    end = end_re.search(raw, start)
+    if end is None:
+        raise ValueError(f'Unterminated {key} array in JSON file')
+    return raw[start:end.end()]
+
+
+def parse_str_array(array : bytes) -> np.ndarray:
+    """
+    Flat JSON array of strings (without commas) as an array of bytes.
+    """
+    return np.char.strip(np.array(array[1:-1].split(b',')), b' \n\r\t"')
+
+
+def parse_float_array(array : bytes) -> np.ndarray:
+    """
+    Flat JSON array of numbers as a float32 array.
+    """
+    return np.fromstring(array[1:-1], dtype=np.float32, sep=',')
+
+
+def parse_float_matrix(array : bytes, rows : Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Square matrix stored as a JSON array of arrays of numbers, as a float32 array.
+    If `rows` (boolean mask) is given, only these rows are parsed.
+    """
+    body = array[1:-1].strip()
+    if rows is None:
+        values = np.fromstring(body.translate(None, b'[]'), dtype=np.float32, sep=',')
+        n = math.isqrt(len(values))
+        if n * n != len(values):
+            raise ValueError(f'Matrix is not square: {len(values):,} values')
+        return values.reshape(n, n)
+
+    # Rows are "[...]" separated by commas: split on closing brackets
+    row_arrays = body.split(b']')[:-1]
+    if len(row_arrays) != len(rows):
+        raise ValueError(f'Matrix has {len(row_arrays):,} rows, expected {len(rows):,}')
+    selected = b','.join(row_arrays[i].lstrip(b' \n\r\t,[') for i in np.flatnonzero(rows))
+    values = np.fromstring(selected, dtype=np.float32, sep=',')
+    return values.reshape(int(rows.sum()), len(rows))
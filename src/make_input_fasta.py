@@ -5,14 +5,49 @@ Parameters:
 - bait:           fasta file containing bait proteins
 - target:         fasta file containing target proteins
 - output_folder:  path to an existing folder where the results will be saved (one fasta per bait protein)
+- shard_pairs:    (optional) stream pairs into fasta shards of at most this number of pairs
+- shard_residues: (optional) stream pairs into fasta shards of at most this number of residues
+- n_shards:       (optional) split pairs into this number of fasta shards of similar estimated runtime
+- bucket_width:   (optional) width of the padding buckets of combined pair length used with n_shards
+- cost_exponent:  (optional) estimated runtime of a pair is padded_length ** cost_exponent, used with n_shards
+- gzip:           (optional) gzip compress the fasta shards
+- dedup:          (optional) only write one canonical pair per unique pair of sequences
+- msa_plan:       (optional) also write the unique chain sequences of all pairs, for a single MSA search
+
+With --shard_pairs and / or --shard_residues, pairs are written straight to disk as they are generated
+into shards {target_name}_pulldown_shard_00000.fasta, ..., each shard being sized for one GPU job.
+
+With --n_shards, pairs are grouped into padding buckets of combined bait:target length and packed into
+N shards {target_name}_pulldown_shard_00000.fasta, ... of similar total estimated runtime (see plan_shards).
+Within a shard, pairs are sorted by padded length so that ColabFold compiles the model once per bucket.
+A summary of the plan is written to {target_name}_pulldown_plan.json.
+
+With --dedup, redundant pairs are not written: pairs of the same two sequences (under other ids or in the
+other order, A:B and B:A) and pairs of a sequence with itself (unless --keep_self_pairs). The redundant pairs are
+listed in {target_name}_pair_mapping.csv along with the id of their canonical pair (empty for dropped self-pairs),
+which score_protein_complex.py and score_af3.py use (--pair_mapping) to fan scores back out to the original ids.
+
+With --msa_plan, each unique chain sequence is written once to {target_name}_unique_chains.fasta, with an id
+derived from the sequence (see get_chain_id). MSAs are then searched for these chains only (MSA work scales with
+baits + targets instead of baits x targets) and the paired inputs of each pair are assembled from the per-chain
+MSAs with src.assemble_pair_msas.
 """
 import argparse
+import gzip
+import csv
+import hashlib
+import json
 import logging
 from pathlib import Path
 import sys
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
 
+import numpy as np
 from Bio.Seq import Seq
 from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+from src.metrics import add_metrics_arguments, finish_metrics, metrics, start_profiler
 
 
 logger = logging.getLogger(__name__)
@@ -40,11 +75,79 @@ def main():
         required=True,
         help='Path to existing output folder where the resuls will be saved',
     )
+    parser.add_argument(
+        '--shard_pairs',
+        type=int,
+        required=False,
+        default=None,
+        help='Stream pairs into fasta shards of at most this number of pairs (one shard per GPU job)',
+    )
+    parser.add_argument(
+        '--shard_residues',
+        type=int,
+        required=False,
+        default=None,
+        help='Stream pairs into fasta shards of at most this total number of residues (one shard per GPU job)',
+    )
+    parser.add_argument(
+        '--n_shards',
+        type=int,
+        required=False,
+        default=None,
+        help='Split pairs into this number of fasta shards of similar estimated runtime, grouped by padded length',
+    )
+    parser.add_argument(
+        '--bucket_width',
+        type=int,
+        required=False,
+        default=10,
+        help='Width in residues of the padding buckets of combined pair length (used with --n_shards)',
+    )
+    parser.add_argument(
+        '--cost_exponent',
+        type=float,
+        required=False,
+        default=3.,
+        help='Estimated runtime of a pair is padded_length ** cost_exponent (used with --n_shards)',
+    )
+    parser.add_argument(
+        '--gzip',
+        action='store_true',
+        help='Gzip compress the fasta shards',
+    )
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        help='Only write one canonical pair per unique pair of sequences, and a mapping of redundant pair ids',
+    )
+    parser.add_argument(
+        '--keep_self_pairs',
+        action='store_true',
+        help='With --dedup, keep pairs of a sequence with itself (homodimers) instead of dropping them',
+    )
+    parser.add_argument(
+        '--msa_plan',
+        action='store_true',
+        help='Also write the unique chain sequences of all pairs to {target_name}_unique_chains.fasta for a single MSA search',
+    )
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     bait_path = args.bait
     target_path = args.target
     output_folder = args.output_folder
+    shard_pairs = args.shard_pairs
+    shard_residues = args.shard_residues
+    n_shards = args.n_shards
+    bucket_width = args.bucket_width
+    cost_exponent = args.cost_exponent
+    compress = args.gzip
+    dedup = args.dedup
+    keep_self_pairs = args.keep_self_pairs
+    msa_plan = args.msa_plan
+    metrics_out = args.metrics_out
+    profile_out = args.profile_out
+    sharded = shard_pairs is not None or shard_residues is not None
 
     if not bait_path.is_file():
         logger.error(f'Bait fasta file does not exist: {bait_path}')
@@ -55,12 +158,86 @@ def main():
     elif not output_folder.is_dir():
         logger.error(f'Output folder does not exist: {output_folder}')
         sys.exit(1)
+    elif shard_pairs is not None and shard_pairs < 1:
+        logger.error(f'--shard_pairs must be at least 1: {shard_pairs}')
+        sys.exit(1)
+    elif shard_residues is not None and shard_residues < 1:
+        logger.error(f'--shard_residues must be at least 1: {shard_residues}')
+        sys.exit(1)
+    elif n_shards is not None and sharded:
+        logger.error('--n_shards cannot be combined with --shard_pairs or --shard_residues')
+        sys.exit(1)
+    elif n_shards is not None and n_shards < 1:
+        logger.error(f'--n_shards must be at least 1: {n_shards}')
+        sys.exit(1)
+    elif bucket_width < 1:
+        logger.error(f'--bucket_width must be at least 1: {bucket_width}')
+        sys.exit(1)
+    elif compress and not sharded and n_shards is None:
+        logger.error('--gzip requires --shard_pairs, --shard_residues or --n_shards')
+        sys.exit(1)
+    elif dedup and not sharded and n_shards is None:
+        logger.error('--dedup requires --shard_pairs, --shard_residues or --n_shards')
+        sys.exit(1)
+
+    profiler = start_profiler(profile_out)
+    target_name = target_path.name.replace('.fasta', '').replace('.fa', '').replace('.faa', '')
+
+    if sharded or n_shards is not None:
+        logger.info('Loading input fasta files')
+        with metrics.timer('read_fasta'):
+            baits = read_sequences(bait_path)
+            targets = read_sequences(target_path)
+        metrics.count('baits', len(baits))
+        metrics.count('targets', len(targets))
+
+        if msa_plan:
+            write_msa_plan([*baits.values(), *targets.values()], output_folder / f'{target_name}_unique_chains.fasta')
+
+        pair_indices = None
+        if dedup:
+            with metrics.timer('dedup_pairs'):
+                pair_indices = dedup_pairs(baits, targets, output_folder / f'{target_name}_pair_mapping.csv', keep_self_pairs)
+
+        if n_shards is not None:
+            write_balanced_shards(
+                baits, 
+                targets, 
+                output_folder, 
+                f'{target_name}_pulldown', 
+                n_shards, 
+                bucket_width, 
+                cost_exponent, 
+                compress, 
+                pair_indices,
+            )
+        else:
+            n_pairs = len(baits) * len(targets) if pair_indices is None else len(pair_indices)
+            logger.info(f'Streaming {n_pairs:,} pairs into fasta shards')
+            with metrics.timer('write_shards'):
+                with FastaShardWriter(output_folder, f'{target_name}_pulldown', shard_pairs, shard_residues, compress) as writer:
+                    for pair_id, bait_seq, target_seq in iter_pairs(baits, targets, pair_indices):
+                        writer.write(pair_id, bait_seq, target_seq)
+            metrics.count('pairs', writer.n_pairs_total)
+
+            logger.info(f'Wrote {writer.n_pairs_total:,} pairs to {len(writer.shards):,} fasta shards in {output_folder}')
+        finish_metrics(metrics_out, profiler, profile_out)
+        logger.info('DONE')
+        sys.exit(0)
 
     logger.info('Loading input fasta files')
 
-    bait_dict = SeqIO.to_dict(SeqIO.parse(bait_path, 'fasta'))
-    target_dict = SeqIO.to_dict(SeqIO.parse(target_path, 'fasta'))
-    target_name = target_path.name.replace('.fasta', '').replace('.fa', '').replace('.faa', '')
+    with metrics.timer('read_fasta'):
+        bait_dict = SeqIO.to_dict(SeqIO.parse(bait_path, 'fasta'))
+        target_dict = SeqIO.to_dict(SeqIO.parse(target_path, 'fasta'))
+    metrics.count('baits', len(bait_dict))
+    metrics.count('targets', len(target_dict))
+
+    if msa_plan:
+        write_msa_plan(
+            [str(record.seq).upper() for record in [*bait_dict.values(), *target_dict.values()]],
+            output_folder / f'{target_name}_unique_chains.fasta',
+        )
 
     logger.info(f'Creating {len(bait_dict):,} pulldown fasta files')
 
@@ -68,28 +245,352 @@ def main():
         output_path = output_folder / f'{bait_id}_{target_name}_pulldown.fasta'
         logger.info(f'Writing fasta file for bait {bait_id} to {output_path} ({i+1:,} / {len(bait_dict):,})')
 
-        output_records = []
-        bait_seq = str(bait_record.seq).upper()
-        for target_id, target_record in target_dict.items():
-            target_seq = str(target_record.seq).upper()
+        with metrics.timer('build_pairs'):
+            output_records = []
+            bait_seq = str(bait_record.seq).upper()
+            for target_id, target_record in target_dict.items():
+                target_seq = str(target_record.seq).upper()
 
-            seq_id = f'{bait_id}__{target_id}'
-            seq = f'{bait_seq}:{target_seq}'
+                seq_id = f'{bait_id}__{target_id}'
+                seq = f'{bait_seq}:{target_seq}'
 
-            record = SeqIO.SeqRecord(
-                seq=Seq(seq),
-                id=seq_id,
-                name='',
-                description='',
-            )
-            output_records.append(record)
+                record = SeqIO.SeqRecord(
+                    seq=Seq(seq),
+                    id=seq_id,
+                    name='',
+                    description='',
+                )
+                output_records.append(record)
+        metrics.count('pairs', len(output_records))
         
-        with output_path.open('w') as f_out:
+        with metrics.timer('write_fasta', bait_id), output_path.open('w') as f_out:
             SeqIO.write(output_records, f_out, 'fasta')
+            metrics.count('files_written')
+            metrics.count('bytes_written', f_out.tell())
 
+    finish_metrics(metrics_out, profiler, profile_out)
     logger.info('DONE')
     sys.exit(0)
 
 
+def read_sequences(fasta_path : Path) -> Dict[str, str]:
+    """
+    Read a fasta file into a dict of id -> uppercased sequence, normalizing each sequence only once.
+    Ids are the first word of the record titles, as in SeqIO.
+    """
+    sequences = {}
+    with fasta_path.open() as f:
+        for title, seq in SimpleFastaParser(f):
+            seq_id = title.split(None, 1)[0] if title else ''
+            if seq_id in sequences:
+                raise ValueError(f'Duplicate key {seq_id!r} in {fasta_path}')
+            sequences[seq_id] = seq.upper()
+    return sequences
+
+
+def iter_pairs(
+    baits : Dict[str, str], 
+    targets : Dict[str, str], 
+    pair_indices : Optional[np.ndarray] = None,
+) -> Iterator[Tuple[str, str, str]]:
+    """
+    Generate (pair_id, bait_seq, target_seq) for all bait - target pairs, in bait then target order.
+    If `pair_indices` is given, only these pairs are generated (pair index: bait_index * n_targets + target_index).
+    """
+    target_items = list(targets.items())
+    if pair_indices is None:
+        for bait_id, bait_seq in baits.items():
+            for target_id, target_seq in target_items:
+                yield f'{bait_id}__{target_id}', bait_seq, target_seq
+        return
+
+    bait_items = list(baits.items())
+    for bi, ti in zip(*(a.tolist() for a in np.divmod(pair_indices, len(target_items)))):
+        (bait_id, bait_seq), (target_id, target_seq) = bait_items[bi], target_items[ti]
+        yield f'{bait_id}__{target_id}', bait_seq, target_seq
+
+
+def dedup_pairs(
+    baits : Dict[str, str], 
+    targets : Dict[str, str], 
+    mapping_path : Path, 
+    keep_self_pairs : bool = False,
+) -> np.ndarray:
+    """
+    Find the canonical pair of each unique (unordered) pair of sequences: the first pair in bait then target order.
+    Pairs of a sequence with itself are dropped unless `keep_self_pairs`.
+    Redundant pairs are written to `mapping_path` as id, canonical_id (empty if dropped) and swapped (1 if the
+    canonical pair has the chains in the other order).
+    Returns the sorted indices (bait_index * n_targets + target_index) of the canonical pairs.
+    """
+    # Sequences are hashed once, pairs are compared by sequence number
+    seq_numbers = {}
+    bait_numbers = np.array([seq_numbers.setdefault(seq, len(seq_numbers)) for seq in baits.values()], dtype=np.int64)
+    target_numbers = np.array([seq_numbers.setdefault(seq, len(seq_numbers)) for seq in targets.values()], dtype=np.int64)
+
+    bait_idx, target_idx = np.divmod(np.arange(len(baits) * len(targets), dtype=np.int64), len(targets))
+    seq_a, seq_b = bait_numbers[bait_idx], target_numbers[target_idx]
+    keys = np.minimum(seq_a, seq_b) * len(seq_numbers) + np.maximum(seq_a, seq_b)
+    _, first_indices, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    canonical = first_indices[inverse.reshape(-1)]
+    if not keep_self_pairs:
+        canonical[seq_a == seq_b] = -1
+
+    pair_indices = np.flatnonzero(canonical == np.arange(len(canonical)))
+    redundant = np.flatnonzero(canonical != np.arange(len(canonical)))
+
+    bait_ids, target_ids = list(baits.keys()), list(targets.keys())
+    with mapping_path.open('w', newline='') as f_out:
+        writer = csv.writer(f_out, lineterminator='\n')
+        writer.writerow(['id', 'canonical_id', 'swapped'])
+        for i, c in zip(redundant.tolist(), canonical[redundant].tolist()):
+            pair_id = f'{bait_ids[bait_idx[i]]}__{target_ids[target_idx[i]]}'
+            if c < 0:
+                writer.writerow([pair_id, '', 0])
+            else:
+                canonical_id = f'{bait_ids[bait_idx[c]]}__{target_ids[target_idx[c]]}'
+                writer.writerow([pair_id, canonical_id, int(seq_a[i] != seq_a[c])])
+    metrics.count('pairs_redundant', len(redundant))
+    metrics.count('files_written')
+
+    n_self_pairs = int((canonical < 0).sum())
+    logger.info(
+        f'Dedup: {len(pair_indices):,} canonical pairs out of {len(canonical):,} '
+        f'({len(redundant) - n_self_pairs:,} redundant pairs, {n_self_pairs:,} self-pairs dropped). '
+        f'Mapping written to {mapping_path}'
+    )
+    return pair_indices
+
+
+def get_chain_id(seq : str) -> str:
+    """
+    Id of a chain in the MSA plan, derived from its sequence so that per-chain MSAs can be reused across runs.
+    """
+    return 'chain_' + hashlib.sha256(seq.encode()).hexdigest()[:16]
+
+
+def write_msa_plan(sequences : List[str], output_path : Path) -> int:
+    """
+    Write each unique chain sequence once, under its chain id, as the input of a single MSA search.
+    Returns the number of unique chains.
+    """
+    unique_seqs = dict.fromkeys(sequences)
+
+    with metrics.timer('write_msa_plan'), output_path.open('w') as f_out:
+        for seq in unique_seqs:
+            f_out.write(f'>{get_chain_id(seq)}\n{seq}\n')
+    metrics.count('unique_chains', len(unique_seqs))
+    metrics.count('files_written')
+
+    logger.info(f'MSA plan: {len(unique_seqs):,} unique chains out of {len(sequences):,} input sequences written to {output_path}')
+    return len(unique_seqs)
+
+
+def open_fasta(path : Path, compress : bool = False) -> TextIO:
+    if compress:
+        return gzip.open(path, 'wt', compresslevel=6)
+    return path.open('w')
+
+
+def format_pair(pair_id : str, seq_a : str, seq_b : str) -> str:
+    return f'>{pair_id}\n{seq_a}:{seq_b}\n'
+
+
+def get_padded_lengths(lengths : np.ndarray, bucket_width : int) -> np.ndarray:
+    """
+    Round lengths up to the next multiple of `bucket_width`.
+    """
+    return -(-lengths // bucket_width) * bucket_width
+
+
+def plan_shards(
+    lengths : np.ndarray, 
+    n_shards : int, 
+    bucket_width : int, 
+    cost_exponent : float, 
+    bucket_tolerance : float = 0.1,
+) -> List[np.ndarray]:
+    """
+    Split pairs of combined length `lengths` into at most `n_shards` shards of similar estimated cost.
+
+    Pairs are grouped into padding buckets, the cost of a pair being padded_length ** cost_exponent.
+    Pairs sorted by padded length are cut into consecutive shards of the mean shard cost, so that
+    each shard holds as few buckets as possible and a bucket is only split at a shard boundary. 
+    A cut within `bucket_tolerance` times the mean shard cost of a bucket boundary is moved there,
+    so that small buckets are not split for a marginally better balance.
+    Returns the indices of the pairs of each shard, sorted by padded length, then input order.
+    """
+    padded = get_padded_lengths(lengths, bucket_width)
+    if len(padded) == 0:
+        return []
+    order = np.argsort(padded, kind='stable')
+    costs = padded[order].astype(float) ** cost_exponent
+    # Cumulative cost before each pair, and after the last one
+    cum_costs = np.concatenate([[0.], np.cumsum(costs)])
+    mean_cost = cum_costs[-1] / n_shards
+
+    # Positions (in sorted order) where a bucket starts or ends, and the cumulative cost there
+    bucket_bounds = np.concatenate([np.flatnonzero(np.diff(padded[order], prepend=-1)), [len(order)]])
+    bucket_bound_costs = cum_costs[bucket_bounds]
+
+    cuts = [0]
+    for i in range(1, n_shards):
+        ideal = i * mean_cost
+        # Nearest bucket boundary, otherwise nearest pair boundary
+        j = int(np.argmin(np.abs(bucket_bound_costs - ideal)))
+        if abs(bucket_bound_costs[j] - ideal) <= bucket_tolerance * mean_cost:
+            cut = int(bucket_bounds[j])
+        else:
+            cut = int(np.searchsorted(cum_costs, ideal))
+            if cut > 0 and ideal - cum_costs[cut - 1] < cum_costs[cut] - ideal:
+                cut -= 1
+        cuts.append(max(cut, cuts[-1]))
+    cuts.append(len(order))
+
+    return [order[start:end] for start, end in zip(cuts[:-1], cuts[1:]) if end > start]
+
+
+def write_balanced_shards(
+    baits : Dict[str, str],
+    targets : Dict[str, str],
+    output_folder : Path,
+    prefix : str,
+    n_shards : int,
+    bucket_width : int,
+    cost_exponent : float,
+    compress : bool = False,
+    pair_indices : Optional[np.ndarray] = None,
+):
+    """
+    Write all bait - target pairs (or only `pair_indices`, see iter_pairs) into `n_shards` fasta shards
+    of similar estimated cost (see plan_shards), along with a summary of the plan in <prefix>_plan.json.
+    """
+    bait_ids, bait_seqs = list(baits.keys()), list(baits.values())
+    target_ids, target_seqs = list(targets.keys()), list(targets.values())
+    if pair_indices is None:
+        pair_indices = np.arange(len(baits) * len(targets), dtype=np.int64)
+    bait_idx, target_idx = np.divmod(pair_indices, len(targets))
+    lengths = (
+        np.array([len(seq) for seq in bait_seqs], dtype=np.int64)[bait_idx]
+        + np.array([len(seq) for seq in target_seqs], dtype=np.int64)[target_idx]
+    )
+
+    with metrics.timer('plan_shards'):
+        shards = plan_shards(lengths, n_shards, bucket_width, cost_exponent)
+    padded = get_padded_lengths(lengths, bucket_width)
+    costs = padded.astype(float) ** cost_exponent
+    mean_cost = costs.sum() / max(len(shards), 1)
+
+    suffix = '.fasta.gz' if compress else '.fasta'
+    shard_summaries = []
+    for i, indices in enumerate(shards):
+        path = output_folder / f'{prefix}_shard_{i:05d}{suffix}'
+        with metrics.timer('write_shards', path.name), open_fasta(path, compress) as f_out:
+            for bi, ti in zip(bait_idx[indices].tolist(), target_idx[indices].tolist()):
+                f_out.write(format_pair(f'{bait_ids[bi]}__{target_ids[ti]}', bait_seqs[bi], target_seqs[ti]))
+        metrics.count('files_written')
+        metrics.count('bytes_written', path.stat().st_size)
+
+        bucket_lengths, bucket_counts = np.unique(padded[indices], return_counts=True)
+        shard_summaries.append({
+            'path': path.name,
+            'n_pairs': len(indices),
+            'n_residues': int(lengths[indices].sum()),
+            'min_length': int(lengths[indices].min()),
+            'max_length': int(lengths[indices].max()),
+            'estimated_cost': float(costs[indices].sum()),
+            'relative_cost': round(float(costs[indices].sum() / mean_cost), 4),
+            'buckets': {str(length): n for length, n in zip(bucket_lengths.tolist(), bucket_counts.tolist())},
+        })
+    metrics.count('pairs', len(lengths))
+
+    max_relative_cost = max((shard['relative_cost'] for shard in shard_summaries), default=0.)
+    plan = {
+        'n_pairs': len(lengths),
+        'n_shards': len(shards),
+        'bucket_width': bucket_width,
+        'cost_exponent': cost_exponent,
+        'n_buckets': len(np.unique(padded)),
+        'estimated_cost': float(costs.sum()),
+        'max_relative_cost': max_relative_cost,
+        'shards': shard_summaries,
+    }
+    plan_path = output_folder / f'{prefix}_plan.json'
+    with plan_path.open('w') as f_out:
+        json.dump(plan, f_out, indent=2)
+
+    logger.info(
+        f'Wrote {len(lengths):,} pairs in {plan["n_buckets"]:,} padding buckets to {len(shards):,} fasta shards '
+        f'in {output_folder}, costliest shard at {max_relative_cost:.3f}x the mean. Plan written to {plan_path}'
+    )
+
+
+class FastaShardWriter:
+    """
+    Write pairs to numbered fasta shards <prefix>_shard_00000.fasta[.gz], ..., starting a new shard
+    whenever the next pair would exceed the pair count or residue budget of the current one.
+    A single pair larger than the residue budget gets a shard of its own.
+    """
+
+    def __init__(
+        self,
+        output_folder : Path,
+        prefix : str,
+        max_pairs : Optional[int] = None,
+        max_residues : Optional[int] = None,
+        compress : bool = False,
+    ):
+        self.output_folder = output_folder
+        self.prefix = prefix
+        self.max_pairs = max_pairs
+        self.max_residues = max_residues
+        self.compress = compress
+        self.shards = []  # (path, n_pairs, n_residues) of each shard
+        self.n_pairs_total = 0
+        self._f_out = None
+        self._n_pairs = 0
+        self._n_residues = 0
+
+    def write(self, pair_id : str, seq_a : str, seq_b : str):
+        n_residues = len(seq_a) + len(seq_b)
+        if self._f_out is None or self._is_full(n_residues):
+            self._next_shard()
+
+        self._f_out.write(format_pair(pair_id, seq_a, seq_b))
+        self._n_pairs += 1
+        self._n_residues += n_residues
+        self.n_pairs_total += 1
+
+    def _is_full(self, n_residues : int) -> bool:
+        if self.max_pairs is not None and self._n_pairs + 1 > self.max_pairs:
+            return True
+        return self.max_residues is not None and self._n_residues + n_residues > self.max_residues
+
+    def _next_shard(self):
+        self.close()
+        suffix = '.fasta.gz' if self.compress else '.fasta'
+        path = self.output_folder / f'{self.prefix}_shard_{len(self.shards):05d}{suffix}'
+        self._f_out = open_fasta(path, self.compress)
+        self._n_pairs = 0
+        self._n_residues = 0
+        self.shards.append((path, 0, 0))
+
+    def close(self):
+        if self._f_out is None:
+            return
+        self._f_out.close()
+        path = self.shards[-1][0]
+        self.shards[-1] = (path, self._n_pairs, self._n_residues)
+        metrics.count('files_written')
+        metrics.count('bytes_written', path.stat().st_size)
+        self._f_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,170 @@
+"""
+Lightweight instrumentation shared by the pipeline scripts.
+
+Provides per-stage timers, counters (files, bytes, atoms, contacts, ...) and tracking of the
+slowest items of each stage, reported in the logs and optionally as JSON (--metrics_out).
+A cProfile dump of the main process can also be written (--profile_out).
+
+Metrics are recorded in a module-level `metrics` object, which threads can update concurrently.
+Work done in worker processes is recorded in the worker's own copy: wrap the worker function with
+`call_with_metrics` and merge the returned snapshot into the main process with `metrics.merge`.
+"""
+import argparse
+import collections
+import contextlib
+import cProfile
+import heapq
+import json
+import logging
+from pathlib import Path
+import resource
+import threading
+import time
+from typing import Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+
+    def __init__(self, n_slowest : int = 10):
+        self.n_slowest = n_slowest
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.timers = collections.defaultdict(lambda: [0., 0])
+        self.counters = collections.defaultdict(int)
+        self.slowest = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def timer(self, stage : str, item : Optional[str] = None):
+        """
+        Time a stage. If `item` is given, the item is a candidate for the slowest items of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, item)
+
+    def add_time(self, stage : str, seconds : float, item : Optional[str] = None, calls : int = 1):
+        with self._lock:
+            self.timers[stage][0] += seconds
+            self.timers[stage][1] += calls
+            if item is not None:
+                self._track_item(stage, seconds, item)
+
+    def _track_item(self, stage : str, seconds : float, item : str):
+        # Min-heap of the slowest items: the fastest of them is at the top
+        slowest = self.slowest[stage]
+        if len(slowest) < self.n_slowest:
+            heapq.heappush(slowest, (seconds, item))
+        elif seconds > slowest[0][0]:
+            heapq.heapreplace(slowest, (seconds, item))
+
+    def count(self, name : str, n : int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self) -> dict:
+        return {
+            'timers': {k: list(v) for k, v in self.timers.items()},
+            'counters': dict(self.counters),
+            'slowest': {k: list(v) for k, v in self.slowest.items()},
+        }
+
+    def merge(self, snapshot : dict):
+        """
+        Merge metrics recorded in another process.
+        """
+        for stage, (seconds, calls) in snapshot['timers'].items():
+            self.add_time(stage, seconds, calls=calls)
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+        for stage, items in snapshot['slowest'].items():
+            with self._lock:
+                for seconds, item in items:
+                    self._track_item(stage, seconds, item)
+
+    def report(self) -> dict:
+        return {
+            'wall_seconds': round(time.perf_counter() - self.start_time, 3),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'stages': {
+                stage: {
+                    'seconds': round(seconds, 6),
+                    'calls': calls,
+                    'mean_seconds': round(seconds / calls, 6) if calls > 0 else None,
+                    'slowest': [
+                        {'item': item, 'seconds': round(s, 6)}
+                        for s, item in sorted(self.slowest.get(stage, []), reverse=True)
+                    ],
+                }
+                for stage, (seconds, calls) in self.timers.items()
+            },
+            'counters': dict(self.counters),
+        }
+
+    def log_summary(self):
+        report = self.report()
+        logger.info(f'Wall time: {report["wall_seconds"]:,.1f} s, peak RSS: {report["peak_rss_mb"]:,.1f} MB')
+        for stage, stage_report in report['stages'].items():
+            logger.info(f'Stage {stage:<20} {stage_report["seconds"]:>10,.2f} s  ({stage_report["calls"]:,} calls)')
+        for name, n in report['counters'].items():
+            logger.info(f'Counter {name:<18} {n:>14,}')
+
+
+metrics = Metrics()
+
+
+def call_with_metrics(fn : Callable, *args):
+    """
+    Call `fn` (typically in a worker process) and return its result along with the metrics recorded during the call.
+    """
+    metrics.reset()
+    result = fn(*args)
+    return result, metrics.snapshot()
+
+
+def add_metrics_arguments(parser : argparse.ArgumentParser):
+    parser.add_argument(
+        '--metrics_out',
+        type=Path,
+        required=False,
+        default=None,
+        help='Path to JSON report of per-stage timings, counters and slowest items.',
+    )
+    parser.add_argument(
+        '--profile_out',
+        type=Path,
+        required=False,
+        default=None,
+        help='Path to cProfile dump of the main process (inspect with pstats or snakeviz).',
+    )
+
+
+def start_profiler(profile_out : Optional[Path]) -> Optional[cProfile.Profile]:
+    if profile_out is None:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def finish_metrics(metrics_out : Optional[Path], profiler : Optional[cProfile.Profile], profile_out : Optional[Path]):
+    """
+    Stop profiling, log a summary of metrics and write reports.
+    """
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_out.as_posix())
+        logger.info(f'cProfile dump written to {profile_out.resolve().as_posix()}')
+
+    metrics.log_summary()
+    if metrics_out is not None:
+        with metrics_out.open('w') as f_out:
+            json.dump(metrics.report(), f_out, indent=2)
+        logger.info(f'Metrics report written to {metrics_out.resolve().as_posix()}')
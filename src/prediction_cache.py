@@ -0,0 +1,250 @@
+"""
+Content-addressed cache of AlphaFold 3 predictions, shared by ligand pulldowns.
+
+Each prediction is keyed by a hash of the protein part of the spec (everything but the job name,
+the model seeds and the ligand), the normalized SMILES of the ligand and the model seeds. A rescreen
+of an overlapping library against the same protein spec reuses cached predictions instead of running
+AlphaFold 3 again: the cached output folder is linked (hard links, copies across filesystems) into
+the output folder under the new job name. Files holding the job name (mmCIF models and the input data JSON)
+are copied with the name rewritten instead. Linked files are made read-only, as they are shared between
+the cache and output folders: an in-place edit of one would change the other.
+
+Runs sharing a cache folder hold a shared lock on it while storing and restoring predictions, and eviction
+holds an exclusive lock. A prediction that cannot be restored (e.g. an incomplete entry) is a cache miss.
+
+SMILES are canonicalized with RDKit when it is installed, otherwise only surrounding whitespace is removed.
+
+The cache is bounded by total size and / or age of its entries: least recently used entries are evicted first.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import shutil
+import stat
+import time
+from typing import List, Optional, Tuple
+
+try:
+    from rdkit import Chem
+except ImportError:
+    Chem = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_smiles(smiles : str) -> str:
+    smiles = smiles.strip()
+    if Chem is not None:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is not None:
+            return Chem.MolToSmiles(mol)
+    return smiles
+
+
+def hash_protein_spec(spec : dict) -> str:
+    """
+    Hash of the protein part of a spec: all fields but the job name and model seeds.
+    """
+    protein_spec = {k: v for k, v in spec.items() if k not in ('name', 'modelSeeds')}
+    return hashlib.sha256(json.dumps(protein_spec, sort_keys=True).encode()).hexdigest()
+
+
+class PredictionCache:
+    """
+    Prediction output folders stored under <cache_folder>/<key[:2]>/<key>/, along with an entry.json record.
+    """
+
+    def __init__(self, cache_folder : Path, protein_hash : str):
+        self.cache_folder = Path(cache_folder)
+        self.protein_hash = protein_hash
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+
+    def key(self, smiles : str, model_seeds : List[int]) -> str:
+        content = json.dumps([self.protein_hash, normalize_smiles(smiles), list(model_seeds)])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def entry_path(self, key : str) -> Path:
+        return self.cache_folder / key[:2] / key
+
+    @contextlib.contextmanager
+    def lock(self, shared : bool = True):
+        """
+        Lock of the cache folder, shared between runs storing and restoring predictions, exclusive for eviction.
+        """
+        with (self.cache_folder / '.lock').open('a') as f_lock:
+            fcntl.flock(f_lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f_lock, fcntl.LOCK_UN)
+
+    def restore(self, key : str, job_folder : Path, job_name : Optional[str] = None) -> bool:
+        """
+        Link the cached prediction `key` into `job_folder`, renaming files after the job and rewriting 
+        the job name in files holding it (`job_name`, or the name of `job_folder` if not given).
+        Returns False on a cache miss, or if the prediction could not be restored (logged).
+        """
+        entry_path = self.entry_path(key)
+        entry_file = entry_path / 'entry.json'
+        tmp_folder = job_folder.with_name(f'{job_folder.name}.{os.getpid()}.tmp')
+        try:
+            with self.lock():
+                if not entry_file.is_file():
+                    return False
+
+                with entry_file.open() as f:
+                    cached_name = json.load(f)['job_name']
+
+                shutil.rmtree(tmp_folder, ignore_errors=True)
+                link_tree(entry_path / 'output', tmp_folder, cached_name, job_folder.name, job_name)
+
+                # Used for least recently used eviction
+                os.utime(entry_file)
+
+            shutil.rmtree(job_folder, ignore_errors=True)
+            os.replace(tmp_folder, job_folder)
+        except Exception as e:
+            logger.warning(f'Failed to restore cached prediction {key} into {job_folder}: {type(e).__name__}: {e}')
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+            return False
+        return True
+
+    def store(self, key : str, job_folder : Path):
+        """
+        Add the prediction in `job_folder` to the cache (no-op if already cached). Failures are logged.
+        """
+        entry_path = self.entry_path(key)
+        tmp_path = entry_path.with_name(f'{key}.{os.getpid()}.tmp')
+        try:
+            with self.lock():
+                if (entry_path / 'entry.json').is_file():
+                    return
+
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                link_tree(job_folder, tmp_path / 'output', read_only=True)
+                with (tmp_path / 'entry.json').open('w') as f_out:
+                    json.dump({'job_name': job_folder.name, 'created_at': time.time()}, f_out)
+
+                try:
+                    os.rename(tmp_path, entry_path)
+                except OSError:
+                    if (entry_path / 'entry.json').is_file():
+                        # Stored meanwhile by another run
+                        shutil.rmtree(tmp_path)
+                        return
+                    # Incomplete entry
+                    shutil.rmtree(entry_path)
+                    os.rename(tmp_path, entry_path)
+        except Exception as e:
+            logger.warning(f'Failed to store prediction {job_folder} in the cache: {type(e).__name__}: {e}')
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def evict(self, max_bytes : Optional[int] = None, max_age_seconds : Optional[float] = None) -> Tuple[int, int]:
+        """
+        Remove entries not used for more than `max_age_seconds`, then least recently used entries
+        until the cache holds at most `max_bytes`. Returns the number of entries and bytes removed.
+        """
+        with self.lock(shared=False):
+            return self._evict(max_bytes, max_age_seconds)
+
+    def _evict(self, max_bytes : Optional[int], max_age_seconds : Optional[float]) -> Tuple[int, int]:
+        entries = []
+        for prefix_dir in self.cache_folder.iterdir():
+            if not prefix_dir.is_dir():
+                continue
+            for entry_path in prefix_dir.iterdir():
+                entry_file = entry_path / 'entry.json'
+                if entry_file.is_file():
+                    entries.append((entry_file.stat().st_mtime, tree_size(entry_path), entry_path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        now = time.time()
+        n_removed, bytes_removed = 0, 0
+        for last_used, size, entry_path in entries:
+            too_old = max_age_seconds is not None and now - last_used > max_age_seconds
+            too_big = max_bytes is not None and total_bytes - bytes_removed > max_bytes
+            if not too_old and not too_big:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            n_removed += 1
+            bytes_removed += size
+
+        return n_removed, bytes_removed
+
+
+def link_tree(
+    src : Path, 
+    dst : Path, 
+    old_prefix : Optional[str] = None, 
+    new_prefix : Optional[str] = None,
+    job_name : Optional[str] = None,
+    read_only : bool = False,
+):
+    """
+    Recreate the tree `src` at `dst` with hard links (copies if linking fails, e.g. across filesystems).
+    File and folder names starting with `old_prefix` are renamed to start with `new_prefix`, and files holding 
+    the job name are copied with the name rewritten (see `rewrite_job_name`). Linked files are made read-only 
+    if `read_only`.
+    """
+    def rename(name):
+        if old_prefix is not None and name.startswith(old_prefix):
+            return new_prefix + name[len(old_prefix):]
+        return name
+
+    dst.mkdir(parents=True)
+    with os.scandir(src) as it:
+        for entry in it:
+            target = dst / rename(entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                link_tree(Path(entry.path), target, old_prefix, new_prefix, job_name, read_only)
+            elif old_prefix is not None and old_prefix != new_prefix and holds_job_name(entry.name):
+                rewrite_job_name(Path(entry.path), target, old_prefix, new_prefix, job_name)
+            else:
+                try:
+                    os.link(entry.path, target)
+                except OSError:
+                    shutil.copy2(entry.path, target)
+                if read_only:
+                    mode = os.stat(target).st_mode
+                    os.chmod(target, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def holds_job_name(file_name : str) -> bool:
+    """
+    AlphaFold 3 output files holding the job name: mmCIF models (data_<job> block) and the input data JSON.
+    """
+    return file_name.endswith('.cif') or file_name.endswith('_data.json')
+
+
+def rewrite_job_name(src : Path, dst : Path, old_name : str, new_name : str, job_name : Optional[str] = None):
+    """
+    Copy `src` to `dst`, replacing the (sanitised) job name `old_name` by `new_name` in mmCIF files,
+    and setting the name of data JSON files to `job_name` (`new_name` if not given).
+    """
+    if src.name.endswith('_data.json'):
+        with src.open() as f:
+            data = json.load(f)
+        data['name'] = job_name if job_name is not None else new_name
+        with dst.open('w') as f_out:
+            json.dump(data, f_out, indent=2)
+    else:
+        name_re = re.compile(rb'(?<![A-Za-z0-9.-])' + re.escape(old_name.encode()) + rb'(?![\w.-])')
+        dst.write_bytes(name_re.sub(new_name.encode(), src.read_bytes()))
+
+
+def tree_size(path : Path) -> int:
+    size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                size += tree_size(Path(entry.path))
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
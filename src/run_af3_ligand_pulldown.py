@@ -15,20 +15,61 @@ Arguments:
 
 Generate a new JSON spec per ligand and runs AF3.
 
-NOTE: a way to specify MSA as external files is available in the input template version 2. Not released yet.
-TODO: use template version 2 when released.
+Specs are split into shards (--n_shards, one per slot by default), or with --batch_size the ligands CSV is
+streamed in batches of fixed size, each batch being a shard. Specs of a shard are written right before it 
+runs and deleted once it completes. Up to --slots `alphafold` processes are run at once, optionally each
+on its own GPU (--gpu_ids). The output of each shard is logged to 
+<output_folder>/logs/shard_<i>.log (appended to by each run). Ligands without a predicted model at the end of the run are reported 
+as failed, and listed in <output_folder>/failed_ligands.txt.
+
+Each run appends to a run manifest (JSON lines, <output_folder>/run_manifest.jsonl by default): 
+the SMILES and model seeds of every submitted ligand, then whether it was predicted. With --resume, ligands 
+already predicted (done in the manifest, or with a model in the output folder) are skipped, and the others 
+are predicted again with the seeds recorded in the manifest. New seeds are only drawn, and recorded, for 
+ligands never submitted before or submitted with another number of models.
+
+The output folder of each submitted ligand is cleared right before its shard runs, so that AlphaFold 3 writes 
+to <job>/ (not <job>_<timestamp>/) and only models predicted by the run count as predicted. Folders without 
+a model (left by failed runs) are removed. Folders with a model are moved aside to <job>_<timestamp>/, 
+unless --resume or --overwrite is given, in which case they are removed.
+
+The shared part of the specs (protein chains with their MSAs and templates) is serialized once, and only the 
+per ligand fields (name, model seeds and ligand) are spliced in for each ligand. Specs are written as compact JSON.
+With --msa_files, MSAs are written once to external files referenced by the specs (input format version 2), 
+so that specs only hold the ligand and paths to the shared MSAs.
+
+AlphaFold 3 compiles its model once per token bucket (inputs are padded to the next bucket size). With 
+--group_by_bucket, the number of tokens of each spec is estimated (protein and other chains of the base spec, 
+plus one token per heavy atom of the ligand) and ligands are grouped into shards of a single bucket, so that 
+each AlphaFold 3 process compiles the model once. The histogram of buckets is logged before the run starts.
+
+With --cache_folder, predictions are stored in a content-addressed cache (see prediction_cache.py) and ligands 
+already predicted against the same protein spec, with the same SMILES and seeds, are linked from the cache into 
+the output folder instead of being run. Model seeds are then derived from the protein spec and the SMILES, 
+so that they are the same in every run.
 """
 import argparse
-import copy
+import collections
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 import csv
 import json
 import logging
+import math
+import os
 from pathlib import Path
+import queue
 import random
+import re
 import shutil
 import subprocess
 import sys
 import tempfile
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from src.metrics import add_metrics_arguments, finish_metrics, metrics, start_profiler
+from src.prediction_cache import PredictionCache, hash_protein_spec, normalize_smiles
+from src.score_af3 import sanitise_job_name
 
 
 logger = logging.getLogger(__name__)
@@ -75,6 +116,93 @@ def main():
         default=1,
         help='Path to output folder where structures will be saved.',
     )
+    parser.add_argument(
+        '--slots', 
+        type=int,
+        required=False,
+        default=1,
+        help='Maximum number of AlphaFold 3 processes running at once.',
+    )
+    parser.add_argument(
+        '--n_shards', 
+        type=int,
+        required=False,
+        default=None,
+        help='Number of shards the ligands are split into, each run by one AlphaFold 3 process (default: number of slots).',
+    )
+    parser.add_argument(
+        '--gpu_ids', 
+        type=str,
+        required=False,
+        default=None,
+        help='Comma separated GPU IDs, one per slot (sets CUDA_VISIBLE_DEVICES of each AlphaFold 3 process).',
+    )
+    parser.add_argument(
+        '--resume', 
+        action='store_true',
+        help='Skip ligands already predicted in the output folder and reuse the model seeds of previous runs.',
+    )
+    parser.add_argument(
+        '--overwrite', 
+        action='store_true',
+        help='Remove models of earlier runs of submitted ligands (default: move them aside to <job>_<timestamp>/).',
+    )
+    parser.add_argument(
+        '--manifest_path', 
+        type=Path,
+        required=False,
+        default=None,
+        help='Path to the run manifest (default: <output_folder>/run_manifest.jsonl).',
+    )
+    parser.add_argument(
+        '--msa_files', 
+        action='store_true',
+        help='Write MSAs once to external files referenced by the specs (requires AlphaFold 3 >= 3.0.1).',
+    )
+    parser.add_argument(
+        '--batch_size', 
+        type=int,
+        required=False,
+        default=None,
+        help=(
+            'Stream the ligands CSV and run AlphaFold 3 on batches of this many ligands, '
+            'with at most one batch of specs on disk per slot (default: load all ligands and split them into shards).'
+        ),
+    )
+    parser.add_argument(
+        '--group_by_bucket', 
+        action='store_true',
+        help='Group ligands into shards of specs of the same AlphaFold 3 token bucket (one compilation per process).',
+    )
+    parser.add_argument(
+        '--buckets', 
+        type=str,
+        required=False,
+        default=','.join(str(b) for b in AF3_BUCKETS),
+        help='Comma separated token bucket sizes, matching alphafold --buckets (default: AlphaFold 3 defaults).',
+    )
+    parser.add_argument(
+        '--cache_folder', 
+        type=Path,
+        required=False,
+        default=None,
+        help='Path to prediction cache folder (created if missing), shared between pulldowns.',
+    )
+    parser.add_argument(
+        '--cache_max_gb', 
+        type=float,
+        required=False,
+        default=None,
+        help='Evict least recently used predictions from the cache above this size (in GB).',
+    )
+    parser.add_argument(
+        '--cache_max_age_days', 
+        type=float,
+        required=False,
+        default=None,
+        help='Evict predictions not used for this many days from the cache.',
+    )
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     spec_path = args.spec_path
@@ -83,6 +211,21 @@ def main():
     smiles_col = args.smiles_col
     output_folder = args.output_folder
     n_models = args.n_models
+    slots = args.slots
+    n_shards = args.n_shards if args.n_shards is not None else args.slots
+    gpu_ids = args.gpu_ids.split(',') if args.gpu_ids is not None else None
+    resume = args.resume
+    overwrite = args.overwrite or args.resume
+    msa_files = args.msa_files
+    batch_size = args.batch_size
+    group_by_bucket = args.group_by_bucket
+    buckets = sorted(int(b) for b in args.buckets.split(','))
+    cache_folder = args.cache_folder
+    cache_max_gb = args.cache_max_gb
+    cache_max_age_days = args.cache_max_age_days
+    manifest_path = args.manifest_path if args.manifest_path is not None else args.output_folder / 'run_manifest.jsonl'
+    metrics_out = args.metrics_out
+    profile_out = args.profile_out
 
     if not spec_path.is_file():
         logger.error(f'Spec path does not exist: {spec_path}')
@@ -93,61 +236,618 @@ def main():
     elif not output_folder.is_dir():
         logger.error(f'Output folder does not exist: {output_folder}')
         sys.exit(1)
+    elif slots < 1:
+        logger.error(f'Number of slots must be at least 1: {slots}')
+        sys.exit(1)
+    elif n_shards < 1:
+        logger.error(f'Number of shards must be at least 1: {n_shards}')
+        sys.exit(1)
+    elif batch_size is not None and batch_size < 1:
+        logger.error(f'Batch size must be at least 1: {batch_size}')
+        sys.exit(1)
+    elif cache_folder is None and (cache_max_gb is not None or cache_max_age_days is not None):
+        logger.error('Cache eviction limits require a cache folder (--cache_folder)')
+        sys.exit(1)
+    elif gpu_ids is not None and len(gpu_ids) != slots:
+        logger.error(f'Number of GPU IDs ({len(gpu_ids)}) must match the number of slots ({slots})')
+        sys.exit(1)
+
+    profiler = start_profiler(profile_out)
 
-    with spec_path.open() as f:
+    with metrics.timer('read_spec'), spec_path.open() as f:
         spec = json.load(f)
+    base_name = spec['name']
+
+    cache, protein_hash = None, None
+    if cache_folder is not None:
+        protein_hash = hash_protein_spec(spec)
+        cache = PredictionCache(cache_folder, protein_hash)
+        logger.info(f'Prediction cache folder: {cache_folder.resolve().as_posix()}')
+
+    manifest = read_run_manifest(manifest_path)
 
-    ligands_dict = parse_ligands_csv(ligands_path, id_col, smiles_col)
+    def prepare_ligands(ligands_dict):
+        """
+        Skip ligands already predicted (--resume), assign model seeds and link cached predictions.
+        Returns the ligands left to predict along with their model seeds, recorded as submitted in the manifest.
+        """
+        if resume:
+            with metrics.timer('resume'):
+                done_ids = get_done_ligands(base_name, ligands_dict, manifest, output_folder)
+            metrics.count('ligands_skipped', len(done_ids))
+            ligands_dict = {k: v for k, v in ligands_dict.items() if k not in done_ids}
 
+        model_seeds = assign_model_seeds(ligands_dict, manifest if resume else {}, n_models, protein_hash)
+
+        if cache is not None:
+            with metrics.timer('clear_job_folders'):
+                clear_job_folders(base_name, ligands_dict, output_folder, overwrite)
+            with metrics.timer('cache_restore'):
+                cached_ids = {
+                    k for k, v in ligands_dict.items()
+                    if cache.restore(
+                        cache.key(v, model_seeds[k]), get_job_folder(base_name, k, output_folder), get_job_name(base_name, k),
+                    )
+                }
+            metrics.count('ligands_cached', len(cached_ids))
+            append_run_manifest(manifest_path, [
+                {'ligand_id': k, 'smiles': ligands_dict[k], 'model_seeds': model_seeds[k], 'status': 'done', 'cached': True}
+                for k in cached_ids
+            ])
+            ligands_dict = {k: v for k, v in ligands_dict.items() if k not in cached_ids}
+
+        append_run_manifest(manifest_path, [
+            {'ligand_id': k, 'smiles': v, 'model_seeds': model_seeds[k], 'status': 'submitted'}
+            for k, v in ligands_dict.items()
+        ])
+        return ligands_dict, model_seeds
+
+    n_base_tokens = count_spec_tokens(spec)
+    if group_by_bucket:
+        logger.info(f'Number of tokens of the base spec: {n_base_tokens:,}')
+
+    if batch_size is None:
+        with metrics.timer('read_ligands'):
+            ligands_dict = parse_ligands_csv(ligands_path, id_col, smiles_col)
+        ligands_dict, model_seeds = prepare_ligands(ligands_dict)
+        logger.info(f'Number of ligands to predict: {len(ligands_dict):,}')
+        if group_by_bucket:
+            log_bucket_histogram(ligands_dict.items(), n_base_tokens, buckets)
+            shard_size = max(math.ceil(len(ligands_dict) / n_shards), 1)
+            shards = (
+                Shard(i, batch, {k: model_seeds[k] for k in batch}, bucket)
+                for i, (bucket, batch) in enumerate(group_by_buckets(ligands_dict.items(), n_base_tokens, buckets, shard_size))
+            )
+        else:
+            shards = (
+                Shard(i, batch, {k: model_seeds[k] for k in batch})
+                for i, batch in enumerate(split_shards(ligands_dict, n_shards))
+            )
+    else:
+        logger.info(f'Streaming ligands in batches of {batch_size:,}')
+        ligands = iter_ligands_csv(ligands_path, id_col, smiles_col)
+        if group_by_bucket:
+            # Quick first pass over the CSV for the histogram, before any prediction
+            log_bucket_histogram(iter_ligands_csv(ligands_path, id_col, smiles_col, record=False), n_base_tokens, buckets)
+            shards = (
+                Shard(i, *prepare_ligands(batch), bucket)
+                for i, (bucket, batch) in enumerate(group_by_buckets(ligands, n_base_tokens, buckets, batch_size))
+            )
+        else:
+            shards = (
+                Shard(i, *prepare_ligands(batch))
+                for i, batch in enumerate(iter_batches(ligands, batch_size))
+            )
+    shards = (shard for shard in shards if len(shard.ligands) > 0)
+
+    logs_folder = output_folder / 'logs'
+    logs_folder.mkdir(exist_ok=True)
+
+    failed_ligands, n_shards_run, n_shards_failed = [], 0, 0
     tempdir = Path(tempfile.mkdtemp())
     try:
-        save_json_specs(spec, ligands_dict, tempdir, n_models)
-        returncode = run_af3(tempdir, output_folder)
+        if msa_files:
+            msa_folder = tempdir / 'msas'
+            msa_folder.mkdir()
+            spec = externalize_msas(spec, msa_folder)
+        spec_template = make_spec_template(spec)
+
+        logger.info(f'Running AlphaFold 3 with {slots:,} slots')
+        with metrics.timer('alphafold'):
+            results = run_af3_shards(
+                shards, spec_template, base_name, tempdir, output_folder, logs_folder, slots, gpu_ids, overwrite,
+            )
+            for result in results:
+                n_shards_run += 1
+                n_shards_failed += int(result.returncode != 0)
+                failed_ligands.extend(result.failed_ligand_ids)
+                failed_ids = set(result.failed_ligand_ids)
+                append_run_manifest(manifest_path, [
+                    {'ligand_id': k, 'smiles': v, 'status': 'failed' if k in failed_ids else 'done'}
+                    for k, v in result.shard.ligands.items()
+                ])
+                if cache is not None:
+                    with metrics.timer('cache_store'):
+                        for k, v in result.shard.ligands.items():
+                            if k not in failed_ids:
+                                cache.store(cache.key(v, result.shard.model_seeds[k]), get_job_folder(base_name, k, output_folder))
     finally:
         shutil.rmtree(tempdir)
 
-    if returncode == 0:
+    if cache is not None:
+        logger.info(f'Number of ligands linked from the prediction cache: {metrics.counters.get("ligands_cached", 0):,}')
+        if cache_max_gb is not None or cache_max_age_days is not None:
+            with metrics.timer('cache_evict'):
+                n_evicted, bytes_evicted = cache.evict(
+                    max_bytes=int(cache_max_gb * 1e9) if cache_max_gb is not None else None,
+                    max_age_seconds=cache_max_age_days * 86400 if cache_max_age_days is not None else None,
+                )
+            logger.info(f'Evicted {n_evicted:,} predictions ({bytes_evicted / 1e9:,.2f} GB) from the prediction cache')
+
+    n_skipped = metrics.counters.get('ligands_skipped', 0)
+    n_seeds_reused = metrics.counters.get('ligands_seeds_reused', 0)
+    n_reseeded = metrics.counters.get('ligands_reseeded', 0)
+    if resume:
+        logger.info(f'Number of ligands already predicted: {n_skipped:,}')
+    if n_seeds_reused > 0:
+        logger.info(f'Number of ligands predicted again with the seeds of a previous run: {n_seeds_reused:,}')
+    if n_reseeded > 0:
+        logger.warning(f'Number of ligands with new seeds (number of models changed): {n_reseeded:,}')
+    report_failed_ligands(failed_ligands, n_shards_failed, n_shards_run, output_folder)
+
+    finish_metrics(metrics_out, profiler, profile_out)
+
+    if len(failed_ligands) == 0:
         logger.info('DONE')
+        sys.exit(0)
     else:
         logger.error('DONE with errors')
+        sys.exit(1)
 
-    sys.exit(returncode)
 
+class Shard(NamedTuple):
+    index       : int
+    ligands     : Dict[str, str]
+    model_seeds : Dict[str, List[int]]
+    bucket      : Optional[int] = None
 
-def save_json_specs(base_spec, ligands_dict, specs_dir, n_models):
-    for ligand_id, ligand_smiles in ligands_dict.items():
-        spec = copy.deepcopy(base_spec)
-        spec['name'] = base_spec['name'] + f'__{ligand_id}'
-        spec['modelSeeds'] = gen_model_seeds(n_models)
 
-        ligand_spec = {
-            'ligand': {
-                'id': 'Z',
-                'smiles': ligand_smiles,
-            }
-        }
-        spec['sequences'].append(ligand_spec)
-
-        with (specs_dir / f'{ligand_id}.json').open('w') as f_out:
-            json.dump(spec, f_out, indent=True)
-
-
-def run_af3(specs_dir, output_folder):
-    result = subprocess.run(
-        [
-            'alphafold',
-            '--input_dir', specs_dir.resolve().as_posix(),
-            '--output_dir', output_folder.resolve().as_posix(),
-            '--norun_data_pipeline',
-        ],
-        stdout=sys.stdout, 
-        stderr=sys.stderr,
+class ShardResult(NamedTuple):
+    shard             : Shard
+    returncode        : int
+    failed_ligand_ids : List[str]
+    log_path          : Path
+    seconds           : float
+
+
+def split_shards(ligands_dict, n_shards):
+    """
+    Split ligands into at most `n_shards` contiguous shards of (nearly) equal size.
+    """
+    ligand_ids = list(ligands_dict.keys())
+    n_shards = min(n_shards, len(ligand_ids))
+    shards = []
+    for i in range(n_shards):
+        start = i * len(ligand_ids) // n_shards
+        end = (i + 1) * len(ligand_ids) // n_shards
+        shards.append({ligand_id: ligands_dict[ligand_id] for ligand_id in ligand_ids[start:end]})
+    return shards
+
+
+def iter_batches(ligands, batch_size) -> Iterator[Dict[str, str]]:
+    """
+    Group (ligand_id, smiles) pairs into dicts of `batch_size` ligands.
+    """
+    batch = {}
+    for ligand_id, smiles in ligands:
+        batch[ligand_id] = smiles
+        if len(batch) == batch_size:
+            yield batch
+            batch = {}
+    if len(batch) > 0:
+        yield batch
+
+
+# Default token buckets of AlphaFold 3 (alphafold --buckets)
+AF3_BUCKETS = [256, 512, 768, 1024, 1280, 1536, 2048, 2560, 3072, 3584, 4096, 4608, 5120]
+
+# Atoms of a SMILES string: bracket atoms, then two-letter and one-letter atoms of the organic subset
+SMILES_ATOM_RE = re.compile(r'\[([^\]]+)\]|Br|Cl|[BCNOPSFI]|[bcnops]')
+BRACKET_HYDROGEN_RE = re.compile(r'^\d*H(?![a-z])')
+
+
+def count_heavy_atoms(smiles):
+    """
+    Number of heavy (non hydrogen) atoms of a SMILES string.
+    """
+    n_atoms = 0
+    for match in SMILES_ATOM_RE.finditer(smiles):
+        bracket_atom = match[1]
+        if bracket_atom is None or BRACKET_HYDROGEN_RE.match(bracket_atom) is None:
+            n_atoms += 1
+    return n_atoms
+
+
+def count_spec_tokens(spec):
+    """
+    Estimated number of tokens of a spec: one per residue of protein, DNA and RNA chains, one per heavy atom
+    of ligands given as SMILES, times the number of copies of each chain. Ligands given as CCD codes are not counted.
+    """
+    n_tokens = 0
+    for entry in spec['sequences']:
+        for kind, chain in entry.items():
+            n_copies = len(chain['id']) if isinstance(chain['id'], list) else 1
+            if 'sequence' in chain:
+                n_tokens += n_copies * len(chain['sequence'])
+            elif 'smiles' in chain:
+                n_tokens += n_copies * count_heavy_atoms(chain['smiles'])
+    return n_tokens
+
+
+def get_bucket(n_tokens, buckets):
+    """
+    Smallest bucket holding `n_tokens` (inputs larger than the largest bucket are not padded).
+    """
+    for bucket in buckets:
+        if n_tokens <= bucket:
+            return bucket
+    return n_tokens
+
+
+def group_by_buckets(ligands, n_base_tokens, buckets, batch_size) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """
+    Group (ligand_id, smiles) pairs into (bucket, ligands) batches of up to `batch_size` ligands of the same bucket.
+    A batch is yielded as soon as it is full; incomplete batches are yielded at the end, by bucket size.
+    """
+    pending = collections.defaultdict(dict)
+    for ligand_id, smiles in ligands:
+        bucket = get_bucket(n_base_tokens + count_heavy_atoms(smiles), buckets)
+        pending[bucket][ligand_id] = smiles
+        if len(pending[bucket]) >= batch_size:
+            yield bucket, pending.pop(bucket)
+
+    for bucket in sorted(pending.keys()):
+        yield bucket, pending[bucket]
+
+
+def log_bucket_histogram(ligands, n_base_tokens, buckets):
+    histogram = collections.Counter(
+        get_bucket(n_base_tokens + count_heavy_atoms(smiles), buckets) for _, smiles in ligands
+    )
+    logger.info(f'Expected token buckets of specs ({len(histogram):,} buckets):')
+    for bucket in sorted(histogram.keys()):
+        logger.info(f'Bucket {bucket:>6,}: {histogram[bucket]:>10,} ligands')
+
+
+def run_af3_shards(
+    shards, 
+    spec_template, 
+    base_name, 
+    specs_folder, 
+    output_folder, 
+    logs_folder, 
+    slots, 
+    gpu_ids=None,
+    overwrite=False,
+) -> Iterator[ShardResult]:
+    """
+    Run AlphaFold 3 on each shard, with up to `slots` processes at once, and yield results as shards complete.
+    Each running process holds a slot (and the GPU of that slot, if `gpu_ids` is given).
+
+    Shards are pulled from the `shards` iterator only when a slot is free, and the specs of a shard are 
+    written right before it runs and deleted once it completes: at most `slots` shards of specs are on disk.
+    Output folders of the shard's jobs are cleared before it runs (see `clear_job_folders`).
+    """
+    free_slots = queue.Queue()
+    for slot in range(slots):
+        free_slots.put(slot)
+
+    def run_shard(shard):
+        slot = free_slots.get()
+        specs_dir = specs_folder / f'shard_{shard.index:04d}'
+        try:
+            with metrics.timer('write_specs'):
+                specs_dir.mkdir()
+                save_json_specs(spec_template, base_name, shard.ligands, specs_dir, shard.model_seeds)
+            with metrics.timer('clear_job_folders'):
+                clear_job_folders(base_name, shard.ligands, output_folder, overwrite)
+
+            env = None
+            if gpu_ids is not None:
+                env = {**os.environ, 'CUDA_VISIBLE_DEVICES': gpu_ids[slot]}
+
+            log_path = logs_folder / f'shard_{shard.index:04d}.log'
+            bucket_info = f', bucket {shard.bucket:,}' if shard.bucket is not None else ''
+            logger.info(
+                f'Shard {shard.index:,}: running {len(shard.ligands):,} ligands in slot {slot}{bucket_info} (log: {log_path})'
+            )
+            start = time.perf_counter()
+            returncode = run_af3(specs_dir, output_folder, log_path, env)
+            seconds = time.perf_counter() - start
+            metrics.add_time('alphafold_shard', seconds, item=f'shard_{shard.index:04d}')
+
+            if returncode == 0:
+                logger.info(f'Shard {shard.index:,}: done in {seconds:,.1f} s')
+            else:
+                logger.error(f'Shard {shard.index:,}: alphafold exited with code {returncode} (see {log_path})')
+
+            failed_ligand_ids = [
+                ligand_id for ligand_id in shard.ligands
+                if not is_ligand_done(base_name, ligand_id, output_folder)
+            ]
+            return ShardResult(shard, returncode, failed_ligand_ids, log_path, seconds)
+        finally:
+            shutil.rmtree(specs_dir, ignore_errors=True)
+            free_slots.put(slot)
+
+    with ThreadPoolExecutor(max_workers=slots) as executor:
+        pending = set()
+        for shard in shards:
+            if len(pending) >= slots:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(run_shard, shard))
+
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def report_failed_ligands(failed_ligands, n_shards_failed, n_shards, output_folder):
+    """
+    Log ligands without a predicted model and write them to failed_ligands.txt.
+    """
+    failed_path = output_folder / 'failed_ligands.txt'
+    if len(failed_ligands) == 0:
+        failed_path.unlink(missing_ok=True)
+        return
+
+    logger.error(
+        f'Number of failed ligands: {len(failed_ligands):,} '
+        f'(failed shards: {n_shards_failed:,} / {n_shards:,})'
+    )
+    for ligand_id in failed_ligands[:20]:
+        logger.error(f'Failed ligand: {ligand_id}')
+    with failed_path.open('w') as f_out:
+        for ligand_id in failed_ligands:
+            f_out.write(f'{ligand_id}\n')
+    logger.error(f'Failed ligands written to {failed_path.resolve().as_posix()}')
+
+
+def get_job_name(base_name, ligand_id):
+    return base_name + f'__{ligand_id}'
+
+
+def get_job_folder(base_name, ligand_id, output_folder):
+    """
+    Output folder of a job, named by AlphaFold 3 after the sanitised job name.
+    """
+    return output_folder / sanitise_job_name(get_job_name(base_name, ligand_id))
+
+
+def clear_job_folders(base_name, ligand_ids, output_folder, overwrite=False):
+    """
+    Clear the output folders of jobs about to be run. Folders without a model, left by failed runs, are removed.
+    Folders with a model of an earlier run are removed if `overwrite`, and moved aside to <job>_<timestamp>/ otherwise.
+
+    AlphaFold 3 writes <job>_data.json before inference, and writes into <job>_<timestamp>/ instead of 
+    <job>/ if the latter is not empty. Without clearing, a resubmitted ligand would be predicted into 
+    a folder that is never checked, and a model left by an earlier run would count as predicted by this one.
+    """
+    for ligand_id in ligand_ids:
+        job_folder = get_job_folder(base_name, ligand_id, output_folder)
+        if job_folder.is_symlink() or job_folder.is_file():
+            job_folder.unlink()
+        elif not job_folder.is_dir():
+            continue
+        elif overwrite or not is_ligand_done(base_name, ligand_id, output_folder):
+            shutil.rmtree(job_folder)
+        else:
+            moved_folder = get_moved_job_folder(job_folder)
+            job_folder.rename(moved_folder)
+            logger.warning(f'Moved earlier prediction of ligand {ligand_id} to {moved_folder}')
+            metrics.count('job_folders_moved')
+            continue
+        metrics.count('job_folders_cleared')
+
+
+def get_moved_job_folder(job_folder):
+    """
+    Unused <job>_<timestamp>/ folder, named like the folders AlphaFold 3 writes to when <job>/ is not empty.
+    """
+    timestamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(job_folder.stat().st_mtime))
+    moved_folder = job_folder.with_name(f'{job_folder.name}_{timestamp}')
+    i = 1
+    while moved_folder.exists():
+        moved_folder = job_folder.with_name(f'{job_folder.name}_{timestamp}_{i}')
+        i += 1
+    return moved_folder
+
+
+def is_ligand_done(base_name, ligand_id, output_folder):
+    job_folder = get_job_folder(base_name, ligand_id, output_folder)
+    return (job_folder / f'{job_folder.name}_model.cif').is_file()
+
+
+def read_run_manifest(manifest_path):
+    """
+    Latest state of each ligand in the run manifest: {ligand_id: record}, where the record holds the SMILES, 
+    the status ('submitted', 'done' or 'failed') and the model seeds of the latest submission.
+    """
+    manifest = {}
+    if not manifest_path.is_file():
+        return manifest
+
+    with manifest_path.open() as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Truncated last line of an interrupted run
+                logger.warning(f'Skipping malformed line in run manifest {manifest_path}')
+                continue
+            ligand_id = record['ligand_id']
+            if 'model_seeds' not in record and ligand_id in manifest:
+                record['model_seeds'] = manifest[ligand_id].get('model_seeds')
+            manifest[ligand_id] = record
+
+    return manifest
+
+
+def append_run_manifest(manifest_path, records):
+    timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with manifest_path.open('a') as f_out:
+        for record in records:
+            f_out.write(json.dumps({**record, 'time': timestamp}) + '\n')
+
+
+def get_done_ligands(base_name, ligands_dict, manifest, output_folder):
+    """
+    Ligands already predicted: done in the run manifest (with the same SMILES), or with a model in the output folder.
+    """
+    done_ids = set()
+    for ligand_id, smiles in ligands_dict.items():
+        record = manifest.get(ligand_id)
+        if record is not None and record.get('smiles') != smiles:
+            logger.warning(f'SMILES of ligand {ligand_id} changed since it was submitted: predicting again')
+        elif record is not None and record.get('status') == 'done':
+            done_ids.add(ligand_id)
+        elif is_ligand_done(base_name, ligand_id, output_folder):
+            done_ids.add(ligand_id)
+    return done_ids
+
+
+def assign_model_seeds(ligands_dict, manifest, n_models, protein_hash=None):
+    """
+    Model seeds of each ligand: seeds of its previous submission in the manifest if any, new seeds otherwise.
+    If `protein_hash` is given, new seeds are derived from the protein spec and the SMILES (reproducible).
+    """
+    model_seeds = {}
+    for ligand_id, smiles in ligands_dict.items():
+        record = manifest.get(ligand_id)
+        seeds = record.get('model_seeds') if record is not None and record.get('smiles') == smiles else None
+        if seeds is not None and len(seeds) == n_models:
+            metrics.count('ligands_seeds_reused')
+        else:
+            if seeds is not None:
+                metrics.count('ligands_reseeded')
+            seed_key = f'{protein_hash}:{normalize_smiles(smiles)}' if protein_hash is not None else None
+            seeds = gen_model_seeds(n_models, seed_key)
+        model_seeds[ligand_id] = seeds
+    return model_seeds
+
+
+SPEC_FIELDS_RE = re.compile(r'"@@(name|modelSeeds|ligand)@@"')
+
+
+def make_spec_template(base_spec) -> List:
+    """
+    Serialize the base spec once, as compact JSON split around the per ligand fields.
+
+    The template alternates encoded JSON chunks and field names ('name', 'modelSeeds', 'ligand'), 
+    e.g. [b'{"name":', 'name', b',"sequences":[...,', 'ligand', b'],"modelSeeds":', 'modelSeeds', b',...}'].
+    """
+    spec = {
+        **base_spec,
+        'name': '@@name@@',
+        'modelSeeds': '@@modelSeeds@@',
+        'sequences': [*base_spec['sequences'], '@@ligand@@'],
+    }
+    text = json.dumps(spec, separators=(',', ':'))
+    parts = SPEC_FIELDS_RE.split(text)
+    if sorted(parts[1::2]) != ['ligand', 'modelSeeds', 'name']:
+        raise ValueError('Base spec contains reserved placeholders')
+
+    return [part if i % 2 == 1 else part.encode() for i, part in enumerate(parts)]
+
+
+def render_spec(spec_template, fields : Dict[str, object]) -> bytes:
+    return b''.join(
+        part if isinstance(part, bytes) else json.dumps(fields[part], separators=(',', ':')).encode()
+        for part in spec_template
     )
+
+
+def save_json_specs(spec_template, base_name, ligands_dict, specs_dir, model_seeds):
+    for ligand_id, ligand_smiles in ligands_dict.items():
+        spec = render_spec(spec_template, {
+            'name': get_job_name(base_name, ligand_id),
+            'modelSeeds': model_seeds[ligand_id],
+            'ligand': {
+                'ligand': {
+                    'id': 'Z',
+                    'smiles': ligand_smiles,
+                }
+            },
+        })
+
+        with (specs_dir / f'{ligand_id}.json').open('wb') as f_out:
+            f_out.write(spec)
+        metrics.count('files_written')
+        metrics.count('bytes_written', len(spec))
+
+
+def externalize_msas(base_spec, msa_folder):
+    """
+    Write the MSAs of protein chains to files in `msa_folder` and return a spec referencing them
+    (`unpairedMsaPath` / `pairedMsaPath`, input format version 2).
+    """
+    sequences = []
+    for entry in base_spec['sequences']:
+        protein = entry.get('protein')
+        if protein is None:
+            sequences.append(entry)
+            continue
+
+        protein = dict(protein)
+        chain_ids = protein['id'] if isinstance(protein['id'], list) else [protein['id']]
+        for key in ['unpairedMsa', 'pairedMsa']:
+            if protein.get(key) is not None:
+                msa_path = msa_folder / f'{"_".join(chain_ids)}_{key}.a3m'
+                msa_path.write_text(protein.pop(key))
+                protein[f'{key}Path'] = msa_path.resolve().as_posix()
+        sequences.append({**entry, 'protein': protein})
+
+    return {
+        **base_spec, 
+        'sequences': sequences, 
+        'version': max(base_spec.get('version', 1), 2),
+    }
+
+
+def run_af3(specs_dir, output_folder, log_path=None, env=None):
+    """
+    Run AlphaFold 3 on a folder of specs. Output is appended to `log_path` if given, written to stdout / stderr otherwise.
+    """
+    cmd = [
+        'alphafold',
+        '--input_dir', specs_dir.resolve().as_posix(),
+        '--output_dir', output_folder.resolve().as_posix(),
+        '--norun_data_pipeline',
+    ]
+    if log_path is None:
+        result = subprocess.run(cmd, stdout=sys.stdout, stderr=sys.stderr, env=env)
+    else:
+        with open(log_path, 'a') as f_log:
+            f_log.write(f'# {time.strftime("%Y-%m-%dT%H:%M:%S")} {" ".join(cmd)}\n')
+            f_log.flush()
+            result = subprocess.run(cmd, stdout=f_log, stderr=subprocess.STDOUT, env=env)
     return result.returncode
 
 
 def parse_ligands_csv(ligands_path, id_col, smiles_col):
-    ligands_dict = {}
+    return dict(iter_ligands_csv(ligands_path, id_col, smiles_col))
+
+
+def iter_ligands_csv(ligands_path, id_col, smiles_col, record=True):
+    """
+    Yield (ligand_id, smiles) pairs as rows are read.
+    Rows with an ID seen before are skipped (the first row with an ID is kept), and logged if `record`.
+    """
+    seen_ids = set()
     with open(ligands_path, mode='r', newline='') as f:
         csv_reader = csv.reader(f)
         
@@ -165,13 +865,24 @@ def parse_ligands_csv(ligands_path, id_col, smiles_col):
                 id_index = header.index(id_col)
                 smiles_index = header.index(smiles_col)
             else:
-                ligands_dict[row[id_index]] = row[smiles_index].strip()
-
-    return ligands_dict
+                ligand_id = row[id_index]
+                if ligand_id in seen_ids:
+                    if record:
+                        metrics.count('ligands_duplicated')
+                        logger.warning(f'Duplicate ligand ID {ligand_id} on line {csv_reader.line_num}: skipping')
+                    continue
+                seen_ids.add(ligand_id)
+                if record:
+                    metrics.count('ligands')
+                yield ligand_id, row[smiles_index].strip()
 
 
-def gen_model_seeds(n):
-    return [int(random.uniform(1, 100)) for _ in range(n)]
+def gen_model_seeds(n, seed_key=None):
+    """
+    Random model seeds, drawn from a generator seeded with `seed_key` if given (same seeds for the same key).
+    """
+    rng = random.Random(seed_key) if seed_key is not None else random
+    return [int(rng.uniform(1, 100)) for _ in range(n)]
 
 
 if __name__ == '__main__':
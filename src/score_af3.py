@@ -1,14 +1,56 @@
 """
 Score structures produced by AlphaFold 3.
+
+Optionally (--dockq), also reports pDockQ (2 protein chains) or mpDockQ (>2 protein chains) computed 
+from the top ranked mmCIF model, using the per-atom pLDDT stored in the B-factor column. DNA and RNA chains
+are not counted.
+See score_protein_complex.py for details.
+
+Optionally (--chain_scores), also reports the per-chain ipTM (`chain_iptm`) and the ipTM of each pair of
+chains (`chain_pair_iptm`), as JSON lists, read in the same pass as the global scores.
+
+Optionally (--ligand_scores), also reports metrics of the interface between a ligand chain and the protein
+chains of the structure, from the full confidences of the top ranked model (`*_confidences.json`):
+- ligand_plddt         mean pLDDT of ligand atoms
+- ligand_pae_mean      mean PAE between ligand tokens and protein tokens (both directions)
+- ligand_pae_min       min PAE between ligand tokens and protein tokens
+- ligand_contact_mass  sum of contact probabilities between ligand tokens and protein tokens
+Protein chains are read from the mmCIF model: other ligands, ions, cofactors and DNA / RNA chains are left out.
+
+Optionally (--pair_mapping), the scores of each canonical pair are also output under the ids of its redundant pairs,
+from the pair mapping written by make_input_fasta.py --dedup (ids are matched after AlphaFold 3 job name sanitisation).
+For redundant pairs with the chains in the other order (B:A for A:B), the per-chain scores of 2 chain structures
+are reordered to match; they are left empty for structures with more chains, whose split between bait and target
+is not known.
+
+Summary confidences are read by a pool of threads (--workers), as reading many small files is bound by
+I/O latency on shared storage. JSON is decoded with orjson when it is installed.
 """
 import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import json
 import logging
+import multiprocessing
 from pathlib import Path
+import re
+import string
 import sys
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-import pandas as pd
+from src.file_index import list_files
+from src.json_arrays import find_json_array, parse_float_array, parse_float_matrix, parse_str_array
+from src.metrics import add_metrics_arguments, call_with_metrics, finish_metrics, metrics, start_profiler
+from src.score_output import SortedScoresWriter, compute_confidence, fan_out_rows, read_pair_mapping, write_sorted_scores
+from src.score_protein_complex import PdbAtoms, score_models_batch
+from src.score_store import ScoreStore, file_fingerprint
 
 
 logger = logging.getLogger(__name__)
@@ -30,10 +72,108 @@ def main():
         required=True,
         help='Path to output CSV file.',
     )
+    parser.add_argument(
+        '--store_path', 
+        type=Path,
+        required=False,
+        default=None,
+        help=(
+            'Path to SQLite score store (created if missing). '
+            'Only new or changed structures are scored; the CSV contains all structures.'
+        ),
+    )
+    parser.add_argument(
+        '--hash_files', 
+        action='store_true',
+        help='Detect changed files in the score store by content hash instead of size and modification time.',
+    )
+    parser.add_argument(
+        '--streaming', 
+        action='store_true',
+        help='Write scores to disk as they are computed and sort them with an external merge sort (bounded memory).',
+    )
+    parser.add_argument(
+        '--top_k', 
+        type=int,
+        required=False,
+        default=None,
+        help='Only output the K structures with highest confidence.',
+    )
+    parser.add_argument(
+        '--workers', 
+        type=int,
+        required=False,
+        default=1,
+        help=(
+            'Number of parallel workers: threads used to list the AlphaFold 3 output folder and read scores, '
+            'or processes used to score structures with --dockq.'
+        ),
+    )
+    parser.add_argument(
+        '--dockq', 
+        action='store_true',
+        help='Compute pDockQ / mpDockQ from the top ranked mmCIF model of each structure.',
+    )
+    parser.add_argument(
+        '--chain_scores', 
+        action='store_true',
+        help='Also output per-chain ipTM and ipTM of each pair of chains (as JSON lists).',
+    )
+    parser.add_argument(
+        '--ligand_scores', 
+        action='store_true',
+        help='Compute ligand interface metrics from the full confidences of the top ranked model of each structure.',
+    )
+    parser.add_argument(
+        '--ligand_chain', 
+        type=str,
+        required=False,
+        default='Z',
+        help='Chain ID of the ligand, for --ligand_scores (default: Z, as in run_af3_ligand_pulldown.py).',
+    )
+    parser.add_argument(
+        '--manifest_path', 
+        type=Path,
+        required=False,
+        default=None,
+        help=(
+            'Path to a manifest of scores files. Reused to skip listing the AlphaFold 3 folder '
+            'while the folder is unchanged, written otherwise.'
+        ),
+    )
+    parser.add_argument(
+        '--refresh_manifest', 
+        action='store_true',
+        help='Always list the AlphaFold 3 folder and rewrite the manifest.',
+    )
+    parser.add_argument(
+        '--pair_mapping', 
+        type=Path,
+        required=False,
+        default=None,
+        help=(
+            'Path to the pair mapping CSV written by make_input_fasta.py --dedup: '
+            'the scores of each canonical pair are also output under the ids of its redundant pairs.'
+        ),
+    )
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     af_folder = args.af_folder
     output_path = args.output_path
+    store_path = args.store_path
+    hash_files = args.hash_files
+    streaming = args.streaming
+    top_k = args.top_k
+    workers = args.workers
+    manifest_path = args.manifest_path
+    refresh_manifest = args.refresh_manifest
+    dockq = args.dockq
+    chain_scores = args.chain_scores
+    ligand_chain = args.ligand_chain if args.ligand_scores else None
+    pair_mapping_path = args.pair_mapping
+    metrics_out = args.metrics_out
+    profile_out = args.profile_out
 
     if not af_folder.is_dir():
         logger.error(f'AlphaFold 3 predictions folder does not exist: {af_folder}')
@@ -41,73 +181,456 @@ def main():
     elif not output_path.parent.is_dir():
         logger.error(f'Output folder does not exist: {output_path.parent}')
         sys.exit(1)
+    elif store_path is not None and not store_path.parent.is_dir():
+        logger.error(f'Score store folder does not exist: {store_path.parent}')
+        sys.exit(1)
+    elif workers < 1:
+        logger.error(f'Number of workers must be at least 1: {workers}')
+        sys.exit(1)
+    elif top_k is not None and top_k < 1:
+        logger.error(f'Top K must be at least 1: {top_k}')
+        sys.exit(1)
+    elif pair_mapping_path is not None and not pair_mapping_path.is_file():
+        logger.error(f'Pair mapping file does not exist: {pair_mapping_path}')
+        sys.exit(1)
 
     logger.info('Score structures docked with AlphaFold 3')
     logger.info(f'AlphaFold predictions folder : {af_folder.resolve().as_posix()}')
     logger.info(f'Output CSV path with scores  : {output_path.resolve().as_posix()}')
+    if store_path is not None:
+        logger.info(f'Score store path             : {store_path.resolve().as_posix()}')
+
+    profiler = start_profiler(profile_out)
 
-    scores_paths = load_scores_paths(af_folder)
+    pair_mapping = None
+    if pair_mapping_path is not None:
+        pair_mapping = read_pair_mapping(pair_mapping_path, sanitise_job_name)
+        logger.info(f'Number of canonical pairs with redundant pairs: {len(pair_mapping):,}')
+
+    with metrics.timer('list_files'):
+        scores_paths = load_scores_paths(af_folder, workers, manifest_path, refresh_manifest)
 
     logger.info(f'Number of results found: {len(scores_paths):,}')
 
-    score_names = [
-        'fraction_disordered',
-        'has_clash',
-        'iptm',
-        'ptm',
-        'ranking_score',
-    ]
-    scores_data = {
-        'id': [],
-    }
-    for n in score_names:
-        scores_data[n] = []
+    score_names = list(DEFAULT_SCORE_NAMES)
+    if chain_scores:
+        score_names += CHAIN_SCORE_NAMES
+    columns = ['id'] + score_names
+    if dockq:
+        columns.append('dockq')
+    if ligand_chain is not None:
+        columns += LIGAND_SCORE_NAMES
+
+    all_structure_ids = [get_structure_id(p) for p in scores_paths]
+    store, fingerprints = None, {}
+    if store_path is not None:
+        store = ScoreStore(store_path)
+        # Structures stored without some of the requested scores are scored again
+        store_options = [n for n in columns[1:] if n not in DEFAULT_SCORE_NAMES]
+        if ligand_chain is not None:
+            store_options.append(f'ligand_chain={ligand_chain}')
+        with metrics.timer('fingerprint'):
+            stored_fingerprints = store.load_fingerprints()
+            fingerprints = {
+                get_structure_id(p): file_fingerprint(
+                    get_input_paths(p, dockq, ligand_chain is not None), hash_files, store_options
+                )
+                for p in scores_paths
+            }
+        scores_paths = [
+            p for p in scores_paths
+            if stored_fingerprints.get(get_structure_id(p)) != fingerprints[get_structure_id(p)]
+        ]
+        logger.info(f'Number of results already in score store: {len(all_structure_ids) - len(scores_paths):,}')
+        logger.info(f'Number of results to score: {len(scores_paths):,}')
 
-    for i, scores_path in enumerate(scores_paths):
+    scores_data = {n: [] for n in columns}
+    writer = None
+    if streaming or top_k is not None:
+        writer = SortedScoresWriter(output_path, columns + ['confidence'], top_k=top_k)
+
+    def add_row(scores_dict):
+        for row in fan_out_rows(scores_dict, pair_mapping, swap_chain_scores if chain_scores else None):
+            if writer is not None:
+                writer.add({**row, 'confidence': compute_confidence(row['iptm'], row['ptm'])})
+            else:
+                for n in columns:
+                    scores_data[n].append(row.get(n))
+
+    results = score_structures(scores_paths, score_names, dockq, ligand_chain, workers)
+    for i, scores_dict in enumerate(results):
         if i == 0 or (i+1) % 100 == 0 or (i+1) == len(scores_paths):
             logger.info(f'Scoring structure {i+1:,} / {len(scores_paths):,}')
 
-        structure_id = scores_path.name.replace('_summary_confidences.json', '')
-        scores_dict = read_scores_from_json_file(scores_path, score_names)
-        
-        scores_data['id'].append(structure_id)
-        for n in score_names:
-            scores_data[n].append(scores_dict.get(n))
+        structure_id = scores_dict['id']
+        failed_scores = scores_dict.pop('failed_scores', None)
+        if store is not None and failed_scores is None:
+            store.add(structure_id, fingerprints[structure_id], scores_dict)
+        elif store is not None:
+            # Partial scores are output but not stored, so that the structure is scored again on the next run
+            store.delete(structure_id)
+            add_row(scores_dict)
+        else:
+            add_row(scores_dict)
+
+    if store is not None:
+        store.commit()
+        for scores_dict in store.iter_scores(all_structure_ids):
+            add_row(scores_dict)
+        store.close()
 
     logger.info(f'Exporting sorted scores (best first) in CSV format to {output_path.resolve().as_posix()}')
-    out_df = pd.DataFrame.from_dict(
-        scores_data
-    )
-    out_df['confidence'] = (0.8 * out_df['iptm'] + 0.2 * out_df['ptm']).round(4)
-    out_df.sort_values(
-        'confidence', 
-        ascending=False,
-    ).to_csv(
-        output_path,
-        index=False,
-    )
+    with metrics.timer('write_output'):
+        if writer is not None:
+            writer.close()
+        else:
+            write_sorted_scores(scores_data, output_path)
 
+    finish_metrics(metrics_out, profiler, profile_out)
     logger.info('DONE')
     sys.exit(0)
 
 
-def load_scores_paths(af_folder) -> List[Path]:
-    paths = []
-    for f in af_folder.glob('**/*_summary_confidences.json'):
-        if f.is_file():
-            paths.append(f)
-    return paths
+SUMMARY_CONFIDENCES_RE = re.compile(r'.+_summary_confidences\.json$')
+DEFAULT_SCORE_NAMES = ['fraction_disordered', 'has_clash', 'iptm', 'ptm', 'ranking_score']
+CHAIN_SCORE_NAMES = ['chain_iptm', 'chain_pair_iptm']
+LIGAND_SCORE_NAMES = ['ligand_plddt', 'ligand_pae_mean', 'ligand_pae_min', 'ligand_contact_mass']
 
 
-def read_scores_from_json_file(json_scores : Path, score_names : List[str]) -> Dict[str, float]:
-    with open(json_scores, 'r') as f:
-        scores_dict = json.load(f)
+def load_scores_paths(
+    af_folder : Path, 
+    workers : int = 1, 
+    manifest_path : Optional[Path] = None, 
+    refresh_manifest : bool = False,
+) -> List[Path]:
+    return list_files(
+        af_folder, 
+        SUMMARY_CONFIDENCES_RE, 
+        recursive=True, 
+        workers=workers, 
+        manifest_path=manifest_path, 
+        refresh=refresh_manifest,
+    )
+
+
+def get_structure_id(scores_path : Path) -> str:
+    return scores_path.name.replace('_summary_confidences.json', '')
+
+
+def sanitise_job_name(name : str) -> str:
+    """
+    Job name as used by AlphaFold 3 to name output folders and files (as in structure ids).
+    """
+    allowed_chars = set(string.ascii_lowercase + string.digits + '_-.')
+    return ''.join(c for c in name.lower().replace(' ', '_') if c in allowed_chars)
+
+
+def swap_chain_scores(scores_dict : Dict[str, float]) -> Dict[str, float]:
+    """
+    Per-chain scores of a 2 chain structure with the chains in the other order (B:A for A:B).
+    Scores of structures with more chains are set to None, as the chains of each side of the pair are not known.
+    """
+    output = dict(scores_dict)
+    for name in CHAIN_SCORE_NAMES:
+        if output.get(name) is None:
+            continue
+        value = json.loads(output[name])
+        if len(value) != 2:
+            output[name] = None
+        elif name == 'chain_pair_iptm':
+            output[name] = json.dumps([row[::-1] for row in value[::-1]], separators=(',', ':'))
+        else:
+            output[name] = json.dumps(value[::-1], separators=(',', ':'))
+    return output
+
+
+def get_model_path(scores_path : Path) -> Path:
+    """
+    Path to the top ranked model, next to the summary confidences.
+    """
+    return scores_path.parent / f'{get_structure_id(scores_path)}_model.cif'
+
+
+def get_confidences_path(scores_path : Path) -> Path:
+    """
+    Path to the full confidences of the top ranked model, next to the summary confidences.
+    """
+    return scores_path.parent / f'{get_structure_id(scores_path)}_confidences.json'
+
+
+def get_input_paths(scores_path : Path, dockq : bool, ligand_scores : bool) -> List[Path]:
+    """
+    All input files of a structure, used to fingerprint it.
+    """
+    paths = [scores_path]
+    if dockq:
+        paths.append(get_model_path(scores_path))
+    if ligand_scores:
+        paths.append(get_confidences_path(scores_path))
+        if not dockq:
+            paths.append(get_model_path(scores_path))
+    return [p for p in paths if p.is_file()]
+
+
+def score_structures(
+    scores_paths : List[Path], 
+    score_names : List[str], 
+    dockq : bool = False, 
+    ligand_chain : Optional[str] = None,
+    workers : int = 1,
+) -> Iterator[Dict[str, float]]:
+    """
+    Scores of each structure, in the same order as the input. 
+    Structures are spread over a pool of worker processes when computing DockQ or ligand scores,
+    otherwise scores files are read by a pool of threads.
+    """
+    score_fn = functools.partial(score_structure, score_names=score_names, dockq=dockq, ligand_chain=ligand_chain)
+    if (dockq or ligand_chain is not None) and workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.imap(functools.partial(call_with_metrics, score_fn), scores_paths, chunksize=16)
+            for scores_dict, worker_metrics in results:
+                metrics.merge(worker_metrics)
+                yield scores_dict
+    elif workers > 1:
+        yield from imap_threads(score_fn, scores_paths, workers)
+    else:
+        yield from map(score_fn, scores_paths)
+
+
+def imap_threads(fn, items : List, workers : int, window_size : int = 64) -> Iterator:
+    """
+    Like `map`, with calls spread over a pool of threads.
+    At most `window_size` calls per worker are pending at once, to bound memory.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            if len(pending) >= window_size * workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, item))
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def score_structure(
+    scores_path : Path, 
+    score_names : List[str], 
+    dockq : bool = False, 
+    ligand_chain : Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Scores of a structure. If DockQ or ligand scores cannot be computed, they are None and
+    `failed_scores` lists them ('dockq', 'ligand_scores').
+    """
+    structure_id = get_structure_id(scores_path)
+    with metrics.timer('read_scores_json'):
+        scores_dict = {'id': structure_id, **read_scores_from_json_file(scores_path, score_names)}
+
+    if dockq:
+        scores_dict['dockq'] = None
+        model_path = get_model_path(scores_path)
+        if not model_path.is_file():
+            logger.warning(f'No mmCIF model found for structure {structure_id}')
+        else:
+            try:
+                with metrics.timer('model_dockq', structure_id):
+                    scores_dict['dockq'] = calc_model_dockq(model_path)
+            except Exception as e:
+                metrics.count('dockq_failed')
+                scores_dict.setdefault('failed_scores', []).append('dockq')
+                logger.error(f'Failed to compute DockQ of structure {structure_id}: {type(e).__name__}: {e}')
+
+    if ligand_chain is not None:
+        scores_dict.update({name: None for name in LIGAND_SCORE_NAMES})
+        confidences_path = get_confidences_path(scores_path)
+        model_path = get_model_path(scores_path)
+        if not confidences_path.is_file():
+            logger.warning(f'No full confidences found for structure {structure_id}')
+        elif not model_path.is_file():
+            logger.warning(f'No mmCIF model found for structure {structure_id}')
+        else:
+            try:
+                with metrics.timer('ligand_scores', structure_id):
+                    with metrics.timer('read_cif'):
+                        protein_chains = get_protein_chains(read_cif_atoms(model_path))
+                    scores_dict.update(calc_ligand_scores(confidences_path, ligand_chain, protein_chains))
+            except Exception as e:
+                metrics.count('ligand_scores_failed')
+                scores_dict.setdefault('failed_scores', []).append('ligand_scores')
+                logger.error(f'Failed to compute ligand scores of structure {structure_id}: {type(e).__name__}: {e}')
+
+    return scores_dict
+
+
+def calc_model_dockq(cif_path : Path) -> Optional[float]:
+    """
+    pDockQ (2 protein chains) or mpDockQ (>2 protein chains) of an AlphaFold 3 model,
+    using the per-atom pLDDT of CA atoms as residue pLDDT. Ligands and other non polymer atoms are ignored,
+    as are DNA and RNA chains.
+    """
+    with metrics.timer('read_cif'):
+        atoms = select_protein_chains(read_cif_atoms(cif_path))
+    metrics.count('atoms', len(atoms.chain))
+    plddt = atoms.b_factor[atoms.atom_name == 'CA']
+    [dockq_score] = score_models_batch([atoms], [plddt])
+    if dockq_score is None:
+        return None
+    return round(float(dockq_score), 4)
+
+
+def calc_ligand_scores(
+    confidences_path : Path, 
+    ligand_chain : str, 
+    protein_chains : List[str],
+) -> Dict[str, Optional[float]]:
+    """
+    Metrics of the interface between the ligand chain `ligand_chain` and `protein_chains`, from the full 
+    confidences of an AlphaFold 3 model (see module docstring).
+    Metrics are None if the structure has no ligand chain `ligand_chain`, or no protein chain.
+
+    Arrays are located in the raw bytes of the file and parsed in bulk by NumPy, as for PAE matrices 
+    of ColabFold (see json_arrays.py), avoiding the millions of Python floats 
+    `json.load` would create. Only the ligand rows of the contact probabilities are parsed.
+    """
+    with open(confidences_path, 'rb') as f:
+        raw = f.read()
+    metrics.count('files_read')
+    metrics.count('bytes_read', len(raw))
+
+    ligand_id = ligand_chain.encode()
+    protein_ids = [chain.encode() for chain in protein_chains if chain != ligand_chain]
+    token_chain_ids = parse_str_array(find_json_array(raw, 'token_chain_ids'))
+    ligand_atoms = parse_str_array(find_json_array(raw, 'atom_chain_ids')) == ligand_id
+    ligand_tokens = token_chain_ids == ligand_id
+    protein_tokens = np.isin(token_chain_ids, protein_ids)
+    if not ligand_atoms.any() or not ligand_tokens.any() or not protein_tokens.any():
+        return {name: None for name in LIGAND_SCORE_NAMES}
+
+    atom_plddts = parse_float_array(find_json_array(raw, 'atom_plddts'))
+    pae = parse_float_matrix(find_json_array(raw, 'pae'))
+    ligand_contact_probs = parse_float_matrix(find_json_array(raw, 'contact_probs'), rows=ligand_tokens)
+    if len(atom_plddts) != len(ligand_atoms) or pae.shape != (len(ligand_tokens), len(ligand_tokens)):
+        raise ValueError(f'Inconsistent array sizes in {confidences_path}')
+
+    pae_interface = np.concatenate([
+        pae[np.ix_(ligand_tokens, protein_tokens)].ravel(),
+        pae[np.ix_(protein_tokens, ligand_tokens)].ravel(),
+    ])
 
     return {
-        name: scores_dict.get(name)
-        for name in score_names
+        'ligand_plddt'       : round(float(atom_plddts[ligand_atoms].mean()), 2),
+        'ligand_pae_mean'    : round(float(pae_interface.mean()), 2),
+        'ligand_pae_min'     : round(float(pae_interface.min()), 2),
+        'ligand_contact_mass': round(float(ligand_contact_probs[:, protein_tokens].sum()), 4),
     }
 
 
+def get_protein_chains(atoms : PdbAtoms) -> List[str]:
+    """
+    Protein chains of polymer atoms: chains with CA atoms (DNA and RNA chains have none).
+    """
+    return np.unique(atoms.chain[atoms.atom_name == 'CA']).tolist()
+
+
+def select_protein_chains(atoms : PdbAtoms) -> PdbAtoms:
+    """
+    Atoms of protein chains (see `get_protein_chains`).
+    """
+    is_protein = np.isin(atoms.chain, get_protein_chains(atoms))
+    if is_protein.all():
+        return atoms
+    return PdbAtoms(*(column[is_protein] for column in atoms))
+
+
+def read_cif_atoms(cif_path : Path, group : str = 'ATOM') -> PdbAtoms:
+    """
+    Read the `atom_site` table of an mmCIF file into NumPy arrays, keeping atoms of the given group 
+    (ATOM for polymers, HETATM for ligands).
+
+    The rows of the table are split into tokens in bulk and reshaped into a 2D array of columns,
+    which assumes that no value contains whitespace (true of atom_site tables written by AlphaFold 3).
+    """
+    with open(cif_path, 'r') as f:
+        text = f.read()
+    metrics.count('files_read')
+    metrics.count('bytes_read', len(text))
+
+    loop_start = text.find('\n_atom_site.')
+    if loop_start < 0:
+        raise ValueError(f'No atom_site table in {cif_path}')
+
+    # Header: one _atom_site.<column> line per column
+    columns = []
+    pos = loop_start + 1
+    while text.startswith('_atom_site.', pos):
+        line_end = text.index('\n', pos)
+        columns.append(text[pos+len('_atom_site.'):line_end].strip())
+        pos = line_end + 1
+
+    # Rows: until the end of the loop (comment, new loop, new category or end of file)
+    data_end = len(text)
+    for terminator in ['\n#', '\nloop_', '\n_', '\ndata_']:
+        end = text.find(terminator, pos - 1)
+        if end >= 0:
+            data_end = min(data_end, end)
+
+    tokens = np.array(text[pos:data_end].split())
+    if len(tokens) % len(columns) != 0:
+        raise ValueError(f'Malformed atom_site table in {cif_path}')
+    table = tokens.reshape(-1, len(columns))
+    table = table[table[:, columns.index('group_PDB')] == group]
+
+    def column(name):
+        return table[:, columns.index(name)]
+
+    # Atom names with a prime (nucleic acids) are quoted, e.g. "O5'"
+    atom_name = column('label_atom_id')
+    quoted = np.flatnonzero(np.char.startswith(atom_name, '"') | np.char.startswith(atom_name, "'"))
+    atom_name[quoted] = [name[1:-1] for name in atom_name[quoted]]
+
+    chain_column = 'auth_asym_id' if 'auth_asym_id' in columns else 'label_asym_id'
+    return PdbAtoms(
+        chain=column(chain_column),
+        atom_name=atom_name,
+        res_name=column('label_comp_id'),
+        coords=np.stack([
+            column('Cartn_x').astype(np.float64),
+            column('Cartn_y').astype(np.float64),
+            column('Cartn_z').astype(np.float64),
+        ], axis=1),
+        b_factor=column('B_iso_or_equiv').astype(np.float64),
+    )
+
+
+def read_scores_from_json_file(json_scores : Path, score_names : List[str]) -> Dict[str, float]:
+    """
+    Read the given scores from a summary confidences file.
+    Per-chain scores (lists) are returned as compact JSON strings, to be stored in a single CSV column.
+    """
+    scores_dict = read_json(json_scores)
+
+    output = {}
+    for name in score_names:
+        value = scores_dict.get(name)
+        if isinstance(value, list):
+            value = json.dumps(value, separators=(',', ':'))
+        output[name] = value
+    return output
+
+
+def read_json(path : Path):
+    """
+    Read and decode a JSON file, with orjson if available.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    metrics.count('files_read')
+    metrics.count('bytes_read', len(data))
+
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 if __name__ == '__main__':
     main()
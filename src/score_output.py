@@ -0,0 +1,204 @@
+"""
+Bounded-memory CSV output of scores, sorted by confidence (best first).
+
+Rows are written to disk as they are scored, in sorted chunks of fixed size, and merged into the
+final CSV at the end (external merge sort). Alternatively, only the top K rows by confidence are
+kept in a heap, so that neither all rows need to be held in memory nor sorted.
+
+Scores of canonical pairs can be fanned out to the redundant pairs they stand for, using the pair mapping
+written by make_input_fasta.py --dedup.
+"""
+import csv
+import heapq
+import itertools
+import logging
+import math
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+def compute_confidence(iptm : Optional[float], ptm : Optional[float]) -> Optional[float]:
+    """
+    Confidence used to rank structures: 0.8 * ipTM + 0.2 * pTM.
+    """
+    if iptm is None or ptm is None:
+        return None
+    return float(np.round(0.8 * iptm + 0.2 * ptm, 4))
+
+
+def read_pair_mapping(
+    mapping_path : Path, 
+    normalize_id : Optional[Callable[[str], str]] = None,
+) -> Dict[str, List[Tuple[str, bool]]]:
+    """
+    Read a pair mapping written by make_input_fasta.py --dedup as canonical id -> (id, swapped) of its redundant pairs,
+    where `swapped` is True if the canonical pair has the chains in the other order.
+    Dropped self-pairs (no canonical id) are ignored. Ids are passed through `normalize_id` if given,
+    to match the ids of scored structures.
+    """
+    pair_mapping = {}
+    with mapping_path.open('r', newline='') as f:
+        for row in csv.DictReader(f):
+            if row['canonical_id'] == '':
+                continue
+            canonical_id, pair_id = row['canonical_id'], row['id']
+            if normalize_id is not None:
+                canonical_id, pair_id = normalize_id(canonical_id), normalize_id(pair_id)
+            pair_mapping.setdefault(canonical_id, []).append((pair_id, row.get('swapped') == '1'))
+    return pair_mapping
+
+
+def fan_out_rows(
+    row : dict, 
+    pair_mapping : Optional[Dict[str, List[Tuple[str, bool]]]], 
+    swap_row : Optional[Callable[[dict], dict]] = None,
+) -> List[dict]:
+    """
+    The row of a canonical pair followed by a copy for each of its redundant pairs.
+    Copies for pairs with the chains in the other order are passed through `swap_row` if given,
+    to reorder scores that depend on the chain order (scores that do not are copied as is).
+    """
+    if pair_mapping is None:
+        return [row]
+
+    rows = [row]
+    for pair_id, swapped in pair_mapping.get(row['id'], []):
+        pair_row = {**row, 'id': pair_id}
+        if swapped and swap_row is not None:
+            pair_row = swap_row(pair_row)
+        rows.append(pair_row)
+    return rows
+
+
+def write_sorted_scores(scores_data : dict, output_path : Path):
+    """
+    Write scores held in memory (dict of columns) to a CSV file sorted by confidence (highest first).
+    """
+    out_df = pd.DataFrame.from_dict(
+        scores_data
+    )
+    out_df['confidence'] = (0.8 * out_df['iptm'] + 0.2 * out_df['ptm']).round(4)
+    out_df.sort_values(
+        'confidence', 
+        ascending=False,
+    ).to_csv(
+        output_path,
+        index=False,
+    )
+
+
+class SortedScoresWriter:
+    """
+    Write score rows to a CSV file sorted by confidence (highest first) with bounded memory.
+
+    Rows with the same confidence are kept in insertion order; rows without confidence come last.
+    """
+
+    def __init__(
+        self,
+        output_path : Path,
+        columns : List[str],
+        chunk_size : int = 100_000,
+        top_k : Optional[int] = None,
+        sort_key : str = 'confidence',
+    ):
+        self.output_path = Path(output_path)
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.top_k = top_k
+        self.sort_key = sort_key
+
+        self._counter = itertools.count()
+        self._buffer : List[Tuple[float, int, list]] = []
+        self._chunk_paths : List[Path] = []
+        self._tempdir : Optional[Path] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._cleanup()
+
+    def add(self, row : dict):
+        value = row.get(self.sort_key)
+        sort_value = -math.inf if value is None or math.isnan(value) else value
+        item = (sort_value, -next(self._counter), [row.get(c) for c in self.columns])
+
+        if self.top_k is not None:
+            # Min-heap of the best K rows: the worst of them is at the top
+            if len(self._buffer) < self.top_k:
+                heapq.heappush(self._buffer, item)
+            elif item > self._buffer[0]:
+                heapq.heapreplace(self._buffer, item)
+            return
+
+        self._buffer.append(item)
+        if len(self._buffer) >= self.chunk_size:
+            self._spill()
+
+    def close(self):
+        """
+        Merge sorted chunks into the output CSV file.
+        """
+        try:
+            if self.top_k is not None:
+                self._write(iter(sorted(self._buffer, reverse=True)))
+            elif len(self._chunk_paths) == 0:
+                self._buffer.sort(reverse=True)
+                self._write(iter(self._buffer))
+            else:
+                self._spill()
+                logger.info(f'Merging {len(self._chunk_paths):,} sorted chunks of scores')
+                chunk_files = [p.open('r', newline='') for p in self._chunk_paths]
+                try:
+                    chunks = [self._read_chunk(f) for f in chunk_files]
+                    self._write(heapq.merge(*chunks, reverse=True))
+                finally:
+                    for f in chunk_files:
+                        f.close()
+        finally:
+            self._buffer = []
+            self._cleanup()
+
+    def _spill(self):
+        if len(self._buffer) == 0:
+            return
+        if self._tempdir is None:
+            self._tempdir = Path(tempfile.mkdtemp(prefix='scores_', dir=self.output_path.parent))
+
+        self._buffer.sort(reverse=True)
+        chunk_path = self._tempdir / f'chunk_{len(self._chunk_paths):06d}.csv'
+        with chunk_path.open('w', newline='') as f_out:
+            writer = csv.writer(f_out, lineterminator='\n')
+            for sort_value, neg_index, values in self._buffer:
+                writer.writerow([repr(sort_value), neg_index, *values])
+
+        self._chunk_paths.append(chunk_path)
+        self._buffer = []
+
+    def _read_chunk(self, f) -> Iterator[Tuple[float, int, list]]:
+        for sort_value, neg_index, *values in csv.reader(f):
+            yield float(sort_value), int(neg_index), values
+
+    def _write(self, items : Iterator[Tuple[float, int, list]]):
+        with self.output_path.open('w', newline='') as f_out:
+            writer = csv.writer(f_out, lineterminator='\n')
+            writer.writerow(self.columns)
+            for _, _, values in items:
+                writer.writerow(values)
+
+    def _cleanup(self):
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
@@ -15,19 +15,43 @@ Results are sorted by the average of the DockQ and ipTM scores (highest first).
     - mpDockQ for protein complexes with >2 chains: [Bryant et al, October 2022](https://doi.org/10.1038/s41467-022-33729-4)
 
 DockQ score implementations are adapted from [AlphaPulldown](https://github.com/KosinskiLab/AlphaPulldown).
+
+Optionally (--coords_cache), the CB coordinates, pLDDT and chain boundaries of each scored model are saved
+to a compact binary cache (see coords_cache.py). With --thresholds 6,8,10, pDockQ / mpDockQ are recomputed
+from the cache for each contact distance threshold (columns dockq_6, dockq_8, dockq_10) without reading PDB files.
+With a score store (--store_path), complexes already in the store but not in the cache are scored again to be cached,
+so that the cache holds every complex of the store.
 """
 import argparse
 import collections
+import csv
+import functools
 import json
 import logging
 import math
+import multiprocessing
+import os
 from pathlib import Path
 import re
 import sys
-from typing import List, Tuple
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
 import numpy as np
-import pandas as pd
+
+from src.coords_cache import (
+    CachedModel,
+    CoordsCacheWriter,
+    list_coords_bundles,
+    load_bundle_array,
+    read_cached_ids,
+    read_coords_bundle,
+)
+from src.file_index import list_files
+from src.json_arrays import find_json_array, parse_float_matrix
+from src.metrics import add_metrics_arguments, call_with_metrics, finish_metrics, metrics, start_profiler
+from src.score_output import SortedScoresWriter, compute_confidence, fan_out_rows, read_pair_mapping, write_sorted_scores
+from src.score_store import ScoreStore, file_fingerprint
 
 
 logger = logging.getLogger(__name__)
@@ -40,8 +64,9 @@ def main():
     parser.add_argument(
         '-i', '--af_folder', 
         type=Path,
-        required=True,
-        help='Path to AlphaFold output folder containing PDB structures and JSON scores.',
+        required=False,
+        default=None,
+        help='Path to AlphaFold output folder containing PDB structures and JSON scores (not needed with --thresholds).',
     )
     parser.add_argument(
         '-o', '--output_path', 
@@ -49,104 +74,932 @@ def main():
         required=True,
         help='Path to output CSV file containing the protein complex scores.',
     )
+    parser.add_argument(
+        '--workers', 
+        type=int,
+        required=False,
+        default=1,
+        help='Number of worker processes used to score protein complexes in parallel.',
+    )
+    parser.add_argument(
+        '--chunk_size', 
+        type=int,
+        required=False,
+        default=16,
+        help='Number of protein complexes sent to a worker process at a time.',
+    )
+    parser.add_argument(
+        '--store_path', 
+        type=Path,
+        required=False,
+        default=None,
+        help=(
+            'Path to SQLite score store (created if missing). '
+            'Only new or changed protein complexes are scored; the CSV contains all complexes.'
+        ),
+    )
+    parser.add_argument(
+        '--hash_files', 
+        action='store_true',
+        help='Detect changed files in the score store by content hash instead of size and modification time.',
+    )
+    parser.add_argument(
+        '--streaming', 
+        action='store_true',
+        help='Write scores to disk as they are computed and sort them with an external merge sort (bounded memory).',
+    )
+    parser.add_argument(
+        '--top_k', 
+        type=int,
+        required=False,
+        default=None,
+        help='Only output the K protein complexes with highest confidence.',
+    )
+    parser.add_argument(
+        '--all_models', 
+        action='store_true',
+        help=(
+            'Score all ranked models of each complex instead of rank 1 only: one row per model, '
+            'plus per complex aggregates (best, mean, std) in <output_path stem>_per_complex.csv.'
+        ),
+    )
+    parser.add_argument(
+        '--manifest_path', 
+        type=Path,
+        required=False,
+        default=None,
+        help=(
+            'Path to a manifest of prediction files. Reused to skip listing the AlphaFold folder '
+            'while the folder is unchanged, written otherwise.'
+        ),
+    )
+    parser.add_argument(
+        '--refresh_manifest', 
+        action='store_true',
+        help='Always list the AlphaFold folder and rewrite the manifest.',
+    )
+    parser.add_argument(
+        '--watch', 
+        action='store_true',
+        help=(
+            'Follow the AlphaFold folder while predictions are running: score each complex as soon as '
+            'its <id>.done.txt marker appears and append its scores to the output CSV. '
+            'The output is sorted when watching stops (Ctrl-C or --watch_timeout).'
+        ),
+    )
+    parser.add_argument(
+        '--poll_interval', 
+        type=float,
+        required=False,
+        default=30,
+        help='Seconds between two scans of the AlphaFold folder in watch mode.',
+    )
+    parser.add_argument(
+        '--watch_timeout', 
+        type=float,
+        required=False,
+        default=None,
+        help='Stop watching after this many seconds without new finished complexes (default: watch until interrupted).',
+    )
+    parser.add_argument(
+        '--pair_mapping', 
+        type=Path,
+        required=False,
+        default=None,
+        help=(
+            'Path to the pair mapping CSV written by make_input_fasta.py --dedup: '
+            'the scores of each canonical pair are also output under the ids of its redundant pairs.'
+        ),
+    )
+    parser.add_argument(
+        '--coords_cache', 
+        type=Path,
+        required=False,
+        default=None,
+        help=(
+            'Path to a folder where the CB coordinates, pLDDT and chain boundaries of scored models are cached '
+            '(bundles of models appended to the folder), or read from with --thresholds. '
+            'With --store_path, complexes already in the store but missing from the cache are scored again to be cached.'
+        ),
+    )
+    parser.add_argument(
+        '--thresholds', 
+        type=str,
+        required=False,
+        default=None,
+        help=(
+            'Comma separated contact distance thresholds in Angstrom (e.g. 6,8,10): recompute pDockQ / mpDockQ '
+            'of all models in --coords_cache for each threshold instead of scoring the AlphaFold folder.'
+        ),
+    )
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     af_folder = args.af_folder
     output_path = args.output_path
+    workers = args.workers
+    chunk_size = args.chunk_size
+    store_path = args.store_path
+    hash_files = args.hash_files
+    streaming = args.streaming
+    top_k = args.top_k
+    all_models = args.all_models
+    manifest_path = args.manifest_path
+    refresh_manifest = args.refresh_manifest
+    watch = args.watch
+    poll_interval = args.poll_interval
+    watch_timeout = args.watch_timeout
+    pair_mapping_path = args.pair_mapping
+    coords_cache = args.coords_cache
+    thresholds = args.thresholds
+    metrics_out = args.metrics_out
+    profile_out = args.profile_out
 
-    if not af_folder.is_dir():
+    if thresholds is not None:
+        try:
+            thresholds = sorted({float(t) for t in thresholds.split(',')})
+        except ValueError:
+            logger.error(f'Thresholds must be comma separated numbers: {thresholds}')
+            sys.exit(1)
+
+    if thresholds is None and af_folder is None:
+        logger.error('AlphaFold predictions folder (-i / --af_folder) is required unless rescoring with --thresholds')
+        sys.exit(1)
+    elif thresholds is None and not af_folder.is_dir():
         logger.error(f'AlphaFold predictions folder does not exist: {af_folder}')
         sys.exit(1)
+    elif thresholds is not None and coords_cache is None:
+        logger.error('Rescoring with --thresholds requires a coordinates cache (--coords_cache)')
+        sys.exit(1)
+    elif thresholds is not None and not coords_cache.is_dir():
+        logger.error(f'Coordinates cache folder does not exist: {coords_cache}')
+        sys.exit(1)
+    elif thresholds is not None and any(t <= 0 for t in thresholds):
+        logger.error(f'Thresholds must be positive: {thresholds}')
+        sys.exit(1)
+    elif coords_cache is not None and watch:
+        logger.error('Watch mode cannot be combined with a coordinates cache')
+        sys.exit(1)
     elif not output_path.parent.is_dir():
         logger.error(f'Output folder does not exist: {output_path.parent}')
         sys.exit(1)
+    elif workers < 1:
+        logger.error(f'Number of workers must be at least 1: {workers}')
+        sys.exit(1)
+    elif chunk_size < 1:
+        logger.error(f'Chunk size must be at least 1: {chunk_size}')
+        sys.exit(1)
+    elif store_path is not None and not store_path.parent.is_dir():
+        logger.error(f'Score store folder does not exist: {store_path.parent}')
+        sys.exit(1)
+    elif top_k is not None and top_k < 1:
+        logger.error(f'Top K must be at least 1: {top_k}')
+        sys.exit(1)
+    elif watch and (store_path is not None or manifest_path is not None):
+        logger.error('Watch mode cannot be combined with a score store or a manifest')
+        sys.exit(1)
+    elif watch and top_k is not None:
+        # The output CSV is the record of scored complexes that a restarted watch resumes from
+        logger.error('Watch mode cannot be combined with --top_k (the output CSV keeps all scored complexes)')
+        sys.exit(1)
+    elif pair_mapping_path is not None and not pair_mapping_path.is_file():
+        logger.error(f'Pair mapping file does not exist: {pair_mapping_path}')
+        sys.exit(1)
+
+    profiler = start_profiler(profile_out)
+
+    pair_mapping = None
+    if pair_mapping_path is not None:
+        pair_mapping = read_pair_mapping(pair_mapping_path)
+        logger.info(f'Number of canonical pairs with redundant pairs: {len(pair_mapping):,}')
+
+    if thresholds is not None:
+        logger.info(f'Recompute DockQ scores from coordinates cache {coords_cache.resolve().as_posix()}')
+        logger.info(f'Contact distance thresholds: {", ".join(f"{t:g}" for t in thresholds)}')
+        rescore_coords_cache(coords_cache, thresholds, output_path, workers, top_k, pair_mapping)
+        finish_metrics(metrics_out, profiler, profile_out)
+        logger.info('DONE')
+        sys.exit(0)
 
     logger.info('Score protein complexes docked with AlphaFold multimer')
     logger.info(f'AlphaFold predictions folder : {af_folder.resolve().as_posix()}')
     logger.info(f'Output CSV path with scores  : {output_path.resolve().as_posix()}')
+    logger.info(f'Number of workers            : {workers:,}')
+    if store_path is not None:
+        logger.info(f'Score store path             : {store_path.resolve().as_posix()}')
+    if coords_cache is not None:
+        logger.info(f'Coordinates cache folder     : {coords_cache.resolve().as_posix()}')
 
-    protein_complex_files = load_protein_complex_files(af_folder)
+    if watch:
+        watch_protein_complexes(
+            af_folder, 
+            output_path, 
+            all_models, 
+            workers, 
+            chunk_size, 
+            poll_interval, 
+            watch_timeout, 
+            pair_mapping,
+        )
+        finish_metrics(metrics_out, profiler, profile_out)
+        logger.info('DONE')
+        sys.exit(0)
+
+    with metrics.timer('list_files'):
+        protein_complex_files = load_protein_complex_files(af_folder, all_models, manifest_path, refresh_manifest)
 
     logger.info(f'Number of protein complexes found: {len(protein_complex_files):,}')
 
-    scores_data = {
-        'id'    : [],
-        'plddt' : [],
-        'ptm'   : [],
-        'iptm'  : [],
-        'dockq' : [],
-    }
-    for i, (complex_id, pdb_path, scores_path) in enumerate(protein_complex_files):
+    all_complex_ids = [complex_id for complex_id, _, _ in protein_complex_files]
+    store, fingerprints = None, {}
+    if store_path is not None:
+        store = ScoreStore(store_path)
+        # Scores of the top ranked model and of all models are stored in different layouts
+        store_options = ['all_models'] if all_models else []
+        with metrics.timer('fingerprint'):
+            stored_fingerprints = store.load_fingerprints()
+            fingerprints = {
+                files[0]: file_fingerprint(get_complex_paths(*files), hash_files, store_options)
+                for files in protein_complex_files
+            }
+        changed_files = [
+            files for files in protein_complex_files
+            if stored_fingerprints.get(files[0]) != fingerprints[files[0]]
+        ]
+        logger.info(
+            f'Number of protein complexes already in score store: '
+            f'{len(all_complex_ids) - len(changed_files):,}'
+        )
+        if coords_cache is not None:
+            # Complexes of the store must also be in the cache, for rescoring with --thresholds
+            with metrics.timer('read_coords_cache_ids'):
+                cached_ids = read_cached_ids(coords_cache) if coords_cache.is_dir() else set()
+            changed_ids = {files[0] for files in changed_files}
+            uncached_files = [
+                files for files in protein_complex_files
+                if files[0] not in changed_ids and files[0] not in cached_ids
+            ]
+            if len(uncached_files) > 0:
+                logger.info(f'Number of stored protein complexes scored again to be cached: {len(uncached_files):,}')
+            changed_files += uncached_files
+        protein_complex_files = changed_files
+        logger.info(f'Number of protein complexes to score: {len(protein_complex_files):,}')
+
+    columns = get_output_columns(all_models)
+    scores_data = {key: [] for key in columns}
+    writer, aggregates_writer = None, None
+    if streaming or top_k is not None:
+        writer = SortedScoresWriter(output_path, columns + ['confidence'], top_k=top_k)
+    if all_models:
+        aggregates_path = get_aggregates_path(output_path)
+        aggregates_writer = SortedScoresWriter(aggregates_path, AGGREGATES_COLUMNS, top_k=top_k, sort_key='confidence_best')
+
+    def add_scores(scores):
+        rows, aggregates = expand_scores(scores, all_models)
+        for row in rows:
+            for out_row in fan_out_rows(row, pair_mapping):
+                if writer is not None:
+                    writer.add(out_row)
+                else:
+                    for key in columns:
+                        scores_data[key].append(out_row.get(key))
+        if aggregates is not None:
+            for out_aggregates in fan_out_rows(aggregates, pair_mapping):
+                aggregates_writer.add(out_aggregates)
+
+    coords_writer = CoordsCacheWriter(coords_cache) if coords_cache is not None else None
+
+    n_failed = 0
+    results = score_protein_complexes(protein_complex_files, workers, chunk_size, all_models, coords_writer is not None)
+    for i, (complex_id, scores, error) in enumerate(results):
         if i == 0 or (i+1) % 100 == 0 or (i+1) == len(protein_complex_files):
             logger.info(f'Scoring protein complex {i+1:,} / {len(protein_complex_files):,}')
 
-        plddt, plddt_avg, ptm, iptm = read_scores_from_json_file(scores_path)
+        if error is not None:
+            logger.error(f'Failed to score protein complex {complex_id}: {error}')
+            n_failed += 1
+            if store is not None:
+                # Stale scores of changed files must not be output
+                store.delete(complex_id)
+            continue
 
-        _, chain_coords, chain_CA_inds, chain_CB_inds = read_pdb(pdb_path)
-        plddt_per_chain = read_plddt_per_chain(plddt, chain_CA_inds)
-        complex_score, num_chains = score_complex(chain_coords, chain_CB_inds, plddt_per_chain)
-        dockq_score = 0
+        if coords_writer is not None:
+            for model_scores in (scores['models'] if all_models else [scores]):
+                coords_writer.add(model_scores.pop('coords'))
 
-        dockq_score = None
-        if num_chains > 2:
-            dockq_score = calculate_mpDockQ(complex_score)
-        elif num_chains == 2:
-            chain_coords, plddt_per_chain = read_pdb_pdockq(pdb_path)
-            dockq_score = calc_pdockq(chain_coords,plddt_per_chain,t=8)
+        if store is not None:
+            store.add(complex_id, fingerprints[complex_id], scores)
+        else:
+            add_scores(scores)
 
-        scores_data['id'].append(complex_id)
-        scores_data['plddt'].append(np.round(plddt_avg, 2))
-        scores_data['ptm'].append(np.round(ptm, 2))
-        scores_data['iptm'].append(np.round(iptm, 2))
-        scores_data['dockq'].append(np.round(dockq_score, 4))
+    if n_failed > 0:
+        logger.warning(f'Number of protein complexes that could not be scored: {n_failed:,}')
+
+    if coords_writer is not None:
+        with metrics.timer('write_coords_cache'):
+            coords_writer.close()
+        logger.info(f'Coordinates of {coords_writer.n_models:,} models cached in {coords_cache.resolve().as_posix()}')
+
+    if store is not None:
+        store.commit()
+        for scores in store.iter_scores(all_complex_ids):
+            add_scores(scores)
+        store.close()
 
     logger.info(f'Exporting sorted scores (best first) in CSV format to {output_path.resolve().as_posix()}')
-    out_df = pd.DataFrame.from_dict(
-        scores_data
-    )
-    out_df['confidence'] = (0.8 * out_df['iptm'] + 0.2 * out_df['ptm']).round(4)
-    out_df.sort_values(
-        'confidence', 
-        ascending=False,
-    ).to_csv(
-        output_path,
-        index=False,
-    )
+    with metrics.timer('write_output'):
+        if writer is not None:
+            writer.close()
+        else:
+            write_sorted_scores(scores_data, output_path)
 
+        if aggregates_writer is not None:
+            logger.info(f'Exporting per complex aggregates of model scores to {aggregates_path.resolve().as_posix()}')
+            aggregates_writer.close()
+
+    finish_metrics(metrics_out, profiler, profile_out)
     logger.info('DONE')
     sys.exit(0)
 
 
-def load_protein_complex_files(af_folder : Path) -> List[Tuple[str, Path, Path]]:
+SCORES_COLUMNS = ['id', 'plddt', 'ptm', 'iptm', 'dockq', 'pae_if_mean', 'pae_if_min', 'ipsae']
+AGGREGATES_COLUMNS = ['id', 'n_models'] + [
+    f'{key}_{agg}' for key in ['dockq', 'iptm', 'confidence'] for agg in ['best', 'mean', 'std']
+]
+
+
+def get_output_columns(all_models : bool) -> List[str]:
+    if all_models:
+        return ['id', 'model', 'rank'] + SCORES_COLUMNS[1:]
+    return SCORES_COLUMNS
+
+
+def get_aggregates_path(output_path : Path) -> Path:
+    return output_path.with_name(f'{output_path.stem}_per_complex.csv')
+
+
+def expand_scores(scores : dict, all_models : bool) -> Tuple[List[dict], Optional[dict]]:
+    """
+    Output rows (with confidence) from the scores of a complex, 
+    along with per complex aggregates when all models are scored.
+    """
+    if not all_models:
+        return [{**scores, 'confidence': compute_confidence(scores['iptm'], scores['ptm'])}], None
+
+    models = [
+        {**model_scores, 'confidence': compute_confidence(model_scores['iptm'], model_scores['ptm'])}
+        for model_scores in scores['models']
+    ]
+    return models, aggregate_model_scores(scores['id'], models)
+
+
+DONE_RE = re.compile(r'^(.+)\.done\.txt$')
+WATCH_FILES_RE = re.compile(r'(?:\.done\.txt|_rank_\d+_.+\.(?:pdb|json))$')
+
+
+def watch_protein_complexes(
+    af_folder : Path,
+    output_path : Path,
+    all_models : bool,
+    workers : int,
+    chunk_size : int,
+    poll_interval : float,
+    watch_timeout : Optional[float],
+    pair_mapping : Optional[Dict[str, List[Tuple[str, bool]]]] = None,
+):
+    """
+    Score protein complexes as ColabFold finishes them, i.e. as <id>.done.txt markers appear.
+
+    Scores are appended to the output CSV (and the per complex CSV when scoring all models)
+    as soon as they are computed. Complexes already in an existing output CSV are not scored again,
+    so an interrupted watch can be restarted. Outputs are sorted by confidence when watching stops.
+    """
+    columns = get_output_columns(all_models) + ['confidence']
+    outputs = [(output_path, columns, 'confidence')]
+    if all_models:
+        outputs.append((get_aggregates_path(output_path), AGGREGATES_COLUMNS, 'confidence_best'))
+
+    scored_ids = read_scored_ids(output_path, columns)
+    if len(scored_ids) > 0:
+        logger.info(f'Number of protein complexes already in output CSV: {len(scored_ids):,}')
+
+    out_files = []
+    for path, path_columns, _ in outputs:
+        is_new = not path.is_file() or path.stat().st_size == 0
+        f_out = path.open('a', newline='')
+        if is_new:
+            csv.writer(f_out, lineterminator='\n').writerow(path_columns)
+        out_files.append(f_out)
+
+    failed_ids = set()
+    last_new_time = time.monotonic()
+    logger.info(f'Watching {af_folder.resolve().as_posix()} for finished predictions (Ctrl-C to stop)')
+    try:
+        while True:
+            files = list_files(af_folder, WATCH_FILES_RE)
+            done_ids = {m[1] for m in (DONE_RE.match(p.name) for p in files) if m is not None}
+            new_ids = done_ids - scored_ids - failed_ids
+
+            if len(new_ids) > 0:
+                last_new_time = time.monotonic()
+                protein_complex_files = [
+                    f for f in group_protein_complex_files(files, all_models)
+                    if f[0] in new_ids
+                ]
+                missing_ids = new_ids - {f[0] for f in protein_complex_files}
+                for complex_id in sorted(missing_ids):
+                    logger.error(f'No model files found for finished protein complex {complex_id}')
+                failed_ids |= missing_ids
+
+                logger.info(f'Scoring {len(protein_complex_files):,} newly finished protein complexes')
+                results = score_protein_complexes(protein_complex_files, workers, chunk_size, all_models)
+                for complex_id, scores, error in results:
+                    if error is not None:
+                        logger.error(f'Failed to score protein complex {complex_id}: {error}')
+                        failed_ids.add(complex_id)
+                        continue
+
+                    rows, aggregates = expand_scores(scores, all_models)
+                    writer = csv.writer(out_files[0], lineterminator='\n')
+                    for row in rows:
+                        for out_row in fan_out_rows(row, pair_mapping):
+                            writer.writerow([out_row.get(c) for c in columns])
+                    if aggregates is not None:
+                        aggregates_writer = csv.writer(out_files[1], lineterminator='\n')
+                        for out_aggregates in fan_out_rows(aggregates, pair_mapping):
+                            aggregates_writer.writerow([out_aggregates.get(c) for c in AGGREGATES_COLUMNS])
+                    scored_ids.add(complex_id)
+
+                for f_out in out_files:
+                    f_out.flush()
+                logger.info(f'Number of protein complexes scored so far: {len(scored_ids):,}')
+
+            elif watch_timeout is not None and time.monotonic() - last_new_time > watch_timeout:
+                logger.info(f'No new finished protein complex in {watch_timeout:,g} seconds: stop watching')
+                break
+
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        logger.info('Stop watching')
+    finally:
+        for f_out in out_files:
+            f_out.close()
+
+    if len(failed_ids) > 0:
+        logger.warning(f'Number of protein complexes that could not be scored: {len(failed_ids):,}')
+
+    for path, path_columns, sort_key in outputs:
+        logger.info(f'Sorting scores (best first) in {path.resolve().as_posix()}')
+        sort_scores_csv(path, path_columns, sort_key)
+
+
+def read_scored_ids(output_path : Path, columns : List[str]) -> set:
+    """
+    Ids of protein complexes in an existing output CSV, to resume watching.
+    """
+    if not output_path.is_file() or output_path.stat().st_size == 0:
+        return set()
+
+    with output_path.open('r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        if header != columns:
+            raise ValueError(f'Existing output CSV has different columns: {output_path}')
+        return {row[0] for row in reader}
+
+
+def sort_scores_csv(path : Path, columns : List[str], sort_key : str):
+    """
+    Sort a CSV of scores in place, with bounded memory.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    writer = SortedScoresWriter(tmp_path, columns, sort_key=sort_key)
+    with path.open('r', newline='') as f:
+        for row in csv.DictReader(f):
+            row[sort_key] = float(row[sort_key]) if row[sort_key] != '' else None
+            writer.add(row)
+    writer.close()
+    os.replace(tmp_path, path)
+
+
+def score_protein_complexes(
+    protein_complex_files : list, 
+    workers : int = 1,
+    chunk_size : int = 16,
+    all_models : bool = False,
+    keep_coords : bool = False,
+) -> Iterator[Tuple[str, Optional[dict], Optional[str]]]:
+    """
+    Score protein complexes, optionally spread over a pool of worker processes.
+    With `keep_coords`, the scores of each model include the coordinates to cache (key 'coords').
+
+    Yields tuples (complex_id, scores, error) in the same order as the input. 
+    A complex that fails to score yields `scores = None` along with the error message.
+    Metrics recorded by worker processes are merged into the metrics of the main process.
+    """
+    score_fn = score_protein_complex_all_models if all_models else score_protein_complex_files
+    if keep_coords:
+        score_fn = functools.partial(score_fn, keep_coords=True)
+    if workers <= 1:
+        for files in protein_complex_files:
+            yield score_fn(files)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.imap(functools.partial(call_with_metrics, score_fn), protein_complex_files, chunksize=chunk_size)
+        for result, worker_metrics in results:
+            metrics.merge(worker_metrics)
+            yield result
+
+
+def score_protein_complex_files(
+    files : Tuple[str, Path, Path], 
+    keep_coords : bool = False,
+) -> Tuple[str, Optional[dict], Optional[str]]:
+    """
+    Score one protein complex from its PDB and JSON score files.
+    Exceptions are caught and returned so that one bad complex does not abort the whole run.
+    """
+    complex_id, pdb_path, scores_path = files
+    try:
+        with metrics.timer('score_complex', complex_id):
+            pae_path = get_pae_path(complex_id, scores_path)
+            if pae_path.is_file():
+                pae_source = (pae_path, 'predicted_aligned_error')
+            else:
+                pae_source = (scores_path, 'pae')
+
+            [scores] = score_models([pdb_path], [scores_path], [pae_source], keep_coords)
+    except Exception as e:
+        metrics.count('complexes_failed')
+        return complex_id, None, f'{type(e).__name__}: {e}'
+
+    if keep_coords:
+        scores['coords'] = scores['coords']._replace(id=complex_id)
+    return complex_id, {'id': complex_id, **scores}, None
+
+
+def score_protein_complex_all_models(
+    files : Tuple[str, List[Path], List[Path]], 
+    keep_coords : bool = False,
+) -> Tuple[str, Optional[dict], Optional[str]]:
+    """
+    Score all models of one protein complex. 
+    Scores are returned as {'id': complex_id, 'models': [scores of each model]}.
+    """
+    complex_id, pdb_paths, scores_paths = files
+    try:
+        with metrics.timer('score_complex', complex_id):
+            models_scores = score_models(pdb_paths, scores_paths, [(p, 'pae') for p in scores_paths], keep_coords)
+    except Exception as e:
+        metrics.count('complexes_failed')
+        return complex_id, None, f'{type(e).__name__}: {e}'
+
+    models = []
+    for scores_path, scores in zip(scores_paths, models_scores):
+        model_name = get_model_name(complex_id, scores_path)
+        if keep_coords:
+            scores['coords'] = scores['coords']._replace(id=complex_id, model=model_name)
+        models.append({
+            'id'    : complex_id,
+            'model' : model_name,
+            'rank'  : int(model_name.split('_')[1]),
+            **scores,
+        })
+    return complex_id, {'id': complex_id, 'models': models}, None
+
+
+def score_models(
+    pdb_paths : List[Path], 
+    scores_paths : List[Path], 
+    pae_sources : List[Tuple[Path, str]], 
+    keep_coords : bool = False,
+) -> List[dict]:
+    """
+    Score the models of a protein complex.
+    With `keep_coords`, the scores of each model include the coordinates to cache (key 'coords', id to be filled in).
+
+    Models of the same complex share chain layout, so their coordinates are stacked
+    and the contacts of all models are computed in one batch.
+    """
+    with metrics.timer('read_pdb'):
+        models_atoms = [read_pdb_atoms(p) for p in pdb_paths]
+    with metrics.timer('read_scores_json'):
+        models_json_scores = [read_scores_from_json_file(p) for p in scores_paths]
+    metrics.count('models', len(models_atoms))
+    metrics.count('atoms', sum(len(atoms.chain) for atoms in models_atoms))
+
+    # Group models with identical atoms (normally all of them)
+    layouts = collections.defaultdict(list)
+    for m, atoms in enumerate(models_atoms):
+        layouts[(atoms.chain.tobytes(), atoms.atom_name.tobytes())].append(m)
+
+    dockq_scores = [None] * len(models_atoms)
+    for model_inds in layouts.values():
+        dockq_batch = score_models_batch(
+            [models_atoms[m] for m in model_inds], 
+            [models_json_scores[m][0] for m in model_inds],
+        )
+        for m, dockq_score in zip(model_inds, dockq_batch):
+            dockq_scores[m] = dockq_score
+
+    _, chain_CA_inds, _ = split_chains_from_atoms(models_atoms[0])
+    chain_lengths = get_chain_lengths(chain_CA_inds)
+
+    output = []
+    for m, (json_scores, pae_source, dockq_score) in enumerate(zip(models_json_scores, pae_sources, dockq_scores)):
+        _, plddt_avg, ptm, iptm = json_scores
+
+        pae = None
+        try:
+            with metrics.timer('read_pae'):
+                pae = read_pae_matrix(*pae_source)
+        except Exception as e:
+            metrics.count('pae_failed')
+            logger.warning(f'Failed to read PAE matrix from {pae_source[0]}: {type(e).__name__}: {e}')
+
+        pae_if_mean, pae_if_min, ipsae = None, None, None
+        if pae is not None:
+            with metrics.timer('interface_pae'):
+                pae_if_mean, pae_if_min, ipsae = calc_interface_pae(pae, chain_lengths)
+
+        output.append({
+            'plddt' : round(float(plddt_avg), 2),
+            'ptm'   : round(float(ptm), 2),
+            'iptm'  : round(float(iptm), 2),
+            'dockq' : round(float(dockq_score), 4) if dockq_score is not None else None,
+            'pae_if_mean' : round(float(pae_if_mean), 2) if pae_if_mean is not None else None,
+            'pae_if_min'  : round(float(pae_if_min), 2) if pae_if_min is not None else None,
+            'ipsae'       : round(float(ipsae), 4) if ipsae is not None else None,
+        })
+        if keep_coords:
+            output[-1]['coords'] = extract_model_coords(
+                models_atoms[m], json_scores[0], output[-1]['iptm'], output[-1]['ptm'],
+            )
+
+    return output
+
+
+def extract_model_coords(atoms : 'PdbAtoms', plddt : np.ndarray, iptm : float, ptm : float) -> CachedModel:
+    """
+    Per chain CB coordinates (CA for glycine), their pLDDT from the B-factor column and per residue pLDDT,
+    i.e. everything pDockQ / mpDockQ are computed from.
+    """
+    chain_atom_inds = split_atoms_per_chain(atoms)
+    _, chain_CA_inds, chain_CB_inds = split_chains_from_atoms(atoms)
+    chains = [*chain_atom_inds.keys()]
+    chain_CB_atom_inds = [chain_atom_inds[chain][chain_CB_inds[chain]] for chain in chains]
+    plddt_per_chain = read_plddt_per_chain(plddt, chain_CA_inds)
+    return CachedModel(
+        id='',
+        model='',
+        iptm=iptm,
+        ptm=ptm,
+        chains=chains,
+        cb_coords=[atoms.coords[inds] for inds in chain_CB_atom_inds],
+        cb_plddt=[atoms.b_factor[inds] for inds in chain_CB_atom_inds],
+        res_plddt=[plddt_per_chain[chain] for chain in chains],
+    )
+
+
+def rescore_coords_cache(
+    coords_cache : Path,
+    thresholds : List[float],
+    output_path : Path,
+    workers : int = 1,
+    top_k : Optional[int] = None,
+    pair_mapping : Optional[Dict[str, List[Tuple[str, bool]]]] = None,
+):
+    """
+    Recompute pDockQ / mpDockQ of all models in a coordinates cache for each contact distance threshold,
+    and write them sorted by confidence. Models cached more than once are taken from the latest bundle.
+    """
+    bundle_paths = list_coords_bundles(coords_cache)
+    logger.info(f'Number of coordinates bundles found: {len(bundle_paths):,}')
+
+    has_models = False
+    for bundle_path in bundle_paths:
+        has_models = has_models or bool((load_bundle_array(bundle_path, 'models') != '').any())
+    dockq_columns = [get_dockq_column(t) for t in thresholds]
+    columns = ['id'] + (['model'] if has_models else []) + ['iptm', 'ptm'] + dockq_columns
+
+    # Latest bundles first, so that the latest scores of a model are kept
+    seen = set()
+    with SortedScoresWriter(output_path, columns + ['confidence'], top_k=top_k) as writer:
+        for rows in rescore_coords_bundles(bundle_paths[::-1], thresholds, workers):
+            for row in rows:
+                key = (row['id'], row.get('model'))
+                if key in seen:
+                    continue
+                seen.add(key)
+                row['confidence'] = compute_confidence(row['iptm'], row['ptm'])
+                for out_row in fan_out_rows(row, pair_mapping):
+                    writer.add(out_row)
+        logger.info(f'Exporting rescored models (best first) in CSV format to {output_path.resolve().as_posix()}')
+
+    logger.info(f'Number of models rescored: {len(seen):,}')
+
+
+def rescore_coords_bundles(bundle_paths : List[Path], thresholds : List[float], workers : int = 1) -> Iterator[List[dict]]:
+    """
+    Rescore coordinates bundles, optionally spread over a pool of worker processes (one bundle at a time).
+    Yields the rows of each bundle in the same order as the input.
+    """
+    rescore_fn = functools.partial(rescore_coords_bundle, thresholds=thresholds)
+    if workers <= 1:
+        for bundle_path in bundle_paths:
+            yield rescore_fn(bundle_path)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        for rows, worker_metrics in pool.imap(functools.partial(call_with_metrics, rescore_fn), bundle_paths):
+            metrics.merge(worker_metrics)
+            yield rows
+
+
+def get_dockq_column(t : float) -> str:
+    return f'dockq_{t:g}'
+
+
+def rescore_coords_bundle(bundle_path : Path, thresholds : List[float]) -> List[dict]:
+    """
+    pDockQ / mpDockQ of the models of a coordinates bundle for each threshold.
+    """
+    rows = []
+    with metrics.timer('rescore_bundle', bundle_path.name):
+        for model in read_coords_bundle(bundle_path):
+            row = {'id': model.id, 'model': model.model, 'iptm': model.iptm, 'ptm': model.ptm}
+            for t, dockq_score in zip(thresholds, calc_dockq_thresholds(model, thresholds)):
+                row[get_dockq_column(t)] = round(float(dockq_score), 4) if dockq_score is not None else None
+            rows.append(row)
+    metrics.count('models', len(rows))
+    metrics.count('files_read')
+    return rows
+
+
+def calc_dockq_thresholds(model : CachedModel, thresholds : List[float]) -> List[Optional[float]]:
+    """
+    pDockQ (2 chains) or mpDockQ (>2 chains) of a cached model for each contact distance threshold.
+
+    Contacts are searched once at the largest threshold. Contacts at a smaller threshold are the subset at
+    distance at most that threshold: distances are computed with the same operations as `find_contacts`
+    and the subset keeps the same order, so scores are identical to searching at each threshold.
+    """
+    n_chains = len(model.chains)
+    if n_chains < 2:
+        return [None for _ in thresholds]
+
+    with metrics.timer('contacts'):
+        pair_contacts = find_chain_pair_contacts([c.reshape(1, -1, 3) for c in model.cb_coords], t=max(thresholds))
+    pair_dists = {}
+    for (i, j), [contacts] in pair_contacts.items():
+        a_min_b = model.cb_coords[i][contacts[:, 0]] - model.cb_coords[j][contacts[:, 1]]
+        pair_dists[(i, j)] = np.sqrt(np.sum(a_min_b.T ** 2, axis=0))
+
+    dockq_scores = []
+    for t in thresholds:
+        contacts_t = {pair: contacts[pair_dists[pair] <= t] for pair, [contacts] in pair_contacts.items()}
+        if n_chains > 2:
+            dockq_scores.append(calculate_mpDockQ(calc_complex_score(contacts_t, model.res_plddt)))
+        else:
+            dockq_scores.append(calc_pdockq_from_contacts(contacts_t[(0, 1)], model.cb_plddt[0], model.cb_plddt[1]))
+    return dockq_scores
+
+
+def score_models_batch(models_atoms : List['PdbAtoms'], models_plddt : List[np.ndarray]) -> List[Optional[float]]:
+    """
+    pDockQ (2 chains) or mpDockQ (>2 chains) of models sharing the same atoms.
+    """
+    chain_atom_inds = split_atoms_per_chain(models_atoms[0])
+    _, chain_CA_inds, chain_CB_inds = split_chains_from_atoms(models_atoms[0])
+    chains = [*chain_atom_inds.keys()]
+    chain_CB_atom_inds = [chain_atom_inds[chain][chain_CB_inds[chain]] for chain in chains]
+
+    coords = np.stack([atoms.coords for atoms in models_atoms])
+    with metrics.timer('contacts'):
+        pair_contacts = find_chain_pair_contacts([coords[:, inds] for inds in chain_CB_atom_inds], t=8)
+    metrics.count('contacts', sum(len(c) for contacts in pair_contacts.values() for c in contacts))
+
+    dockq_scores = []
+    for m, (atoms, plddt) in enumerate(zip(models_atoms, models_plddt)):
+        dockq_score = None
+        if len(chains) > 2:
+            plddt_per_chain = read_plddt_per_chain(plddt, chain_CA_inds)
+            complex_score = calc_complex_score(
+                {pair: contacts[m] for pair, contacts in pair_contacts.items()},
+                [plddt_per_chain[chain] for chain in chains],
+            )
+            dockq_score = calculate_mpDockQ(complex_score)
+        elif len(chains) == 2:
+            dockq_score = calc_pdockq_from_contacts(
+                pair_contacts[(0, 1)][m],
+                atoms.b_factor[chain_CB_atom_inds[0]],
+                atoms.b_factor[chain_CB_atom_inds[1]],
+            )
+        dockq_scores.append(dockq_score)
+
+    return dockq_scores
+
+
+def aggregate_model_scores(complex_id : str, models : List[dict]) -> dict:
+    """
+    Per complex aggregates of model scores: best, mean and spread (standard deviation).
+    """
+    aggregates = {'id': complex_id, 'n_models': len(models)}
+    for key in ['dockq', 'iptm', 'confidence']:
+        values = np.array([m[key] for m in models if m.get(key) is not None], dtype=np.float64)
+        if len(values) == 0:
+            aggregates.update({f'{key}_best': None, f'{key}_mean': None, f'{key}_std': None})
+        else:
+            aggregates[f'{key}_best'] = round(float(values.max()), 4)
+            aggregates[f'{key}_mean'] = round(float(values.mean()), 4)
+            aggregates[f'{key}_std'] = round(float(values.std()), 4)
+    return aggregates
+
+
+MODEL_FILES_RE = re.compile(r'_rank_\d+_.+\.(?:pdb|json)$')
+PDB_RE = re.compile(r'^(.+)_[^_]+_(rank_(\d+)_.+)\.pdb$')
+SCORES_RE = re.compile(r'^(.+)_scores_(rank_(\d+)_.+)\.json$')
+
+
+def load_protein_complex_files(
+    af_folder : Path, 
+    all_models : bool = False,
+    manifest_path : Optional[Path] = None,
+    refresh_manifest : bool = False,
+) -> list:
     """
     Iterate through AF predictions folder and find the PDB and JSON score files of the rank 1 model.
+
+    With `all_models=True`, files of all ranked models are returned as 
+    (complex_id, [pdb_paths], [scores_paths]), with models in rank order.
     """
-    id_to_files = collections.defaultdict(dict)
-    for p in af_folder.iterdir():
-        if p.is_file():
-            pdb_match = re.match(r'^(.+)_[^_]+_rank_001_.+.pdb$', p.name)
-            scores_match = re.match(r'^(.+)_scores_rank_001_.+.json$', p.name)
-            if pdb_match is not None:
-                id_to_files[pdb_match[1]]['pdb'] = p
-            elif scores_match is not None:
-                id_to_files[scores_match[1]]['scores'] = p
+    model_files = list_files(af_folder, MODEL_FILES_RE, manifest_path=manifest_path, refresh=refresh_manifest)
+    return group_protein_complex_files(model_files, all_models)
+
+
+def group_protein_complex_files(model_files : List[Path], all_models : bool = False) -> list:
+    """
+    Group PDB and JSON score files per protein complex (see `load_protein_complex_files`).
+    Files that are neither are ignored.
+    """
+    id_to_files = collections.defaultdict(lambda: collections.defaultdict(dict))
+    for p in model_files:
+        if p.name.endswith('.pdb'):
+            pdb_match = PDB_RE.match(p.name)
+            if pdb_match is not None and (all_models or pdb_match[3] == '001'):
+                id_to_files[pdb_match[1]][pdb_match[2]]['pdb'] = p
+        elif p.name.endswith('.json'):
+            scores_match = SCORES_RE.match(p.name)
+            if scores_match is not None and (all_models or scores_match[3] == '001'):
+                id_to_files[scores_match[1]][scores_match[2]]['scores'] = p
 
     output = []
     for complex_id in id_to_files.keys():
-        dct = id_to_files[complex_id]
-        if 'pdb' not in dct:
-            logger.warning(f'No PDB file found for complex {complex_id}. Skipping.')
-        elif 'scores' not in dct:
-            logger.warning(f'No JSON scores file found for complex {complex_id}. Skipping.')
+        pdb_paths, scores_paths = [], []
+        for model_name in sorted(id_to_files[complex_id].keys()):
+            dct = id_to_files[complex_id][model_name]
+            if 'pdb' not in dct:
+                logger.warning(f'No PDB file found for complex {complex_id} ({model_name}). Skipping.')
+            elif 'scores' not in dct:
+                logger.warning(f'No JSON scores file found for complex {complex_id} ({model_name}). Skipping.')
+            else:
+                pdb_paths.append(dct['pdb'])
+                scores_paths.append(dct['scores'])
+
+        if len(pdb_paths) == 0:
+            continue
+        elif all_models:
+            output.append((complex_id, pdb_paths, scores_paths))
         else:
-            output.append((complex_id, dct['pdb'], dct['scores']))
+            output.append((complex_id, pdb_paths[0], scores_paths[0]))
 
     return output
 
 
+def get_model_name(complex_id : str, scores_path : Path) -> str:
+    """
+    Model name of a JSON scores file, e.g. rank_001_alphafold2_multimer_v3_model_1_seed_000
+    """
+    return scores_path.name[len(f'{complex_id}_scores_'):-len('.json')]
+
+
+def get_complex_paths(complex_id : str, pdb_path, scores_path) -> List[Path]:
+    """
+    All input files of a complex (single model or all models), used to fingerprint it.
+    The separate PAE file is only read for the top model, so it is not part of the all-models fingerprint.
+    """
+    if isinstance(pdb_path, list):
+        return pdb_path + scores_path
+    pae_path = get_pae_path(complex_id, scores_path)
+    return [pdb_path, scores_path] + ([pae_path] if pae_path.is_file() else [])
+
+
 def read_scores_from_json_file(json_scores : Path) -> Tuple[float, float, float]:
     with open(json_scores, 'r') as f:
         scores_dict = json.load(f)
+        metrics.count('bytes_read', f.tell())
+        metrics.count('files_read')
 
     plddt = np.array(scores_dict.get('plddt', []), dtype=np.float32)
     plddt_avg = plddt.mean()
@@ -156,75 +1009,309 @@ def read_scores_from_json_file(json_scores : Path) -> Tuple[float, float, float]
     return plddt, plddt_avg, ptm, iptm
 
 
-###
-# Except explicitly noted, functions below are adapted from AlphaPulldown v1.0.4;
-# https://github.com/KosinskiLab/AlphaPulldown/blob/1.0.4/alphapulldown/analysis_pipeline/calculate_mpdockq.py
-###
+class PdbAtoms(NamedTuple):
+    """
+    Columnar representation of the ATOM records of a PDB file.
+    """
+    chain     : np.ndarray  # (N,) str
+    atom_name : np.ndarray  # (N,) str
+    res_name  : np.ndarray  # (N,) str
+    coords    : np.ndarray  # (N, 3) float64
+    b_factor  : np.ndarray  # (N,) float64
+
+
+def read_pdb_atoms(pdbfile) -> PdbAtoms:
+    """
+    Read all ATOM records of a PDB file in a single pass into NumPy arrays.
+
+    Fields are sliced out of the fixed-width records in bulk rather than line by line.
+    """
+    with open(pdbfile, 'rb') as f:
+        lines = [line for line in f if line.startswith(b'ATOM')]
+        metrics.count('bytes_read', f.tell())
+        metrics.count('files_read')
+
+    records = np.array(lines, dtype='S80').view(np.uint8).reshape(-1, 80)
+
+    def column(start, end):
+        return np.ascontiguousarray(records[:, start:end]).view(f'S{end - start}').ravel()
+
+    return PdbAtoms(
+        chain=column(21, 22).astype('U1'),
+        atom_name=np.char.strip(column(12, 16).astype('U4')),
+        res_name=np.char.strip(column(17, 20).astype('U3')),
+        coords=np.stack([
+            column(30, 38).astype(np.float64),
+            column(38, 46).astype(np.float64),
+            column(46, 54).astype(np.float64),
+        ], axis=1),
+        b_factor=column(60, 66).astype(np.float64),
+    )
+
+
+def split_atoms_per_chain(atoms : PdbAtoms) -> Dict[str, np.ndarray]:
+    """
+    Return the indices of the atoms of each chain, with chains in order of appearance in the file.
+    """
+    chains, first_index = np.unique(atoms.chain, return_index=True)
+    return {
+        str(chain): np.flatnonzero(atoms.chain == chain)
+        for chain in chains[np.argsort(first_index)]
+    }
+
+
+def is_CB_atom(atoms : PdbAtoms) -> np.ndarray:
+    """
+    CB atoms, or CA for glycine.
+    """
+    return (atoms.atom_name == 'CB') | ((atoms.atom_name == 'CA') & (atoms.res_name == 'GLY'))
+
 
 def read_pdb(pdbfile):
     """
-    Read a pdb file per chain.
+    Read a pdb file per chain: ATOM lines, coordinates of all atoms and indices of CA and CB atoms.
+    Kept for callers of the line based parser; scoring uses `split_chains_from_atoms` on parsed atoms.
     """
     pdb_chains = {}
+    with open(pdbfile) as file:
+        for line in file:
+            if line.startswith('ATOM'):
+                pdb_chains.setdefault(line[21], []).append(line)
+
+    chain_coords, chain_CA_inds, chain_CB_inds = split_chains_from_atoms(read_pdb_atoms(pdbfile))
+    return pdb_chains, chain_coords, chain_CA_inds, chain_CB_inds
+
+
+def split_chains_from_atoms(atoms : PdbAtoms):
+    """
+    Get per chain coordinates of all atoms along with the indices of CA and CB atoms (mpDockQ path).
+    """
     chain_coords = {}
     chain_CA_inds = {}
     chain_CB_inds = {}
+    is_CA = atoms.atom_name == 'CA'
+    is_CB = is_CB_atom(atoms)
+    for chain, inds in split_atoms_per_chain(atoms).items():
+        chain_coords[chain] = atoms.coords[inds]
+        chain_CA_inds[chain] = np.flatnonzero(is_CA[inds])
+        chain_CB_inds[chain] = np.flatnonzero(is_CB[inds])
 
-    with open(pdbfile) as file:
-        for line in file:
-            if 'ATOM' in line:
-                record = parse_atm_record(line)
-                if record['chain'] in [*pdb_chains.keys()]:
-                    pdb_chains[record['chain']].append(line)
-                    chain_coords[record['chain']].append([record['x'],record['y'],record['z']])
-                    coord_ind+=1
-                    if record['atm_name'] == 'CA':
-                        chain_CA_inds[record['chain']].append(coord_ind)
-                    if record['atm_name'] == 'CB' or (record['atm_name'] == 'CA' and record['res_name'] == 'GLY'):
-                        chain_CB_inds[record['chain']].append(coord_ind)
-                else:
-                    pdb_chains[record['chain']] = [line]
-                    chain_coords[record['chain']]= [[record['x'],record['y'],record['z']]]
-                    chain_CA_inds[record['chain']]= []
-                    chain_CB_inds[record['chain']]= []
-                    # Reset coord ind
-                    coord_ind = 0
+    return chain_coords, chain_CA_inds, chain_CB_inds
 
-    return pdb_chains, chain_coords, chain_CA_inds, chain_CB_inds
+
+def read_pdb_pdockq(pdbfile):
+    """
+    Read a pdb file predicted with AF and rewritten to contain all chains.
+    Adepted from FoldDock repo:
+    https://gitlab.com/ElofssonLab/FoldDock/-/blob/main/src/pdockq.py#L34-59
+    """
+    return split_pdockq_chains_from_atoms(read_pdb_atoms(pdbfile))
 
 
-def parse_atm_record(line):
+def split_pdockq_chains_from_atoms(atoms : PdbAtoms):
     """
-    Get the atm record.
+    Get per chain CB coordinates (CA for glycine) and their pLDDT from the B-factor column (pDockQ path).
     """
-    record = collections.defaultdict()
-    record['name'] = line[0:6].strip()
-    record['atm_no'] = int(line[6:11].strip())
-    record['atm_name'] = line[12:16].strip()
-    record['atm_alt'] = line[17]
-    record['res_name'] = line[17:20].strip()
-    record['chain'] = line[21]
-    record['res_no'] = int(line[22:26].strip())
-    record['insert'] = line[26].strip()
-    record['resid'] = line[22:29]
-    record['x'] = float(line[30:38])
-    record['y'] = float(line[38:46])
-    record['z'] = float(line[46:54])
-    record['occ'] = float(line[54:60])
-    record['B'] = float(line[60:66])
-    return record
+    chain_coords, chain_plddt = {}, {}
+    is_CB = is_CB_atom(atoms)
+    for chain, inds in split_atoms_per_chain(atoms).items():
+        CB_inds = inds[is_CB[inds]]
+        chain_coords[chain] = atoms.coords[CB_inds]
+        chain_plddt[chain] = atoms.b_factor[CB_inds]
 
+    return chain_coords, chain_plddt
 
-def read_plddt_per_chain(plddt, chain_CA_inds):
+
+def find_contacts(coords1 : np.ndarray, coords2 : np.ndarray, t : float = 8) -> np.ndarray:
     """
-    Get the plDDT for each chain.
+    Find all pairs (i, j) such that the distance between coords1[i] and coords2[j] is at most t.
+
+    Uses a cell list with cells of size t, so only points in neighbouring cells are compared 
+    instead of building the full distance matrix. Distances are computed with the same operations 
+    as the dense implementation, and pairs are returned in the same (row-major) order as 
+    `np.argwhere(dists <= t)`, so results are identical.
+    """
+    coords1 = np.asarray(coords1, dtype=np.float64).reshape(1, -1, 3)
+    coords2 = np.asarray(coords2, dtype=np.float64).reshape(1, -1, 3)
+    return find_contacts_batched(coords1, coords2, t)[0]
+
+
+def find_contacts_batched(coords1 : np.ndarray, coords2 : np.ndarray, t : float = 8) -> List[np.ndarray]:
+    """
+    Same as `find_contacts` for a batch of M models sharing the same layout, 
+    with coords1 of shape (M, l1, 3) and coords2 of shape (M, l2, 3). 
+    Contacts of all models are searched in a single pass: the model index is part of the cell key
+    so that points of different models are never compared. Returns one array of contacts per model.
+    """
+    n_models, l1, l2 = coords1.shape[0], coords1.shape[1], coords2.shape[1]
+    if l1 == 0 or l2 == 0:
+        return [np.empty((0, 2), dtype=np.int64) for _ in range(n_models)]
+
+    flat_coords1 = coords1.reshape(-1, 3)
+    flat_coords2 = coords2.reshape(-1, 3)
+
+    # Integer cell coordinates, shifted so that neighbouring cells of every point are non-negative
+    cells1 = np.floor(flat_coords1 / t).astype(np.int64)
+    cells2 = np.floor(flat_coords2 / t).astype(np.int64)
+    cell_min = np.minimum(cells1.min(axis=0), cells2.min(axis=0)) - 1
+    cells1 -= cell_min
+    cells2 -= cell_min
+    dims = np.maximum(cells1.max(axis=0), cells2.max(axis=0)) + 2
+    strides = np.array([dims[1] * dims[2], dims[2], 1], dtype=np.int64)
+    model_keys1 = np.repeat(np.arange(n_models, dtype=np.int64), l1) * np.prod(dims)
+    model_keys2 = np.repeat(np.arange(n_models, dtype=np.int64), l2) * np.prod(dims)
+
+    keys2 = cells2 @ strides + model_keys2
+    order2 = np.argsort(keys2, kind='stable')
+    sorted_keys2 = keys2[order2]
+
+    candidates_i, candidates_j = [], []
+    for offset in np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1])).T.reshape(-1, 3):
+        neighbour_keys = (cells1 + offset) @ strides + model_keys1
+        start = np.searchsorted(sorted_keys2, neighbour_keys, side='left')
+        end = np.searchsorted(sorted_keys2, neighbour_keys, side='right')
+        counts = end - start
+        total = counts.sum()
+        if total == 0:
+            continue
+
+        # Expand each [start, end) range into explicit candidate pairs
+        inds1 = np.repeat(np.arange(len(flat_coords1)), counts)
+        range_offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates_i.append(inds1)
+        candidates_j.append(order2[np.repeat(start, counts) + range_offsets])
+
+    if len(candidates_i) == 0:
+        return [np.empty((0, 2), dtype=np.int64) for _ in range(n_models)]
+
+    inds1 = np.concatenate(candidates_i)
+    inds2 = np.concatenate(candidates_j)
+    a_min_b = flat_coords1[inds1] - flat_coords2[inds2]
+    dists = np.sqrt(np.sum(a_min_b.T ** 2, axis=0))
+    is_contact = dists <= t
+    inds1, inds2 = inds1[is_contact], inds2[is_contact]
+
+    order = np.lexsort((inds2, inds1))
+    inds1, inds2 = inds1[order], inds2[order]
+
+    # Split per model and convert back to indices within each model
+    models = inds1 // l1
+    splits = np.cumsum(np.bincount(models, minlength=n_models))[:-1]
+    contacts = np.stack([inds1 - models * l1, inds2 - models * l2], axis=1)
+    return np.split(contacts, splits)
+
+
+def find_chain_pair_contacts(chain_CB_coords : List[np.ndarray], t : float = 8) -> Dict[Tuple[int, int], List[np.ndarray]]:
+    """
+    Contacts between each unordered pair of chains (i, j), i < j, for a batch of models.
+    `chain_CB_coords` holds one array of shape (M, l, 3) per chain. 
+    Returns one array of contacts per model for each pair.
+    """
+    pair_contacts = {}
+    for i in range(len(chain_CB_coords)):
+        for j in range(i+1, len(chain_CB_coords)):
+            pair_contacts[(i, j)] = find_contacts_batched(chain_CB_coords[i], chain_CB_coords[j], t)
+    return pair_contacts
+
+
+def get_pae_path(complex_id : str, scores_path : Path) -> Path:
+    return scores_path.parent / f'{complex_id}_predicted_aligned_error_v1.json'
+
+
+def read_pae_matrix(json_path : Path, key : str) -> Optional[np.ndarray]:
+    """
+    Read a square PAE matrix stored under `key` in a JSON file directly into a float32 array.
+
+    The nested list is located in the raw bytes and its numbers parsed in bulk by NumPy (see json_arrays.py),
+    avoiding the list of lists of Python floats that `json.load` would create.
+    Returns None if the key is not present.
+    """
+    with open(json_path, 'rb') as f:
+        raw = f.read()
+    metrics.count('bytes_read', len(raw))
+    metrics.count('files_read')
+
+    if raw.find(f'"{key}"'.encode()) < 0:
+        return None
+    return parse_float_matrix(find_json_array(raw, key))
+
+
+def calc_d0(n : np.ndarray) -> np.ndarray:
+    """
+    TM-score d0 for a number of residues n, floored at 27 residues (as in ipSAE).
+    """
+    n = np.maximum(n, 27).astype(np.float32)
+    return np.maximum(1.24 * np.cbrt(n - 15) - 1.8, 1.0)
+
+
+def calc_interface_pae(
+    pae : np.ndarray, 
+    chain_lengths : Dict[str, int], 
+    pae_cutoff : float = 10,
+) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+    """
+    Interface PAE metrics of a complex, restricted to inter-chain residue pairs:
+    - mean and min inter-chain PAE
+    - ipSAE: for each ordered chain pair (A, B) and residue i of A, the pTM-like score over the 
+      residues j of B with PAE(i, j) < pae_cutoff, with d0 based on the number of such residues;
+      the score of the complex is the max over residues and chain pairs.
+      [Dunbrack, 2025](https://doi.org/10.1101/2025.02.10.637595)
+    All three are None if the complex has a single chain.
+    """
+    lengths = np.array([*chain_lengths.values()])
+    if pae.shape[0] != lengths.sum():
+        raise ValueError(f'PAE matrix size ({pae.shape[0]:,}) does not match number of residues ({lengths.sum():,})')
+
+    labels = np.repeat(np.arange(len(lengths)), lengths)
+    is_inter_chain = labels[:, np.newaxis] != labels[np.newaxis, :]
+    if not is_inter_chain.any():
+        return None, None, None
+
+    inter_chain_pae = pae[is_inter_chain]
+    pae_if_mean = inter_chain_pae.mean(dtype=np.float64)
+    pae_if_min = inter_chain_pae.min()
+
+    ipsae = 0.
+    boundaries = np.concatenate([[0], np.cumsum(lengths)])
+    for a in range(len(lengths)):
+        rows = slice(boundaries[a], boundaries[a+1])
+        for b in range(len(lengths)):
+            if a == b:
+                continue
+            block = pae[rows, boundaries[b]:boundaries[b+1]]
+            is_valid = block < pae_cutoff
+            n0 = is_valid.sum(axis=1)
+            d0 = calc_d0(n0)
+            ptm_terms = np.where(is_valid, 1 / (1 + (block / d0[:, np.newaxis]) ** 2), 0)
+            ipsae_per_residue = ptm_terms.sum(axis=1) / np.maximum(n0, 1)
+            ipsae = max(ipsae, float(ipsae_per_residue.max()))
+
+    return pae_if_mean, pae_if_min, ipsae
+
+
+###
+# Except explicitly noted, functions below are adapted from AlphaPulldown v1.0.4;
+# https://github.com/KosinskiLab/AlphaPulldown/blob/1.0.4/alphapulldown/analysis_pipeline/calculate_mpdockq.py
+###
+
+def get_chain_lengths(chain_CA_inds):
+    """
+    Get the number of residues of each chain, in chain order.
     """
     chain_names = chain_CA_inds.keys()
     chain_lengths = dict()
     for name in chain_names:
         curr_len = len(chain_CA_inds[name])
         chain_lengths[name] = curr_len
-    
+    return chain_lengths
+
+
+def read_plddt_per_chain(plddt, chain_CA_inds):
+    """
+    Get the plDDT for each chain.
+    """
+    chain_lengths = get_chain_lengths(chain_CA_inds)
+
     plddt_per_chain = dict()
     curr_len = 0
     for k, v in chain_lengths.items():
@@ -244,34 +1331,49 @@ def score_complex(path_coords, path_CB_inds, path_plddt):
     """
 
     chains = [*path_coords.keys()]
-    chain_inds = np.arange(len(chains))
+    chain_CB_coords = [
+        np.array(path_coords[chain])[path_CB_inds[chain]].reshape(1, -1, 3)
+        for chain in chains
+    ]
+    pair_contacts = find_chain_pair_contacts(chain_CB_coords, t=8)
+    complex_score = calc_complex_score(
+        {pair: contacts[0] for pair, contacts in pair_contacts.items()},
+        [path_plddt[chain] for chain in chains],
+    )
+    return complex_score, len(chains)
+
+
+def calc_complex_score(pair_contacts, chain_plddts):
+    """
+    Sum of log10(number of contacts + 1) * average interface plDDT over all interfaces of a complex,
+    from the contacts of each unordered chain pair (as computed by `find_chain_pair_contacts`).
+    """
+    # Contacts are symmetric: each unordered chain pair is computed once
+    # and the score term of both orderings is derived from it.
+    interface_scores = {}
+    for (i, int_i), contacts in pair_contacts.items():
+        chain_plddt = chain_plddts[i]
+        int_chain_plddt = chain_plddts[int_i]
+        # The first axis contains the contacts from chain 1
+        # The second the contacts from chain 2
+        if contacts.shape[0] > 0:
+            n_contacts_term = np.log10(contacts.shape[0]+1)
+            av_if_plDDT = np.concatenate((chain_plddt[contacts[:,0]], int_chain_plddt[contacts[:,1]])).mean()
+            interface_scores[(i, int_i)] = n_contacts_term*av_if_plDDT
+
+            reverse_contacts = contacts[np.lexsort((contacts[:,0], contacts[:,1]))]
+            av_if_plDDT = np.concatenate((int_chain_plddt[reverse_contacts[:,1]], chain_plddt[reverse_contacts[:,0]])).mean()
+            interface_scores[(int_i, i)] = n_contacts_term*av_if_plDDT
+
+    # Sum in the same order as the original all ordered pairs loop
+    chain_inds = np.arange(len(chain_plddts))
     complex_score = 0
-    # Get interfaces per chain
     for i in chain_inds:
-        chain_i = chains[i]
-        chain_coords = np.array(path_coords[chain_i])
-        chain_CB_inds = path_CB_inds[chain_i]
-        l1 = len(chain_CB_inds)
-        chain_CB_coords = chain_coords[chain_CB_inds]
-        chain_plddt = path_plddt[chain_i]
- 
         for int_i in np.setdiff1d(chain_inds, i):
-            int_chain = chains[int_i]
-            int_chain_CB_coords = np.array(path_coords[int_chain])[path_CB_inds[int_chain]]
-            int_chain_plddt = path_plddt[int_chain]
-            # Calc 2-norm
-            mat = np.append(chain_CB_coords,int_chain_CB_coords,axis=0)
-            a_min_b = mat[:,np.newaxis,:] -mat[np.newaxis,:,:]
-            dists = np.sqrt(np.sum(a_min_b.T ** 2, axis=0)).T
-            contact_dists = dists[:l1,l1:]
-            contacts = np.argwhere(contact_dists <= 8)
-            # The first axis contains the contacts from chain 1
-            # The second the contacts from chain 2
-            if contacts.shape[0] > 0:
-                av_if_plDDT = np.concatenate((chain_plddt[contacts[:,0]], int_chain_plddt[contacts[:,1]])).mean()
-                complex_score += np.log10(contacts.shape[0]+1)*av_if_plDDT
+            if (i, int_i) in interface_scores:
+                complex_score += interface_scores[(i, int_i)]
 
-    return complex_score, len(chains)
+    return complex_score
 
 
 def calculate_mpDockQ(complex_score):
@@ -291,35 +1393,6 @@ def calculate_mpDockQ(complex_score):
     return L/(1+math.exp(-1*k*(complex_score-x_0))) + b
 
 
-def read_pdb_pdockq(pdbfile):
-    """
-    Read a pdb file predicted with AF and rewritten to contain all chains.
-    Adepted from FoldDock repo:
-    https://gitlab.com/ElofssonLab/FoldDock/-/blob/main/src/pdockq.py#L34-59
-    """
-    chain_coords, chain_plddt = {}, {}
-    with open(pdbfile, 'r') as file:
-        for line in file:
-            if not line.startswith('ATOM'):
-                continue
-            record = parse_atm_record(line)
-            # Get CB - CA for GLY
-            if record['atm_name']=='CB' or (record['atm_name']=='CA' and record['res_name']=='GLY'):
-                if record['chain'] in [*chain_coords.keys()]:
-                    chain_coords[record['chain']].append([record['x'],record['y'],record['z']])
-                    chain_plddt[record['chain']].append(record['B'])
-                else:
-                    chain_coords[record['chain']] = [[record['x'],record['y'],record['z']]]
-                    chain_plddt[record['chain']] = [record['B']]
-
-    # Convert to arrays
-    for chain in chain_coords:
-        chain_coords[chain] = np.array(chain_coords[chain])
-        chain_plddt[chain] = np.array(chain_plddt[chain])
-
-    return chain_coords, chain_plddt
-
-
 def calc_pdockq(chain_coords, chain_plddt, t):
     """
     Calculate the pDockQ scores
@@ -334,14 +1407,15 @@ def calc_pdockq(chain_coords, chain_plddt, t):
     coords1, coords2 = chain_coords[ch1], chain_coords[ch2]
     plddt1, plddt2 = chain_plddt[ch1], chain_plddt[ch2]
 
-    # Calc 2-norm
-    mat = np.append(coords1, coords2,axis=0)
-    a_min_b = mat[:,np.newaxis,:] -mat[np.newaxis,:,:]
-    dists = np.sqrt(np.sum(a_min_b.T ** 2, axis=0)).T
-    l1 = len(coords1)
-    contact_dists = dists[:l1,l1:] # upper triangular --> first dim = chain 1
-    contacts = np.argwhere(contact_dists<=t)
+    contacts = find_contacts(coords1, coords2, t=t) # first dim = chain 1
+
+    return calc_pdockq_from_contacts(contacts, plddt1, plddt2)
+
 
+def calc_pdockq_from_contacts(contacts, plddt1, plddt2):
+    """
+    pDockQ from the contacts between two chains and the plDDT of their CB atoms.
+    """
     if contacts.shape[0] < 1:
         pdockq = 0
     else:
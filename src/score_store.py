@@ -0,0 +1,126 @@
+"""
+Persistent SQLite store of scores, used to make scoring incremental and resumable.
+
+Each scored structure is stored along with a fingerprint of its input files (size and modification
+time, or a content hash). On a rerun, only structures that are new or whose input files changed
+need to be scored again. Scores are committed in batches so that a killed run resumes from the
+last committed batch. Structures that fail to be scored are removed from the store, and failed or
+partial scores are never stored, so that they are scored again on the next run.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+def file_fingerprint(paths : Iterable[Path], content_hash : bool = False, options : Iterable[str] = ()) -> str:
+    """
+    Fingerprint of a set of input files.
+
+    By default based on file size and modification time, which only requires a `stat` per file.
+    With `content_hash=True`, the files are read and hashed instead (robust to copies and `touch`).
+    `options` are the scoring options that change the stored scores (e.g. extra score names), so that
+    structures stored with other options are scored again instead of missing scores.
+    """
+    options = sorted(options)
+    parts = [f'options:{",".join(options)}'] if len(options) > 0 else []
+    for path in paths:
+        if content_hash:
+            h = hashlib.blake2b(digest_size=16)
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            parts.append(h.hexdigest())
+        else:
+            stat = Path(path).stat()
+            parts.append(f'{stat.st_size}:{stat.st_mtime_ns}')
+    return '|'.join(parts)
+
+
+class ScoreStore:
+    """
+    Scores keyed by structure id, along with the fingerprint of the files they were computed from.
+    """
+
+    def __init__(self, db_path : Path, batch_size : int = 500):
+        self.db_path = Path(db_path)
+        self.batch_size = batch_size
+        self._pending : List[Tuple[str, str, str, float]] = []
+
+        self.conn = sqlite3.connect(self.db_path.as_posix())
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS scores ('
+            'id TEXT PRIMARY KEY, '
+            'fingerprint TEXT NOT NULL, '
+            'scores TEXT NOT NULL, '
+            'updated_at REAL NOT NULL'
+            ')'
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load_fingerprints(self) -> Dict[str, str]:
+        return dict(self.conn.execute('SELECT id, fingerprint FROM scores'))
+
+    def add(self, structure_id : str, fingerprint : str, scores : dict):
+        """
+        Add scores of a structure. Committed to disk every `batch_size` additions.
+        """
+        self._pending.append((structure_id, fingerprint, json.dumps(scores), time.time()))
+        if len(self._pending) >= self.batch_size:
+            self.commit()
+
+    def delete(self, structure_id : str):
+        """
+        Remove the scores of a structure, e.g. one that could not be scored again after its files changed,
+        so that stale scores are not output.
+        """
+        self.commit()
+        with self.conn:
+            self.conn.execute('DELETE FROM scores WHERE id = ?', (structure_id,))
+
+    def commit(self):
+        if len(self._pending) == 0:
+            return
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO scores (id, fingerprint, scores, updated_at) VALUES (?, ?, ?, ?)',
+                self._pending,
+            )
+        self._pending = []
+
+    def iter_scores(self, structure_ids : Optional[List[str]] = None) -> Iterator[dict]:
+        """
+        Iterate through stored scores. If `structure_ids` is given, only these structures are returned,
+        in the same order (structures missing from the store are skipped).
+        """
+        if structure_ids is None:
+            for (scores,) in self.conn.execute('SELECT scores FROM scores ORDER BY id'):
+                yield json.loads(scores)
+            return
+
+        query_size = 500
+        for start in range(0, len(structure_ids), query_size):
+            ids = structure_ids[start:start+query_size]
+            placeholders = ', '.join('?' * len(ids))
+            rows = dict(self.conn.execute(f'SELECT id, scores FROM scores WHERE id IN ({placeholders})', ids))
+            for structure_id in ids:
+                if structure_id in rows:
+                    yield json.loads(rows[structure_id])
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,104 @@
+"""
+Assembled pair MSAs must have the layout of ColabFold complex MSAs: the query, rows paired by taxonomy
+(best hit of each chain per taxon with hits in every chain), then the unpaired MSA of each chain padded with gaps.
+"""
+import subprocess
+import sys
+
+from src.make_input_fasta import get_chain_id
+from tests.test_score_store import REPO_ROOT, run_script
+
+
+SEQ_A, SEQ_B = 'MKVLA', 'GSTW'
+
+MSA_A = [
+    ('UniRef100_P1 OX=9606', 'MKVLS'),
+    ('UniRef100_P2', 'MRVL-'),              # Taxonomy id from the map: 10090
+    ('UniRef100_P3 OX=9606', 'MKILA'),      # Second hit of 9606
+    ('UniRef100_P4 OX=7227', 'MKV--'),      # No hit of 7227 in chain B
+]
+MSA_B = [
+    ('UniRef100_Q1', 'GSTY'),               # Taxonomy id from the map: 10090
+    ('UniRef100_Q2 OX=9606', 'GATW'),
+    ('UniRef100_Q3 OX=4932', 'GS-W'),       # No hit of 4932 in chain A
+]
+
+PAIRED_LINES = [
+    '>UniRef100_P1 OX=9606\tUniRef100_Q2 OX=9606',
+    'MKVLSGATW',
+    '>UniRef100_P2\tUniRef100_Q1',
+    'MRVL-GSTY',
+]
+UNPAIRED_LINES = [
+    '>A__B', 'MKVLA----',
+    '>UniRef100_P1 OX=9606', 'MKVLS----',
+    '>UniRef100_P2', 'MRVL-----',
+    '>UniRef100_P3 OX=9606', 'MKILA----',
+    '>UniRef100_P4 OX=7227', 'MKV------',
+    '>A__B', '-----GSTW',
+    '>UniRef100_Q1', '-----GSTY',
+    '>UniRef100_Q2 OX=9606', '-----GATW',
+    '>UniRef100_Q3 OX=4932', '-----GS-W',
+]
+
+
+def write_inputs(tmp_path):
+    msa_folder = tmp_path / 'msas'
+    msa_folder.mkdir()
+    for seq, msa in [(SEQ_A, MSA_A), (SEQ_B, MSA_B)]:
+        records = [(get_chain_id(seq), seq), *msa]
+        (msa_folder / f'{get_chain_id(seq)}.a3m').write_text(
+            f'#{len(seq)}\t1\n' + ''.join(f'>{header}\n{aligned_seq}\n' for header, aligned_seq in records)
+        )
+
+    pairs_path = tmp_path / 'targets_pulldown.fasta'
+    pairs_path.write_text(f'>A__B\n{SEQ_A}:{SEQ_B}\n')
+    taxonomy_map_path = tmp_path / 'taxonomy.tsv'
+    taxonomy_map_path.write_text('P2\t10090\nUniRef100_Q1\tNCBI_TaxID\t10090\nQ1\tGene_Name\tXYZ\n')
+    output_folder = tmp_path / 'output'
+    output_folder.mkdir()
+    return ['-p', pairs_path, '-m', msa_folder, '-o', output_folder], taxonomy_map_path, output_folder
+
+
+def read_lines(path):
+    return path.read_text().splitlines()
+
+
+def test_paired_layout(tmp_path):
+    args, taxonomy_map_path, output_folder = write_inputs(tmp_path)
+    run_script('src.assemble_pair_msas', *args, '--taxonomy_map', taxonomy_map_path)
+
+    assert read_lines(output_folder / 'A__B.a3m') == [
+        '#5,4\t1,1',
+        '>A__B\tA__B',
+        'MKVLAGSTW',
+        *PAIRED_LINES,
+        *UNPAIRED_LINES,
+    ]
+
+
+def test_unpaired_only(tmp_path):
+    args, taxonomy_map_path, output_folder = write_inputs(tmp_path)
+    run_script('src.assemble_pair_msas', *args, '--unpaired_only')
+
+    assert read_lines(output_folder / 'A__B.a3m') == [
+        '#5,4\t1,1',
+        '>A__B\tA__B',
+        'MKVLAGSTW',
+        *UNPAIRED_LINES,
+    ]
+
+
+def test_no_paired_rows(tmp_path):
+    # Without the taxonomy map, only 9606 has hits in both chains
+    args, _, output_folder = write_inputs(tmp_path)
+    run_script('src.assemble_pair_msas', *args)
+    assert read_lines(output_folder / 'A__B.a3m')[3:5] == PAIRED_LINES[:2]
+
+    # Without any taxon in common, the script fails instead of silently writing unpaired MSAs
+    msa_b_path = tmp_path / 'msas' / f'{get_chain_id(SEQ_B)}.a3m'
+    msa_b_path.write_text(msa_b_path.read_text().replace('OX=9606', 'OX=9598'))
+    cmd = [sys.executable, '-m', 'src.assemble_pair_msas', *(str(a) for a in args)]
+    result = subprocess.run(cmd, cwd=REPO_ROOT, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert 'No pair has paired rows' in result.stderr
@@ -0,0 +1,156 @@
+"""
+The cell-list contact search must give pDockQ / mpDockQ bit-for-bit identical to the dense distance matrix
+implementation it replaced (adapted from FoldDock and MoLPC, kept below as the reference).
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.score_protein_complex import (
+    calc_complex_score,
+    calc_pdockq,
+    calculate_mpDockQ,
+    find_chain_pair_contacts,
+    load_protein_complex_files,
+    read_pdb_atoms,
+    read_plddt_per_chain,
+    read_scores_from_json_file,
+    score_complex,
+    score_models_batch,
+    split_chains_from_atoms,
+    split_pdockq_chains_from_atoms,
+)
+
+
+EXAMPLE_DATA = Path(__file__).resolve().parent.parent / 'example_data'
+THRESHOLDS = [4, 6, 8, 10, 12]
+
+
+def dense_score_complex(path_coords, path_CB_inds, path_plddt, t=8):
+    chains = [*path_coords.keys()]
+    chain_inds = np.arange(len(chains))
+    complex_score = 0
+    for i in chain_inds:
+        chain_i = chains[i]
+        chain_coords = np.array(path_coords[chain_i])
+        chain_CB_inds = path_CB_inds[chain_i]
+        l1 = len(chain_CB_inds)
+        chain_CB_coords = chain_coords[chain_CB_inds]
+        chain_plddt = path_plddt[chain_i]
+
+        for int_i in np.setdiff1d(chain_inds, i):
+            int_chain = chains[int_i]
+            int_chain_CB_coords = np.array(path_coords[int_chain])[path_CB_inds[int_chain]]
+            int_chain_plddt = path_plddt[int_chain]
+            mat = np.append(chain_CB_coords,int_chain_CB_coords,axis=0)
+            a_min_b = mat[:,np.newaxis,:] -mat[np.newaxis,:,:]
+            dists = np.sqrt(np.sum(a_min_b.T ** 2, axis=0)).T
+            contact_dists = dists[:l1,l1:]
+            contacts = np.argwhere(contact_dists <= t)
+            if contacts.shape[0] > 0:
+                av_if_plDDT = np.concatenate((chain_plddt[contacts[:,0]], int_chain_plddt[contacts[:,1]])).mean()
+                complex_score += np.log10(contacts.shape[0]+1)*av_if_plDDT
+
+    return complex_score, len(chains)
+
+
+def dense_calc_pdockq(chain_coords, chain_plddt, t):
+    ch1, ch2 = [*chain_coords.keys()]
+    coords1, coords2 = chain_coords[ch1], chain_coords[ch2]
+    plddt1, plddt2 = chain_plddt[ch1], chain_plddt[ch2]
+
+    mat = np.append(coords1, coords2,axis=0)
+    a_min_b = mat[:,np.newaxis,:] -mat[np.newaxis,:,:]
+    dists = np.sqrt(np.sum(a_min_b.T ** 2, axis=0)).T
+    l1 = len(coords1)
+    contact_dists = dists[:l1,l1:]
+    contacts = np.argwhere(contact_dists<=t)
+
+    if contacts.shape[0] < 1:
+        pdockq = 0
+    else:
+        avg_if_plddt = np.average(np.concatenate([plddt1[np.unique(contacts[:,0])], plddt2[np.unique(contacts[:,1])]]))
+        n_if_contacts = contacts.shape[0]
+        x = avg_if_plddt*np.log10(n_if_contacts)
+        pdockq = 0.724 / (1 + np.exp(-0.052*(x-152.611)))+0.018
+
+    return pdockq
+
+
+def random_complex(rng, n_chains, on_grid=False):
+    """
+    Per chain CB coordinates (random walks packed next to each other, in PDB precision),
+    their pLDDT from the B-factor column (float64) and per residue pLDDT from JSON scores (float32).
+    On a grid of 2 Å, many distances are exactly equal to the thresholds.
+    """
+    chain_coords, chain_bfactors, chain_plddts = {}, {}, {}
+    for c in range(n_chains):
+        length = int(rng.integers(1, 120))
+        if on_grid:
+            coords = 2. * rng.integers(-6, 7, size=(length, 3)) + np.array([4. * c, 0, 0])
+        else:
+            steps = rng.normal(size=(length, 3))
+            steps = 3.8 * steps / np.linalg.norm(steps, axis=1, keepdims=True)
+            coords = np.round(np.cumsum(steps, axis=0) + rng.normal(scale=4, size=3) + np.array([10. * c, 0, 0]), 3)
+        chain = chr(ord('A') + c)
+        chain_coords[chain] = coords
+        chain_bfactors[chain] = np.round(rng.uniform(20, 95, size=length), 2)
+        chain_plddts[chain] = np.round(rng.uniform(20, 95, size=length), 2).astype(np.float32)
+    return chain_coords, chain_bfactors, chain_plddts
+
+
+def get_example_complexes():
+    return [
+        (read_pdb_atoms(pdb_path), read_scores_from_json_file(scores_path)[0])
+        for _, pdb_path, scores_path in load_protein_complex_files(EXAMPLE_DATA)
+    ]
+
+
+def test_example_data_pdockq():
+    complexes = get_example_complexes()
+    assert len(complexes) > 0
+    for atoms, _ in complexes:
+        chain_coords, chain_plddt = split_pdockq_chains_from_atoms(atoms)
+        for t in THRESHOLDS:
+            assert calc_pdockq(chain_coords, chain_plddt, t) == dense_calc_pdockq(chain_coords, chain_plddt, t)
+
+
+def test_example_data_complex_score():
+    for atoms, plddt in get_example_complexes():
+        chain_coords, chain_CA_inds, chain_CB_inds = split_chains_from_atoms(atoms)
+        plddt_per_chain = read_plddt_per_chain(plddt, chain_CA_inds)
+        assert score_complex(chain_coords, chain_CB_inds, plddt_per_chain) == \
+            dense_score_complex(chain_coords, chain_CB_inds, plddt_per_chain)
+
+
+def test_example_data_score_models_batch():
+    for atoms, plddt in get_example_complexes():
+        chain_coords, chain_CA_inds, chain_CB_inds = split_chains_from_atoms(atoms)
+        if len(chain_coords) == 2:
+            expected = dense_calc_pdockq(*split_pdockq_chains_from_atoms(atoms), t=8)
+        else:
+            plddt_per_chain = read_plddt_per_chain(plddt, chain_CA_inds)
+            expected = calculate_mpDockQ(dense_score_complex(chain_coords, chain_CB_inds, plddt_per_chain)[0])
+        assert score_models_batch([atoms], [plddt]) == [expected]
+
+
+@pytest.mark.parametrize('on_grid', [False, True])
+def test_random_complexes(on_grid):
+    rng = np.random.default_rng(0)
+    for _ in range(150):
+        n_chains = int(rng.integers(2, 6))
+        chain_coords, chain_bfactors, chain_plddts = random_complex(rng, n_chains, on_grid)
+        chains = [*chain_coords.keys()]
+        chain_CB_inds = {chain: np.arange(len(chain_coords[chain])) for chain in chains}
+
+        for t in THRESHOLDS:
+            if n_chains == 2:
+                assert calc_pdockq(chain_coords, chain_bfactors, t) == dense_calc_pdockq(chain_coords, chain_bfactors, t)
+
+            pair_contacts = find_chain_pair_contacts([chain_coords[chain][np.newaxis] for chain in chains], t=t)
+            complex_score = calc_complex_score(
+                {pair: contacts[0] for pair, contacts in pair_contacts.items()},
+                [chain_plddts[chain] for chain in chains],
+            )
+            assert complex_score == dense_score_complex(chain_coords, chain_CB_inds, chain_plddts, t)[0]
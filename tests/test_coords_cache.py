@@ -0,0 +1,67 @@
+"""
+Rescoring from the coordinates cache (--thresholds) must give the same pDockQ / mpDockQ as scoring
+the PDB files at the same contact distance threshold.
+"""
+from pathlib import Path
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.benchmark_scoring import generate_library
+from src.coords_cache import list_coords_bundles, read_coords_bundle
+from src.score_protein_complex import (
+    calculate_mpDockQ,
+    load_protein_complex_files,
+    read_pdb_atoms,
+    read_plddt_per_chain,
+    read_scores_from_json_file,
+    split_chains_from_atoms,
+    split_pdockq_chains_from_atoms,
+)
+from tests.test_contacts import dense_calc_pdockq, dense_score_complex
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+THRESHOLDS = [6, 8, 10]
+
+
+def run_script(*args):
+    cmd = [sys.executable, '-m', 'src.score_protein_complex', *(str(a) for a in args)]
+    result = subprocess.run(cmd, cwd=REPO_ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def score_pdb(pdb_path, scores_path, t):
+    atoms = read_pdb_atoms(pdb_path)
+    chain_coords, chain_CA_inds, chain_CB_inds = split_chains_from_atoms(atoms)
+    if len(chain_coords) == 2:
+        return dense_calc_pdockq(*split_pdockq_chains_from_atoms(atoms), t=t)
+    plddt_per_chain = read_plddt_per_chain(read_scores_from_json_file(scores_path)[0], chain_CA_inds)
+    return calculate_mpDockQ(dense_score_complex(chain_coords, chain_CB_inds, plddt_per_chain, t)[0])
+
+
+@pytest.mark.parametrize('n_chains', [2, 3])
+def test_thresholds_match_pdb_scores(tmp_path, n_chains):
+    af_folder, coords_cache = tmp_path / 'af', tmp_path / 'coords'
+    af_folder.mkdir()
+    generate_library(af_folder, n_complexes=4, n_chains=n_chains, chain_length=40, rng=np.random.default_rng(n_chains))
+    run_script('-i', af_folder, '-o', tmp_path / 'scores.csv', '--coords_cache', coords_cache)
+
+    # Bundles are folders of memory-mapped arrays
+    [bundle_path] = list_coords_bundles(coords_cache)
+    assert bundle_path.is_dir()
+    assert isinstance(next(read_coords_bundle(bundle_path)).cb_coords[0].base, np.memmap)
+
+    rescored_path = tmp_path / 'rescored.csv'
+    run_script('--coords_cache', coords_cache, '--thresholds', ','.join(str(t) for t in THRESHOLDS), '-o', rescored_path)
+    rescored = pd.read_csv(rescored_path).set_index('id')
+
+    complex_files = load_protein_complex_files(af_folder)
+    assert sorted(rescored.index) == sorted(complex_id for complex_id, _, _ in complex_files)
+    for complex_id, pdb_path, scores_path in complex_files:
+        for t in THRESHOLDS:
+            expected = round(float(score_pdb(pdb_path, scores_path, t)), 4)
+            assert rescored.loc[complex_id, f'dockq_{t}'] == expected
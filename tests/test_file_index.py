@@ -0,0 +1,71 @@
+"""
+A file manifest must be reused while the listed folders are unchanged, rebuilt when a file is added to the folder
+or to a subdirectory (recursive mode), and rebuilt regardless with refresh.
+"""
+import os
+import re
+
+from src.file_index import list_files
+
+
+PATTERN = re.compile(r'\.json$')
+
+
+def touch(path):
+    path.write_text('{}')
+
+
+def set_mtime(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_manifest_reuse_and_refresh(tmp_path):
+    folder = tmp_path / 'af'
+    folder.mkdir()
+    for name in ['a.json', 'b.json', 'a.pdb']:
+        touch(folder / name)
+    set_mtime(folder, 1_000_000_000)
+    manifest_path = tmp_path / 'manifest.txt'
+
+    assert list_files(folder, PATTERN, manifest_path=manifest_path) == [folder / 'a.json', folder / 'b.json']
+    assert manifest_path.is_file()
+
+    # A file added without changing the folder mtime is not seen: the manifest is reused...
+    touch(folder / 'c.json')
+    set_mtime(folder, 1_000_000_000)
+    assert list_files(folder, PATTERN, manifest_path=manifest_path) == [folder / 'a.json', folder / 'b.json']
+
+    # ... unless refreshed, which also rewrites the manifest
+    expected = [folder / 'a.json', folder / 'b.json', folder / 'c.json']
+    assert list_files(folder, PATTERN, manifest_path=manifest_path, refresh=True) == expected
+    (folder / 'c.json').unlink()
+    set_mtime(folder, 1_000_000_000)
+    assert list_files(folder, PATTERN, manifest_path=manifest_path) == expected
+
+    # Adding a file changes the folder mtime, so the folder is listed again
+    touch(folder / 'd.json')
+    set_mtime(folder, 2_000_000_000)
+    expected = [folder / 'a.json', folder / 'b.json', folder / 'd.json']
+    assert list_files(folder, PATTERN, manifest_path=manifest_path) == expected
+
+    # Scan parameters are part of the manifest
+    assert list_files(folder, re.compile(r'\.pdb$'), manifest_path=manifest_path) == [folder / 'a.pdb']
+
+
+def test_manifest_recursive(tmp_path):
+    folder = tmp_path / 'af3'
+    for name in ['x', 'y']:
+        (folder / name).mkdir(parents=True)
+        touch(folder / name / f'{name}.json')
+    manifest_path = tmp_path / 'manifest.txt'
+
+    expected = [folder / 'x' / 'x.json', folder / 'y' / 'y.json']
+    assert list_files(folder, PATTERN, recursive=True, workers=2, manifest_path=manifest_path) == expected
+
+    # A file written into an existing subdirectory does not change the root folder, only the subdirectory
+    root_mtime_ns = folder.stat().st_mtime_ns
+    touch(folder / 'y' / 'z.json')
+    set_mtime(folder / 'y', 3_000_000_000)
+    set_mtime(folder, root_mtime_ns)
+    expected.append(folder / 'y' / 'z.json')
+    assert list_files(folder, PATTERN, recursive=True, workers=2, manifest_path=manifest_path) == expected
@@ -0,0 +1,71 @@
+"""
+Interface PAE and ipSAE of a small hand-built PAE matrix, with known low-PAE inter-chain pairs.
+"""
+import numpy as np
+import pytest
+
+from src.score_protein_complex import calc_interface_pae, get_complex_paths
+
+
+# ipSAE d0 of fewer than 27 residues is that of 27 residues
+D0 = 1.24 * 12 ** (1 / 3) - 1.8
+
+
+def ptm_term(pae):
+    return 1 / (1 + (pae / D0) ** 2)
+
+
+def test_interface_pae():
+    # Chain A: residues 0-1, chain B: residues 2-4
+    pae = np.array([
+        [ 0.5,  1.0,  2.0, 20.0,  4.0],
+        [ 1.0,  0.5, 30.0, 30.0, 30.0],
+        [15.0, 12.0,  0.5,  1.0,  1.0],
+        [ 1.0, 25.0,  1.0,  0.5,  1.0],
+        [11.0, 10.0,  1.0,  1.0,  0.5],
+    ], dtype=np.float32)
+    pae_if_mean, pae_if_min, ipsae = calc_interface_pae(pae, {'A': 2, 'B': 3})
+
+    inter_chain = [2.0, 20.0, 4.0, 30.0, 30.0, 30.0, 15.0, 12.0, 1.0, 25.0, 11.0, 10.0]
+    assert pae_if_mean == pytest.approx(np.mean(inter_chain))
+    assert pae_if_min == 1.0
+
+    # A -> B: residue 0 has two pairs under the cutoff (PAE 2 and 4), residue 1 none.
+    # B -> A: residue 3 has one pair (PAE 1), residue 4 none (PAE 10 is not under the cutoff).
+    a_to_b = (ptm_term(2.0) + ptm_term(4.0)) / 2
+    b_to_a = ptm_term(1.0)
+    assert b_to_a > a_to_b
+    assert ipsae == pytest.approx(b_to_a, rel=1e-6)
+
+    # A lower cutoff drops the PAE 4 pair of residue 0
+    _, _, ipsae = calc_interface_pae(pae, {'A': 2, 'B': 3}, pae_cutoff=1.5)
+    assert ipsae == pytest.approx(ptm_term(1.0), rel=1e-6)
+
+
+def test_no_interface():
+    pae = np.full((3, 3), 5.0, dtype=np.float32)
+    assert calc_interface_pae(pae, {'A': 3}) == (None, None, None)
+
+    with pytest.raises(ValueError):
+        calc_interface_pae(np.full((4, 4), 30.0, dtype=np.float32), {'A': 2, 'B': 3})
+
+    # No inter-chain pair under the cutoff
+    pae = np.full((4, 4), 30.0, dtype=np.float32)
+    _, pae_if_min, ipsae = calc_interface_pae(pae, {'A': 2, 'B': 2})
+    assert pae_if_min == 30.0
+    assert ipsae == 0.
+
+
+def test_pae_file_fingerprint(tmp_path):
+    complex_id = 'A__B'
+    pae_path = tmp_path / f'{complex_id}_predicted_aligned_error_v1.json'
+    pae_path.write_text('{}')
+    pdb_paths = [tmp_path / f'{complex_id}_unrelaxed_rank_00{i}.pdb' for i in (1, 2)]
+    scores_paths = [tmp_path / f'{complex_id}_scores_rank_00{i}.json' for i in (1, 2)]
+
+    # The separate PAE file is read for the top model only
+    assert get_complex_paths(complex_id, pdb_paths[0], scores_paths[0]) == [pdb_paths[0], scores_paths[0], pae_path]
+    assert get_complex_paths(complex_id, pdb_paths, scores_paths) == pdb_paths + scores_paths
+
+    pae_path.unlink()
+    assert get_complex_paths(complex_id, pdb_paths[0], scores_paths[0]) == [pdb_paths[0], scores_paths[0]]
@@ -0,0 +1,50 @@
+"""
+JSON arrays must be parsed the same as with json.load, whatever the layout of the file.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from src.json_arrays import find_json_array, parse_float_array, parse_float_matrix, parse_str_array
+
+
+def make_scores(n=7, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        'chain_ids': [chr(ord('A') + i % 3) for i in range(n)],
+        'plddt': np.round(rng.uniform(20, 95, size=n), 2).tolist(),
+        'pae': np.round(rng.uniform(0, 31.75, size=(n, n)), 2).tolist(),
+        'ptm': 0.5,
+    }
+
+
+@pytest.mark.parametrize('indent', [None, 1, 4, '\t'])
+def test_layouts(indent):
+    scores = make_scores()
+    raw = json.dumps(scores, indent=indent).encode()
+    expected = np.array(scores['pae'], dtype=np.float32)
+
+    pae = parse_float_matrix(find_json_array(raw, 'pae'))
+    assert np.array_equal(pae, expected)
+
+    rows = np.array([True, False, False, True, True, False, True])
+    assert np.array_equal(parse_float_matrix(find_json_array(raw, 'pae'), rows), expected[rows])
+
+    plddt = parse_float_array(find_json_array(raw, 'plddt'))
+    assert np.array_equal(plddt, np.array(scores['plddt'], dtype=np.float32))
+    assert parse_str_array(find_json_array(raw, 'chain_ids')).tolist() == [c.encode() for c in scores['chain_ids']]
+
+
+def test_multiline_rows():
+    # Rows broken over several lines, with blank space around brackets and commas
+    raw = b'{"pae": [\n  [ 0.0 ,\n 1.5 ],\r\n  [2.25,\n\n 3 ]\n ]\n, "plddt": [1]}'
+    assert parse_float_matrix(find_json_array(raw, 'pae')).tolist() == [[0.0, 1.5], [2.25, 3.0]]
+    assert parse_float_matrix(find_json_array(raw, 'pae'), np.array([False, True])).tolist() == [[2.25, 3.0]]
+
+
+def test_errors():
+    with pytest.raises(ValueError):
+        find_json_array(b'{"plddt": [1, 2]}', 'pae')
+    with pytest.raises(ValueError):
+        parse_float_matrix(find_json_array(b'{"pae": [[1, 2], [3]]}', 'pae'))
@@ -0,0 +1,79 @@
+"""
+Ligand specs rendered from the serialized template of run_af3_ligand_pulldown.py must be the JSON of
+the base spec with the name, model seeds and ligand entry of each ligand, as built with `json.dumps`.
+"""
+import copy
+import json
+
+import pytest
+
+from src.run_af3_ligand_pulldown import get_job_name, make_spec_template, render_spec, save_json_specs
+
+
+BASE_SPEC = {
+    'name': 'Bait protein',
+    'modelSeeds': [1],
+    'sequences': [
+        {'protein': {
+            'id': ['A', 'B'],
+            'sequence': 'MKVLAAGIVG',
+            'unpairedMsa': '>query\nMKVLAAGIVG\n>hit "1"\tTaxID=9606\nMKVL-AGIVG\n',
+            'pairedMsa': '',
+            'templates': [],
+        }},
+        {'ligand': {'id': 'M', 'ccdCodes': ['MG']}},
+    ],
+    'bondedAtomPairs': None,
+    'dialect': 'alphafold3',
+    'version': 1,
+}
+
+LIGANDS = {
+    'lig1': 'CCO',
+    'lig 2 β': 'C/C=C\\C[C@@H](N)C(=O)O',
+    'lig3': 'c1ccccc1"',
+}
+
+
+def old_spec(base_spec, ligand_id, smiles, model_seeds):
+    """
+    Spec of a ligand as built before templates: deep copy of the base spec with the ligand fields set.
+    """
+    spec = copy.deepcopy(base_spec)
+    spec['name'] = get_job_name(base_spec['name'], ligand_id)
+    spec['modelSeeds'] = model_seeds
+    spec['sequences'].append({'ligand': {'id': 'Z', 'smiles': smiles}})
+    return spec
+
+
+def test_render_spec_matches_json_dumps():
+    spec_template = make_spec_template(BASE_SPEC)
+    for ligand_id, smiles in LIGANDS.items():
+        model_seeds = [3, 14, 15]
+        spec = render_spec(spec_template, {
+            'name': get_job_name(BASE_SPEC['name'], ligand_id),
+            'modelSeeds': model_seeds,
+            'ligand': {'ligand': {'id': 'Z', 'smiles': smiles}},
+        })
+        expected = old_spec(BASE_SPEC, ligand_id, smiles, model_seeds)
+        assert spec == json.dumps(expected, separators=(',', ':')).encode()
+        assert json.loads(spec) == expected
+    # The base spec is left untouched
+    assert len(BASE_SPEC['sequences']) == 2
+
+
+def test_save_json_specs(tmp_path):
+    model_seeds = {ligand_id: [i + 1] for i, ligand_id in enumerate(LIGANDS)}
+    save_json_specs(make_spec_template(BASE_SPEC), BASE_SPEC['name'], LIGANDS, tmp_path, model_seeds)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(f'{ligand_id}.json' for ligand_id in LIGANDS)
+    for ligand_id, smiles in LIGANDS.items():
+        with (tmp_path / f'{ligand_id}.json').open() as f:
+            assert json.load(f) == old_spec(BASE_SPEC, ligand_id, smiles, model_seeds[ligand_id])
+
+
+def test_reserved_placeholders():
+    base_spec = copy.deepcopy(BASE_SPEC)
+    base_spec['sequences'][0]['protein']['unpairedMsa'] = '@@name@@'
+    with pytest.raises(ValueError, match='reserved placeholders'):
+        make_spec_template(base_spec)
@@ -0,0 +1,127 @@
+"""
+Ligands of run_af3_ligand_pulldown.py: rows with a duplicate ID are skipped (and logged),
+ligands are grouped into batches of the requested size, and their token bucket is estimated
+from the number of heavy atoms of their SMILES.
+"""
+import logging
+
+import pytest
+
+from src.run_af3_ligand_pulldown import (
+    AF3_BUCKETS,
+    count_heavy_atoms,
+    count_spec_tokens,
+    get_bucket,
+    group_by_buckets,
+    iter_batches,
+    iter_ligands_csv,
+)
+
+
+def write_ligands(path, rows, header='id,name,smiles'):
+    path.write_text(header + '\n' + ''.join(','.join(row) + '\n' for row in rows))
+    return path
+
+
+def test_duplicate_ligand_ids(tmp_path, caplog):
+    ligands_path = write_ligands(tmp_path / 'ligands.csv', [
+        ('lig1', 'ethanol', 'CCO'),
+        ('lig2', 'benzene', ' c1ccccc1 '),
+        ('lig1', 'methanol', 'CO'),
+        ('lig3', 'water', 'O'),
+        ('lig2', 'benzene', 'c1ccccc1'),
+    ])
+
+    with caplog.at_level(logging.WARNING):
+        ligands = list(iter_ligands_csv(ligands_path, 'id', 'smiles'))
+    assert ligands == [('lig1', 'CCO'), ('lig2', 'c1ccccc1'), ('lig3', 'O')]
+    assert [r.getMessage() for r in caplog.records] == [
+        'Duplicate ligand ID lig1 on line 4: skipping',
+        'Duplicate ligand ID lig2 on line 6: skipping',
+    ]
+
+    # Second pass over the file (bucket histogram) does not log them again
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        assert list(iter_ligands_csv(ligands_path, 'id', 'smiles', record=False)) == ligands
+    assert caplog.records == []
+
+
+def test_missing_columns(tmp_path):
+    ligands_path = write_ligands(tmp_path / 'ligands.csv', [('lig1', 'ethanol', 'CCO')])
+    with pytest.raises(ValueError, match='No ID column'):
+        list(iter_ligands_csv(ligands_path, 'ligand_id', 'smiles'))
+    with pytest.raises(ValueError, match='No SMILES column'):
+        list(iter_ligands_csv(ligands_path, 'id', 'SMILES'))
+
+
+@pytest.mark.parametrize('n_ligands, batch_size, expected_sizes', [
+    (0, 3, []),
+    (1, 3, [1]),
+    (6, 3, [3, 3]),
+    (7, 3, [3, 3, 1]),
+    (5, 1, [1, 1, 1, 1, 1]),
+    (4, 10, [4]),
+])
+def test_batches(n_ligands, batch_size, expected_sizes):
+    ligands = [(f'lig{i}', 'C' * (i + 1)) for i in range(n_ligands)]
+    batches = list(iter_batches(iter(ligands), batch_size))
+    assert [len(batch) for batch in batches] == expected_sizes
+    assert [item for batch in batches for item in batch.items()] == ligands
+
+
+def test_batches_after_duplicates(tmp_path):
+    # Skipped duplicates do not leave holes in batches
+    ligands_path = write_ligands(tmp_path / 'ligands.csv', [
+        (f'lig{i % 4}', f'name{i}', 'C' * (i + 1)) for i in range(7)
+    ] + [('lig4', 'name', 'N'), ('lig5', 'name', 'S')])
+    batches = list(iter_batches(iter_ligands_csv(ligands_path, 'id', 'smiles'), 2))
+    assert [list(batch) for batch in batches] == [['lig0', 'lig1'], ['lig2', 'lig3'], ['lig4', 'lig5']]
+
+
+@pytest.mark.parametrize('smiles, n_atoms', [
+    ('CCO', 3),
+    ('c1ccccc1', 6),                    # Aromatic atoms
+    ('c1ccc2[nH]ccc2c1', 9),            # Indole: aromatic bracket atom with a hydrogen
+    ('ClCC(Br)Cl', 5),                  # Two-letter atoms are one atom each
+    ('BrB', 2),
+    ('[H]OC([H])([H])[H]', 2),          # Explicit hydrogens are not heavy atoms
+    ('[2H]C([2H])([2H])O', 2),          # Nor are isotopes of hydrogen
+    ('[Hg+2].[Cl-].[Cl-]', 3),          # Mercury is not a hydrogen
+    ('C[C@@H](N)C(=O)O', 6),            # Chirality and bonds are not atoms
+    ('[NH4+]', 1),
+    ('O=S(=O)(O)O', 5),
+    ('[Na+].[O-]P(=O)([O-])[O-]', 6),
+    ('', 0),
+])
+def test_count_heavy_atoms(smiles, n_atoms):
+    assert count_heavy_atoms(smiles) == n_atoms
+
+
+def test_count_spec_tokens():
+    spec = {'sequences': [
+        {'protein': {'id': ['A', 'B'], 'sequence': 'MKVLA'}},
+        {'rna': {'id': 'C', 'sequence': 'ACGU'}},
+        {'ligand': {'id': 'L', 'smiles': 'c1ccccc1Cl'}},
+        {'ligand': {'id': 'M', 'ccdCodes': ['ATP']}},
+    ]}
+    assert count_spec_tokens(spec) == 2 * 5 + 4 + 7
+
+
+def test_buckets():
+    assert get_bucket(1, AF3_BUCKETS) == 256
+    assert get_bucket(256, AF3_BUCKETS) == 256
+    assert get_bucket(257, AF3_BUCKETS) == 512
+    assert get_bucket(5121, AF3_BUCKETS) == 5121
+
+    # A 250 residue bait: ligands of up to 6 heavy atoms fit in the 256 bucket
+    n_base_tokens = 250
+    ligands = [('small', 'CCCCCC'), ('chloro', 'ClCCCCCl'), ('hydrogens', '[H]C([H])CCCCC[H]'), ('large', 'C' * 300)]
+    assert [get_bucket(n_base_tokens + count_heavy_atoms(smiles), AF3_BUCKETS) for _, smiles in ligands] == [
+        256, 256, 256, 768,
+    ]
+    assert list(group_by_buckets(iter(ligands), n_base_tokens, AF3_BUCKETS, batch_size=2)) == [
+        (256, {'small': 'CCCCCC', 'chloro': 'ClCCCCCl'}),
+        (256, {'hydrogens': '[H]C([H])CCCCC[H]'}),
+        (768, {'large': 'C' * 300}),
+    ]
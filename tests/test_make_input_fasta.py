@@ -0,0 +1,181 @@
+"""
+Deduplicated pairs must keep one canonical pair per unordered pair of sequences, and map the others to it.
+Balanced shards must have similar estimated cost while keeping padding buckets together.
+Streamed shards must hold all pairs in order, within their pair and residue budgets.
+"""
+import csv
+import gzip
+
+import numpy as np
+import pytest
+
+from src.make_input_fasta import FastaShardWriter, dedup_pairs, get_padded_lengths, plan_shards
+from tests.test_score_store import run_script
+
+
+def read_mapping(mapping_path):
+    with mapping_path.open(newline='') as f:
+        return {row['id']: (row['canonical_id'], row['swapped']) for row in csv.DictReader(f)}
+
+
+def test_dedup_pairs(tmp_path):
+    # B1 and T1 have the same sequence, as do T2 and T3
+    baits = {'B1': 'MKV', 'B2': 'MLL'}
+    targets = {'T1': 'MKV', 'T2': 'MLL', 'T3': 'MLL', 'T4': 'MEE'}
+    mapping_path = tmp_path / 'pair_mapping.csv'
+
+    pair_indices = dedup_pairs(baits, targets, mapping_path)
+
+    pair_ids = [f'{b}__{t}' for b in baits for t in targets]
+    assert [pair_ids[i] for i in pair_indices] == ['B1__T2', 'B1__T4', 'B2__T4']
+    assert read_mapping(mapping_path) == {
+        'B1__T1': ('', '0'),             # Self-pair dropped
+        'B1__T3': ('B1__T2', '0'),       # Same sequences, same order
+        'B2__T1': ('B1__T2', '1'),       # Same sequences, chains in the other order
+        'B2__T2': ('', '0'),
+        'B2__T3': ('', '0'),
+    }
+
+
+def test_dedup_pairs_keep_self_pairs(tmp_path):
+    baits = {'B1': 'MKV', 'B2': 'MKV'}
+    targets = {'T1': 'MKV', 'T2': 'MLL'}
+    mapping_path = tmp_path / 'pair_mapping.csv'
+
+    pair_indices = dedup_pairs(baits, targets, mapping_path, keep_self_pairs=True)
+
+    pair_ids = [f'{b}__{t}' for b in baits for t in targets]
+    assert [pair_ids[i] for i in pair_indices] == ['B1__T1', 'B1__T2']
+    assert read_mapping(mapping_path) == {
+        'B2__T1': ('B1__T1', '0'),
+        'B2__T2': ('B1__T2', '0'),
+    }
+
+
+def shard_costs(lengths, shards, bucket_width=10, cost_exponent=3.):
+    costs = get_padded_lengths(lengths, bucket_width).astype(float) ** cost_exponent
+    return np.array([costs[indices].sum() for indices in shards])
+
+
+def test_plan_shards_one_bucket_per_shard():
+    # 4 buckets of equal cost: 216 pairs of 50 residues, 27 of 100, 8 of 150 and 1 of 300
+    rng = np.random.default_rng(0)
+    lengths = rng.permutation(np.concatenate([np.full(27, 100), np.full(8, 150), np.full(1, 300), np.full(216, 50)]))
+
+    shards = plan_shards(lengths, n_shards=4, bucket_width=10, cost_exponent=3.)
+
+    assert sorted(np.concatenate(shards).tolist()) == list(range(len(lengths)))
+    padded = get_padded_lengths(lengths, 10)
+    assert [np.unique(padded[indices]).tolist() for indices in shards] == [[50], [100], [150], [300]]
+    assert np.all(shard_costs(lengths, shards) == 27_000_000)
+    # Sorted by padded length, then input order
+    for indices in shards:
+        assert indices.tolist() == sorted(indices.tolist())
+
+
+def test_plan_shards_balanced():
+    rng = np.random.default_rng(1)
+    lengths = rng.integers(100, 1500, size=2_000)
+    n_shards = 7
+
+    shards = plan_shards(lengths, n_shards, bucket_width=10, cost_exponent=3.)
+
+    assert len(shards) == n_shards
+    assert sorted(np.concatenate(shards).tolist()) == list(range(len(lengths)))
+    costs = shard_costs(lengths, shards)
+    assert costs.max() / costs.mean() < 1.25
+    # Shards hold consecutive buckets, so at most n_shards - 1 buckets are split across shards
+    padded = get_padded_lengths(lengths, 10)
+    shard_buckets = [set(padded[indices].tolist()) for indices in shards]
+    n_split = sum(len(a & b) for a, b in zip(shard_buckets[:-1], shard_buckets[1:]))
+    assert n_split <= n_shards - 1
+    for a, b in zip(shards[:-1], shards[1:]):
+        assert padded[a].max() <= padded[b].min()
+
+
+def test_plan_shards_few_pairs():
+    lengths = np.array([120, 80])
+    shards = plan_shards(lengths, n_shards=5, bucket_width=10, cost_exponent=3.)
+    assert [indices.tolist() for indices in shards] == [[1], [0]]
+    assert plan_shards(np.array([], dtype=np.int64), 3, 10, 3.) == []
+
+
+def read_fasta_pairs(path):
+    open_fn = gzip.open if path.suffix == '.gz' else open
+    with open_fn(path, 'rt') as f:
+        lines = f.read().splitlines()
+    return [(header[1:], seqs) for header, seqs in zip(lines[::2], lines[1::2])]
+
+
+def write_shards(tmp_path, pairs, max_pairs=None, max_residues=None, compress=False):
+    with FastaShardWriter(tmp_path, 'targets_pulldown', max_pairs, max_residues, compress) as writer:
+        for pair_id, seq_a, seq_b in pairs:
+            writer.write(pair_id, seq_a, seq_b)
+    return writer
+
+
+@pytest.mark.parametrize('max_pairs, max_residues, expected_sizes', [
+    (3, None, [3, 3, 1]),
+    (None, 20, [2, 1, 2, 2]),       # The 24 residue pair gets a shard of its own
+    (1, None, [1] * 7),
+    (2, 16, [2, 1, 1, 1, 2]),
+    (10, 1_000, [7]),
+])
+def test_fasta_shard_writer(tmp_path, max_pairs, max_residues, expected_sizes):
+    lengths = [(3, 5), (4, 4), (12, 12), (5, 5), (6, 2), (7, 7), (1, 1)]
+    pairs = [(f'B{i}__T{i}', 'M' * a, 'K' * b) for i, (a, b) in enumerate(lengths)]
+
+    writer = write_shards(tmp_path, pairs, max_pairs, max_residues)
+
+    assert [n_pairs for _, n_pairs, _ in writer.shards] == expected_sizes
+    assert writer.n_pairs_total == len(pairs)
+    assert [path.name for path, _, _ in writer.shards] == [
+        f'targets_pulldown_shard_{i:05d}.fasta' for i in range(len(expected_sizes))
+    ]
+    assert sorted(tmp_path.iterdir()) == [path for path, _, _ in writer.shards]
+
+    written = []
+    for path, n_pairs, n_residues in writer.shards:
+        shard_pairs = read_fasta_pairs(path)
+        assert len(shard_pairs) == n_pairs
+        assert n_residues == sum(len(seqs) - 1 for _, seqs in shard_pairs)
+        if max_residues is not None and n_pairs > 1:
+            assert n_residues <= max_residues
+        written.extend(shard_pairs)
+    assert written == [(pair_id, f'{a}:{b}') for pair_id, a, b in pairs]
+
+
+def test_fasta_shard_writer_gzip(tmp_path):
+    pairs = [(f'B{i}__T0', 'M' * (i + 1), 'KK') for i in range(5)]
+    writer = write_shards(tmp_path, pairs, max_pairs=2, compress=True)
+    assert [path.name for path, _, _ in writer.shards] == [
+        f'targets_pulldown_shard_{i:05d}.fasta.gz' for i in range(3)
+    ]
+    assert [p for path, _, _ in writer.shards for p in read_fasta_pairs(path)] == [
+        (pair_id, f'{a}:{b}') for pair_id, a, b in pairs
+    ]
+
+
+def test_streamed_shards(tmp_path):
+    (tmp_path / 'baits.fasta').write_text('>B1\nMKV\n>B2\nMLLLL\n')
+    (tmp_path / 'targets.fasta').write_text('>T1\nMEE\n>T2\nMRRRRRR\n>T3\nMQ\n')
+    output_folder = tmp_path / 'output'
+    output_folder.mkdir()
+    args = ['-b', tmp_path / 'baits.fasta', '-t', tmp_path / 'targets.fasta', '-o', output_folder]
+
+    run_script('src.make_input_fasta', *args, '--shard_pairs', 4)
+    shards = sorted(output_folder.glob('targets_pulldown_shard_*.fasta'))
+    assert [len(read_fasta_pairs(path)) for path in shards] == [4, 2]
+    assert [p for path in shards for p in read_fasta_pairs(path)] == [
+        ('B1__T1', 'MKV:MEE'), ('B1__T2', 'MKV:MRRRRRR'), ('B1__T3', 'MKV:MQ'),
+        ('B2__T1', 'MLLLL:MEE'), ('B2__T2', 'MLLLL:MRRRRRR'), ('B2__T3', 'MLLLL:MQ'),
+    ]
+
+    for path in shards:
+        path.unlink()
+    # Pairs of 6, 10, 5, 8, 12 and 7 residues
+    run_script('src.make_input_fasta', *args, '--shard_residues', 16)
+    shards = sorted(output_folder.glob('targets_pulldown_shard_*.fasta'))
+    assert [[pair_id for pair_id, _ in read_fasta_pairs(path)] for path in shards] == [
+        ['B1__T1', 'B1__T2'], ['B1__T3', 'B2__T1'], ['B2__T2'], ['B2__T3'],
+    ]
@@ -0,0 +1,54 @@
+"""
+The columnar PDB parser must give the same chains, coordinates and CA / CB indices as the line based parser
+it replaced (kept below as the reference), and read_pdb / read_pdb_pdockq must still take a PDB file path.
+"""
+from pathlib import Path
+
+import numpy as np
+
+from src.score_protein_complex import load_protein_complex_files, read_pdb, read_pdb_pdockq
+
+
+EXAMPLE_DATA = Path(__file__).resolve().parent.parent / 'example_data'
+
+
+def reference_read_pdb(pdbfile):
+    pdb_chains, chain_coords, chain_CA_inds, chain_CB_inds, chain_CB_plddt = {}, {}, {}, {}, {}
+    with open(pdbfile) as file:
+        for line in file:
+            if not line.startswith('ATOM'):
+                continue
+            chain, atm_name, res_name = line[21], line[12:16].strip(), line[17:20].strip()
+            xyz = [float(line[30:38]), float(line[38:46]), float(line[46:54])]
+            if chain not in pdb_chains:
+                pdb_chains[chain], chain_coords[chain] = [], []
+                chain_CA_inds[chain], chain_CB_inds[chain], chain_CB_plddt[chain] = [], [], []
+            coord_ind = len(chain_coords[chain])
+            pdb_chains[chain].append(line)
+            chain_coords[chain].append(xyz)
+            if atm_name == 'CA':
+                chain_CA_inds[chain].append(coord_ind)
+            if atm_name == 'CB' or (atm_name == 'CA' and res_name == 'GLY'):
+                chain_CB_inds[chain].append(coord_ind)
+                chain_CB_plddt[chain].append(float(line[60:66]))
+    return pdb_chains, chain_coords, chain_CA_inds, chain_CB_inds, chain_CB_plddt
+
+
+def test_read_pdb_paths():
+    pdb_paths = [pdb_path for _, pdb_path, _ in load_protein_complex_files(EXAMPLE_DATA)]
+    assert len(pdb_paths) > 0
+    for pdb_path in pdb_paths:
+        pdb_chains, chain_coords, chain_CA_inds, chain_CB_inds, chain_CB_plddt = reference_read_pdb(pdb_path)
+
+        lines, coords, CA_inds, CB_inds = read_pdb(pdb_path)
+        assert lines == pdb_chains
+        assert list(coords) == list(chain_coords)
+        for chain in chain_coords:
+            assert np.array_equal(coords[chain], np.array(chain_coords[chain]))
+            assert list(CA_inds[chain]) == chain_CA_inds[chain]
+            assert list(CB_inds[chain]) == chain_CB_inds[chain]
+
+        CB_coords, CB_plddt = read_pdb_pdockq(pdb_path)
+        for chain in chain_coords:
+            assert np.array_equal(CB_coords[chain], np.array(chain_coords[chain])[chain_CB_inds[chain]])
+            assert np.array_equal(CB_plddt[chain], np.array(chain_CB_plddt[chain]))
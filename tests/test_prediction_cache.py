@@ -0,0 +1,68 @@
+"""
+Predictions restored from the cache under another job name must carry the new name, and must not share
+writable files with the cache. A prediction that cannot be restored is a cache miss.
+"""
+import json
+import os
+import shutil
+
+from src.prediction_cache import PredictionCache
+
+
+def make_job_folder(output_folder, job_name):
+    name = job_name.lower()
+    job_folder = output_folder / name
+    (job_folder / 'seed-1_sample-0').mkdir(parents=True)
+    (job_folder / f'{name}_model.cif').write_text(f'data_{name}\n_entry.id {name}\n#\n')
+    (job_folder / 'seed-1_sample-0' / 'model.cif').write_text(f'data_{name}\n#\n')
+    (job_folder / f'{name}_data.json').write_text(json.dumps({'name': job_name, 'modelSeeds': [1]}))
+    (job_folder / f'{name}_confidences.json').write_text('{"pae": [[0.5]]}')
+    return job_folder
+
+
+def test_restore_under_another_name(tmp_path):
+    cache = PredictionCache(tmp_path / 'cache', 'protein')
+    key = cache.key('CCO', [1])
+    cached_folder = make_job_folder(tmp_path / 'run_1', 'Bait__lig1')
+    cache.store(key, cached_folder)
+
+    job_folder = tmp_path / 'run_2' / 'bait__ethanol'
+    job_folder.parent.mkdir()
+    assert cache.restore(key, job_folder, 'Bait__Ethanol')
+
+    assert sorted(p.name for p in job_folder.iterdir()) == [
+        'bait__ethanol_confidences.json', 'bait__ethanol_data.json', 'bait__ethanol_model.cif', 'seed-1_sample-0',
+    ]
+    assert (job_folder / 'bait__ethanol_model.cif').read_text() == 'data_bait__ethanol\n_entry.id bait__ethanol\n#\n'
+    assert (job_folder / 'seed-1_sample-0' / 'model.cif').read_text() == 'data_bait__ethanol\n#\n'
+    assert json.loads((job_folder / 'bait__ethanol_data.json').read_text())['name'] == 'Bait__Ethanol'
+
+    # Files holding the job name are copies; other files are read-only hard links
+    model_path = job_folder / 'bait__ethanol_model.cif'
+    assert not os.path.samefile(model_path, cached_folder / 'bait__lig1_model.cif')
+    confidences_path = job_folder / 'bait__ethanol_confidences.json'
+    assert os.path.samefile(confidences_path, cached_folder / 'bait__lig1_confidences.json')
+    assert not (os.stat(confidences_path).st_mode & 0o222)
+
+    # Restoring into an existing folder replaces it
+    assert cache.restore(key, job_folder, 'Bait__Ethanol')
+    assert not list(job_folder.parent.glob('*.tmp'))
+
+
+def test_failed_restore_is_a_miss(tmp_path, caplog):
+    cache = PredictionCache(tmp_path / 'cache', 'protein')
+    job_folder = tmp_path / 'output' / 'bait__lig2'
+    job_folder.parent.mkdir()
+    assert not cache.restore(cache.key('CCN', [1]), job_folder)
+
+    key = cache.key('CCO', [1])
+    cache.store(key, make_job_folder(tmp_path / 'run_1', 'bait__lig1'))
+    # Entry evicted while being restored: its output is gone
+    shutil.rmtree(cache.entry_path(key) / 'output')
+    assert not cache.restore(key, job_folder)
+    assert 'Failed to restore cached prediction' in caplog.text
+    assert not job_folder.exists()
+    assert not list(job_folder.parent.iterdir())
+
+    entry_size = os.path.getsize(cache.entry_path(key) / 'entry.json')
+    assert cache.evict(max_bytes=0) == (1, entry_size)
@@ -0,0 +1,143 @@
+"""
+The shard scheduler of run_af3_ligand_pulldown.py, run end to end against a stub `alphafold` on PATH.
+
+The stub writes a model for each spec of its input folder, except for ligands listed in $STUB_FAIL,
+and records the CUDA device and the jobs of each run in its log.
+"""
+import json
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+STUB_ALPHAFOLD = f'''#!{sys.executable}
+import json, os, sys, time
+from pathlib import Path
+
+args = sys.argv[1:]
+input_dir = Path(args[args.index('--input_dir') + 1])
+output_dir = Path(args[args.index('--output_dir') + 1])
+failed = set(os.environ.get('STUB_FAIL', '').split(','))
+print('device', os.environ.get('CUDA_VISIBLE_DEVICES'))
+for spec_path in sorted(input_dir.glob('*.json')):
+    name = json.loads(spec_path.read_text())['name'].lower()
+    print('job', name)
+    if spec_path.stem in failed:
+        continue
+    job_folder = output_dir / name
+    job_folder.mkdir()
+    (job_folder / f'{{name}}_model.cif').write_text('data_' + name)
+time.sleep(0.2)
+sys.exit(1 if failed & {{p.stem for p in input_dir.glob('*.json')}} else 0)
+'''
+
+
+@pytest.fixture
+def pulldown(tmp_path):
+    bin_folder = tmp_path / 'bin'
+    bin_folder.mkdir()
+    stub_path = bin_folder / 'alphafold'
+    stub_path.write_text(STUB_ALPHAFOLD)
+    stub_path.chmod(0o755)
+
+    spec_path = tmp_path / 'bait.json'
+    spec_path.write_text(json.dumps({
+        'name': 'bait',
+        'sequences': [{'protein': {'id': 'A', 'sequence': 'MKVLAAGIVG'}}],
+        'modelSeeds': [1],
+        'dialect': 'alphafold3',
+        'version': 1,
+    }))
+    ligands_path = tmp_path / 'ligands.csv'
+    ligands_path.write_text('id,smiles\n' + ''.join(f'lig{i},{"C" * (i + 1)}O\n' for i in range(8)))
+    output_folder = tmp_path / 'output'
+    output_folder.mkdir()
+
+    def run(*args, fail=()):
+        env = {
+            **os.environ,
+            'PATH': f'{bin_folder}{os.pathsep}{os.environ["PATH"]}',
+            'STUB_FAIL': ','.join(fail),
+        }
+        cmd = [
+            sys.executable, '-m', 'src.run_af3_ligand_pulldown',
+            '-i', spec_path, '-l', ligands_path, '--id_col', 'id', '--smiles_col', 'smiles', '-o', output_folder,
+            *args,
+        ]
+        return subprocess.run([str(c) for c in cmd], cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+
+    return run, output_folder
+
+
+def read_shard_logs(output_folder):
+    """
+    {shard log name: (devices, jobs)} of all runs logged.
+    """
+    logs = {}
+    for log_path in sorted((output_folder / 'logs').glob('shard_*.log')):
+        text = log_path.read_text()
+        logs[log_path.name] = (re.findall(r'^device (\S+)$', text, re.M), re.findall(r'^job (\S+)$', text, re.M))
+    return logs
+
+
+def test_shards_and_failed_ligands(pulldown):
+    run, output_folder = pulldown
+    result = run('--slots', '2', '--n_shards', '4', '--gpu_ids', '0,1', fail=['lig5'])
+    assert result.returncode == 1, result.stderr
+
+    # Contiguous shards of 2 ligands, each run by one process on the GPU of its slot
+    logs = read_shard_logs(output_folder)
+    assert list(logs) == [f'shard_{i:04d}.log' for i in range(4)]
+    for i, (devices, jobs) in enumerate(logs.values()):
+        assert len(devices) == 1 and devices[0] in ('0', '1')
+        assert jobs == [f'bait__lig{2 * i}', f'bait__lig{2 * i + 1}']
+
+    slots = re.findall(r'Shard \d+: running 2 ligands in slot (\d)', result.stderr)
+    assert sorted(slots) == ['0', '0', '1', '1']
+
+    assert (output_folder / 'failed_ligands.txt').read_text() == 'lig5\n'
+    assert 'Number of failed ligands: 1 (failed shards: 1 / 4)' in result.stderr
+    for i in range(8):
+        assert (output_folder / f'bait__lig{i}' / f'bait__lig{i}_model.cif').is_file() == (i != 5)
+
+
+def test_resume(pulldown):
+    run, output_folder = pulldown
+    assert run('--slots', '2', fail=['lig1', 'lig6']).returncode == 1
+    seeds = {}
+    for line in (output_folder / 'run_manifest.jsonl').read_text().splitlines():
+        record = json.loads(line)
+        if 'model_seeds' in record:
+            seeds[record['ligand_id']] = record['model_seeds']
+
+    result = run('--slots', '2', '--resume')
+    assert result.returncode == 0, result.stderr
+    assert not (output_folder / 'failed_ligands.txt').exists()
+    assert 'Number of ligands already predicted: 6' in result.stderr
+
+    # Only failed ligands are predicted again, with the seeds of their first submission
+    jobs = [job for _, (_, jobs) in read_shard_logs(output_folder).items() for job in jobs]
+    assert sorted(jobs) == sorted([f'bait__lig{i}' for i in range(8)] + ['bait__lig1', 'bait__lig6'])
+    records = [json.loads(line) for line in (output_folder / 'run_manifest.jsonl').read_text().splitlines()]
+    resubmitted = [r for r in records[-4:] if r['status'] == 'submitted']
+    assert {r['ligand_id']: r['model_seeds'] for r in resubmitted} == {'lig1': seeds['lig1'], 'lig6': seeds['lig6']}
+
+
+def test_rerun_keeps_earlier_models(pulldown):
+    run, output_folder = pulldown
+    assert run().returncode == 0
+    assert run().returncode == 0
+
+    # Earlier models are moved aside to <job>_<timestamp>/, not deleted
+    for i in range(8):
+        job_folders = sorted(p.name for p in output_folder.glob(f'bait__lig{i}*'))
+        assert len(job_folders) == 2 and job_folders[0] == f'bait__lig{i}'
+
+    assert run('--overwrite').returncode == 0
+    assert len(list(output_folder.glob('bait__lig0*'))) == 2
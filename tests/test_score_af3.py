@@ -0,0 +1,204 @@
+"""
+Scores of AlphaFold 3 models: only protein chains count as chains of the complex, and as partners of the ligand.
+Scoring with several workers must give the same rows in the same order as serial scoring.
+The mmCIF atom_site reader must give the same atoms as the PDB reader for the same structure.
+"""
+import json
+import time
+
+import numpy as np
+import pytest
+
+from src.benchmark_scoring import generate_library
+from src.score_af3 import (
+    DEFAULT_SCORE_NAMES,
+    calc_ligand_scores,
+    calc_model_dockq,
+    get_protein_chains,
+    imap_threads,
+    load_scores_paths,
+    read_cif_atoms,
+    score_structures,
+)
+from src.score_protein_complex import load_protein_complex_files, read_pdb_atoms, score_protein_complex_files
+
+
+CIF_COLUMNS = [
+    'group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_comp_id', 'label_asym_id',
+    'label_seq_id', 'Cartn_x', 'Cartn_y', 'Cartn_z', 'B_iso_or_equiv', 'auth_asym_id',
+]
+
+
+def protein_chain(rng, chain, length, offset):
+    """
+    Atoms (group, atom name, residue name, chain, residue number, coordinates, pLDDT) of a random walk of residues.
+    """
+    coords = np.cumsum(rng.normal(scale=2.2, size=(length, 3)), axis=0) + offset
+    atoms = []
+    for i, (xyz, plddt) in enumerate(zip(coords, rng.uniform(40, 95, size=length))):
+        res_name = 'GLY' if i % 5 == 0 else 'ALA'
+        atoms.append(('ATOM', 'N', res_name, chain, i + 1, xyz + [-1.2, 0.5, 0], plddt))
+        atoms.append(('ATOM', 'CA', res_name, chain, i + 1, xyz, plddt))
+        if res_name != 'GLY':
+            atoms.append(('ATOM', 'CB', res_name, chain, i + 1, xyz + [0.6, 1.3, 0], plddt))
+    return atoms
+
+
+def dna_chain(rng, chain, length, offset):
+    coords = np.cumsum(rng.normal(scale=2.2, size=(length, 3)), axis=0) + offset
+    atoms = []
+    for i, xyz in enumerate(coords):
+        for atom_name, shift in [('P', 0.), ("C1'", 1.4), ('N9', 2.8)]:
+            atoms.append(('ATOM', atom_name, 'DA', chain, i + 1, xyz + shift, 80.))
+    return atoms
+
+
+def write_cif(path, atoms):
+    lines = ['data_model', '#', 'loop_', *(f'_atom_site.{c}' for c in CIF_COLUMNS)]
+    for i, (group, atom_name, res_name, chain, res_id, (x, y, z), plddt) in enumerate(atoms):
+        atom_name = f'"{atom_name}"' if "'" in atom_name else atom_name
+        lines.append(
+            f'{group} {i + 1} {atom_name[0]} {atom_name} {res_name} {chain} {res_id} '
+            f'{x:.3f} {y:.3f} {z:.3f} {plddt:.2f} {chain}'
+        )
+    path.write_text('\n'.join(lines) + '\n#\n')
+
+
+def test_dockq_ignores_nucleic_acids(tmp_path):
+    rng = np.random.default_rng(0)
+    protein_atoms = protein_chain(rng, 'A', 40, 0.) + protein_chain(rng, 'B', 35, 6.)
+    dna_atoms = dna_chain(rng, 'C', 12, 4.)
+    ligand_atoms = [('HETATM', 'MG', 'MG', 'D', '.', np.array([3., 3., 3.]), 90.)]
+
+    write_cif(tmp_path / 'proteins.cif', protein_atoms)
+    write_cif(tmp_path / 'with_dna.cif', protein_atoms + dna_atoms + ligand_atoms)
+
+    dockq = calc_model_dockq(tmp_path / 'proteins.cif')
+    assert dockq is not None and dockq > 0.018
+    # Two protein chains and a DNA chain: pDockQ of the protein chains, not mpDockQ of 3 chains
+    assert calc_model_dockq(tmp_path / 'with_dna.cif') == dockq
+
+    write_cif(tmp_path / 'single.cif', protein_chain(rng, 'A', 20, 0.) + dna_chain(rng, 'B', 10, 3.))
+    assert calc_model_dockq(tmp_path / 'single.cif') is None
+
+
+def test_ligand_scores_exclude_other_ligands_and_ions(tmp_path):
+    # Protein A (3 residues), ligand Z (2 atoms), magnesium ion M
+    token_chain_ids = ['A', 'A', 'A', 'Z', 'Z', 'M']
+    pae = np.full((6, 6), 30.)
+    pae[np.ix_([3, 4], [0, 1, 2])] = [[4., 5., 6.], [7., 8., 9.]]
+    pae[np.ix_([0, 1, 2], [3, 4])] = 10.
+    pae[np.ix_([3, 4], [5])] = 0.5
+    pae[np.ix_([5], [3, 4])] = 0.5
+    contact_probs = np.zeros((6, 6))
+    contact_probs[np.ix_([3, 4], [0, 1, 2])] = [[0.1, 0.2, 0.], [0., 0.3, 0.]]
+    contact_probs[np.ix_([3, 4], [5])] = 1.
+    confidences_path = tmp_path / 'model_confidences.json'
+    confidences_path.write_text(json.dumps({
+        'atom_chain_ids': ['A'] * 12 + ['Z', 'Z', 'M'],
+        'atom_plddts': [90.] * 12 + [60., 70., 95.],
+        'contact_probs': contact_probs.tolist(),
+        'pae': pae.tolist(),
+        'token_chain_ids': token_chain_ids,
+        'token_res_ids': [1, 2, 3, 1, 1, 1],
+    }, indent=1))
+
+    rng = np.random.default_rng(0)
+    model_path = tmp_path / 'model.cif'
+    write_cif(model_path, protein_chain(rng, 'A', 3, 0.) + [
+        ('HETATM', 'C1', 'LIG', 'Z', '.', np.array([1., 1., 1.]), 60.),
+        ('HETATM', 'C2', 'LIG', 'Z', '.', np.array([2., 1., 1.]), 70.),
+        ('HETATM', 'MG', 'MG', 'M', '.', np.array([3., 3., 3.]), 95.),
+    ])
+    protein_chains = get_protein_chains(read_cif_atoms(model_path))
+    assert protein_chains == ['A']
+
+    scores = calc_ligand_scores(confidences_path, 'Z', protein_chains)
+    assert scores['ligand_plddt'] == 65.
+    assert scores['ligand_pae_mean'] == pytest.approx(round((4 + 5 + 6 + 7 + 8 + 9 + 6 * 10) / 12, 2))
+    assert scores['ligand_pae_min'] == 4.
+    assert scores['ligand_contact_mass'] == pytest.approx(0.6)
+
+    # The ligand is never its own partner, and a structure without protein has no ligand scores
+    assert calc_ligand_scores(confidences_path, 'Z', ['A', 'Z']) == scores
+    assert all(v is None for v in calc_ligand_scores(confidences_path, 'Z', []).values())
+
+
+def test_imap_threads_keeps_order():
+    def slow_square(x):
+        time.sleep((x * 7 % 5) / 1000)
+        return x * x
+
+    items = list(range(50))
+    assert list(imap_threads(slow_square, items, workers=4, window_size=2)) == [x * x for x in items]
+
+
+@pytest.mark.parametrize('dockq', [False, True])
+def test_workers_match_serial(tmp_path, dockq):
+    generate_library(tmp_path, n_complexes=24, n_chains=2, chain_length=30, rng=np.random.default_rng(3))
+    scores_paths = load_scores_paths(tmp_path / 'af3', workers=4)
+    assert len(scores_paths) == 24
+
+    serial = list(score_structures(scores_paths, DEFAULT_SCORE_NAMES, dockq=dockq, workers=1))
+    parallel = list(score_structures(scores_paths, DEFAULT_SCORE_NAMES, dockq=dockq, workers=4))
+    assert parallel == serial
+    assert [row['id'] for row in serial] == [p.name.replace('_summary_confidences.json', '') for p in scores_paths]
+    if dockq:
+        assert all(row['dockq'] is not None for row in serial)
+
+
+@pytest.mark.parametrize('n_chains', [2, 3])
+def test_cif_reader_matches_pdb_reader(tmp_path, n_chains):
+    generate_library(tmp_path, n_complexes=3, n_chains=n_chains, chain_length=25, rng=np.random.default_rng(n_chains))
+    for files in load_protein_complex_files(tmp_path):
+        complex_id, pdb_path, _ = files
+        af3_id = complex_id.lower()
+        cif_path = tmp_path / 'af3' / af3_id / f'{af3_id}_model.cif'
+
+        cif_atoms, pdb_atoms = read_cif_atoms(cif_path), read_pdb_atoms(pdb_path)
+        for name in ['chain', 'atom_name', 'res_name']:
+            assert getattr(cif_atoms, name).tolist() == getattr(pdb_atoms, name).tolist()
+        assert np.array_equal(cif_atoms.coords, pdb_atoms.coords)
+        assert np.array_equal(cif_atoms.b_factor, pdb_atoms.b_factor)
+
+        _, scores, error = score_protein_complex_files(files)
+        assert error is None
+        assert calc_model_dockq(cif_path) == pytest.approx(scores['dockq'], abs=1e-4)
+
+
+def test_cif_reader_layout(tmp_path):
+    # auth_asym_id differs from label_asym_id, quoted atom names, a ligand, and another loop after atom_site
+    cif_path = tmp_path / 'model.cif'
+    cif_path.write_text(
+        'data_model\n'
+        '#\n'
+        'loop_\n'
+        '_atom_site.group_PDB\n'
+        '_atom_site.label_atom_id\n'
+        '_atom_site.label_comp_id\n'
+        '_atom_site.label_asym_id\n'
+        '_atom_site.Cartn_x\n'
+        '_atom_site.Cartn_y\n'
+        '_atom_site.Cartn_z\n'
+        '_atom_site.B_iso_or_equiv\n'
+        '_atom_site.auth_asym_id\n'
+        'ATOM CA ALA A 1.000 2.000 3.000 90.10 H\n'
+        'ATOM "O5\'" DA B -1.5 0.25 10 55.00 D\n'
+        'HETATM C1 LIG C 4.0 4.0 4.0 70.00 X\n'
+        'loop_\n'
+        '_atom_type.symbol\n'
+        'C\n'
+    )
+    atoms = read_cif_atoms(cif_path)
+    assert atoms.chain.tolist() == ['H', 'D']
+    assert atoms.atom_name.tolist() == ['CA', "O5'"]
+    assert atoms.res_name.tolist() == ['ALA', 'DA']
+    assert atoms.coords.tolist() == [[1., 2., 3.], [-1.5, 0.25, 10.]]
+    assert atoms.b_factor.tolist() == [90.1, 55.]
+
+    ligand_atoms = read_cif_atoms(cif_path, group='HETATM')
+    assert ligand_atoms.chain.tolist() == ['X'] and ligand_atoms.atom_name.tolist() == ['C1']
+
+    (tmp_path / 'empty.cif').write_text('data_model\n#\n')
+    with pytest.raises(ValueError, match='No atom_site table'):
+        read_cif_atoms(tmp_path / 'empty.cif')
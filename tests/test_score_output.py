@@ -0,0 +1,65 @@
+"""
+SortedScoresWriter must give the same sorted CSV whether rows fit in memory, are spilled to sorted chunks
+and merged, or only the top K are kept.
+"""
+import csv
+
+import numpy as np
+
+from src.score_output import SortedScoresWriter
+
+
+COLUMNS = ['id', 'confidence']
+
+
+def random_rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    # Rounded, so that many rows have the same confidence; some rows have none
+    confidences = np.round(rng.uniform(0, 1, size=n), 2)
+    return [
+        {'id': f'complex_{i}', 'confidence': None if i % 17 == 0 else float(c)}
+        for i, c in enumerate(confidences)
+    ]
+
+
+def expected_ids(rows):
+    """
+    Ids by confidence (highest first), rows with the same confidence in insertion order, rows without confidence last.
+    """
+    order = sorted(
+        range(len(rows)), 
+        key=lambda i: (rows[i]['confidence'] is None, -(rows[i]['confidence'] or 0), i),
+    )
+    return [rows[i]['id'] for i in order]
+
+
+def write_rows(output_path, rows, **kwargs):
+    with SortedScoresWriter(output_path, COLUMNS, **kwargs) as writer:
+        for row in rows:
+            writer.add(row)
+    with output_path.open(newline='') as f:
+        reader = csv.reader(f)
+        assert next(reader) == COLUMNS
+        return [row[0] for row in reader]
+
+
+def test_in_memory(tmp_path):
+    rows = random_rows(500)
+    assert write_rows(tmp_path / 'scores.csv', rows) == expected_ids(rows)
+
+
+def test_spill_and_merge(tmp_path):
+    rows = random_rows(1_000)
+    assert write_rows(tmp_path / 'scores.csv', rows, chunk_size=64) == expected_ids(rows)
+    # Sorted chunks are removed once merged
+    assert [p.name for p in tmp_path.iterdir()] == ['scores.csv']
+
+
+def test_top_k(tmp_path):
+    rows = random_rows(1_000)
+    assert write_rows(tmp_path / 'scores.csv', rows, top_k=25) == expected_ids(rows)[:25]
+    assert write_rows(tmp_path / 'all.csv', rows[:10], top_k=25) == expected_ids(rows[:10])
+
+
+def test_empty(tmp_path):
+    assert write_rows(tmp_path / 'scores.csv', []) == []
@@ -0,0 +1,171 @@
+"""
+Scoring of ColabFold outputs by score_protein_complex.py: complexes scored by a pool of workers give the same
+results, in the same order, as serial scoring, and a complex that fails to score does not abort the others.
+All models of a complex scored in one batch give the same scores as each model scored on its own.
+Watch mode scores complexes as their done markers appear, stops after --watch_timeout seconds without new ones,
+and does not score again complexes already in the output CSV.
+"""
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.benchmark_scoring import generate_library
+from src.score_protein_complex import (
+    load_protein_complex_files,
+    score_models,
+    score_protein_complex_all_models,
+    score_protein_complexes,
+)
+from tests.test_score_store import REPO_ROOT, run_script
+
+
+def break_complexes(af_folder):
+    """
+    Make the first complex fail on its PDB file (no atoms) and the third one on its JSON scores (truncated).
+    """
+    files = load_protein_complex_files(af_folder)
+    files[0][1].write_text('MODEL     1\nENDMDL\n')
+    files[2][2].write_text(files[2][2].read_text()[:100])
+    return {files[0][0], files[2][0]}
+
+
+def test_workers_match_serial(tmp_path):
+    generate_library(tmp_path, n_complexes=7, n_chains=2, chain_length=30, rng=np.random.default_rng(0))
+    failed_ids = break_complexes(tmp_path)
+    files = load_protein_complex_files(tmp_path)
+
+    serial = list(score_protein_complexes(files, workers=1))
+    parallel = list(score_protein_complexes(files, workers=3, chunk_size=2))
+    assert parallel == serial
+    assert [complex_id for complex_id, _, _ in serial] == [f[0] for f in files]
+    assert {complex_id for complex_id, scores, error in serial if error is not None} == failed_ids
+    for complex_id, scores, error in serial:
+        if complex_id in failed_ids:
+            assert scores is None
+        else:
+            assert error is None and scores['dockq'] is not None
+
+
+def test_failures_are_isolated(tmp_path):
+    generate_library(tmp_path, n_complexes=7, n_chains=3, chain_length=30, rng=np.random.default_rng(1))
+    failed_ids = break_complexes(tmp_path)
+
+    run_script('src.score_protein_complex', '-i', tmp_path, '-o', tmp_path / 'serial.csv')
+    result = run_script(
+        'src.score_protein_complex', '-i', tmp_path, '-o', tmp_path / 'parallel.csv', '--workers', 3, '--chunk_size', 1,
+    )
+    for complex_id in failed_ids:
+        assert f'Failed to score protein complex {complex_id}' in result.stderr
+    assert 'Number of protein complexes that could not be scored: 2' in result.stderr
+
+    serial = pd.read_csv(tmp_path / 'serial.csv')
+    parallel = pd.read_csv(tmp_path / 'parallel.csv')
+    pd.testing.assert_frame_equal(parallel, serial)
+    assert len(serial) == 5 and not set(serial['id']) & failed_ids
+
+
+def add_ranked_models(af_folder, n_models, rng):
+    """
+    Write models of rank 2 to `n_models` of each complex: the rank 1 model with moved atoms and other ipTM / pTM.
+    """
+    for complex_id, pdb_path, scores_path in load_protein_complex_files(af_folder):
+        pdb_lines = pdb_path.read_text().splitlines()
+        scores = json.loads(scores_path.read_text())
+        for rank in range(2, n_models + 1):
+            lines = []
+            for line in pdb_lines:
+                if line.startswith('ATOM'):
+                    xyz = np.array([float(line[30:38]), float(line[38:46]), float(line[46:54])])
+                    xyz += rng.normal(scale=1.5, size=3)
+                    line = f'{line[:30]}{xyz[0]:8.3f}{xyz[1]:8.3f}{xyz[2]:8.3f}{line[54:]}'
+                lines.append(line)
+            model_name = f'rank_{rank:03d}_alphafold2_multimer_v3_model_{rank}_seed_000'
+            (af_folder / f'{complex_id}_unrelaxed_{model_name}.pdb').write_text('\n'.join(lines) + '\n')
+            scores.update(iptm=round(float(rng.uniform(0.1, 0.9)), 2), ptm=round(float(rng.uniform(0.2, 0.9)), 2))
+            (af_folder / f'{complex_id}_scores_{model_name}.json').write_text(json.dumps(scores))
+
+
+@pytest.mark.parametrize('n_chains', [2, 3])
+def test_all_models_batch(tmp_path, n_chains):
+    rng = np.random.default_rng(n_chains)
+    generate_library(tmp_path, n_complexes=3, n_chains=n_chains, chain_length=30, rng=rng)
+    add_ranked_models(tmp_path, n_models=4, rng=rng)
+
+    files = load_protein_complex_files(tmp_path, all_models=True)
+    assert [len(pdb_paths) for _, pdb_paths, _ in files] == [4, 4, 4]
+    for files_of_complex in files:
+        complex_id, pdb_paths, scores_paths = files_of_complex
+        _, scores, error = score_protein_complex_all_models(files_of_complex)
+        assert error is None
+        assert [m['rank'] for m in scores['models']] == [1, 2, 3, 4]
+
+        dockq_scores = set()
+        for model_scores, pdb_path, scores_path in zip(scores['models'], pdb_paths, scores_paths):
+            [expected] = score_models([pdb_path], [scores_path], [(scores_path, 'pae')])
+            assert {k: v for k, v in model_scores.items() if k not in ('id', 'model', 'rank')} == expected
+            dockq_scores.add(expected['dockq'])
+        # Moved atoms change the contacts of each model (mpDockQ of the synthetic complexes is saturated)
+        if n_chains == 2:
+            assert len(dockq_scores) > 1
+
+    output_path = tmp_path / 'scores.csv'
+    run_script('src.score_protein_complex', '-i', tmp_path, '-o', output_path, '--all_models', '--workers', 2)
+    models = pd.read_csv(output_path)
+    aggregates = pd.read_csv(tmp_path / 'scores_per_complex.csv').set_index('id')
+    assert len(models) == 12
+    assert (aggregates['n_models'] == 4).all()
+    for complex_id, complex_models in models.groupby('id'):
+        assert sorted(complex_models['rank']) == [1, 2, 3, 4]
+        assert aggregates.loc[complex_id, 'dockq_best'] == pytest.approx(complex_models['dockq'].max())
+
+
+def mark_done(af_folder, complex_ids):
+    for complex_id in complex_ids:
+        (af_folder / f'{complex_id}.done.txt').write_text('')
+
+
+def test_watch(tmp_path):
+    generate_library(tmp_path, n_complexes=5, n_chains=2, chain_length=30, rng=np.random.default_rng(4))
+    complex_ids = [f[0] for f in load_protein_complex_files(tmp_path)]
+    output_path = tmp_path / 'scores.csv'
+    watch_args = ['-i', tmp_path, '-o', output_path, '--watch', '--poll_interval', 0.1]
+
+    # Complexes without done marker are not scored; watching stops after the timeout
+    mark_done(tmp_path, complex_ids[:2])
+    start = time.monotonic()
+    result = run_script('src.score_protein_complex', *watch_args, '--watch_timeout', 0.5)
+    assert time.monotonic() - start > 0.5
+    assert 'No new finished protein complex in 0.5 seconds: stop watching' in result.stderr
+    scores = pd.read_csv(output_path)
+    assert sorted(scores['id']) == complex_ids[:2]
+    assert scores['confidence'].is_monotonic_decreasing
+
+    # Complexes already in the CSV are not scored again, even if their files changed
+    scores_path = load_protein_complex_files(tmp_path)[0][2]
+    scores_json = json.loads(scores_path.read_text())
+    scores_path.write_text(json.dumps({**scores_json, 'iptm': 0.01, 'ptm': 0.01}))
+
+    cmd = [sys.executable, '-m', 'src.score_protein_complex', *(str(a) for a in watch_args), '--watch_timeout', '3']
+    process = subprocess.Popen(cmd, cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        mark_done(tmp_path, complex_ids[2:4])
+        # A complex finishing while watching is scored and resets the timeout
+        deadline = time.monotonic() + 30
+        while len(pd.read_csv(output_path)) < 4 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        mark_done(tmp_path, complex_ids[4:])
+        _, stderr = process.communicate(timeout=30)
+    finally:
+        process.kill()
+    assert process.returncode == 0, stderr
+    assert 'Number of protein complexes already in output CSV: 2' in stderr
+
+    rescored = pd.read_csv(output_path).set_index('id')
+    assert sorted(rescored.index) == complex_ids
+    pd.testing.assert_frame_equal(rescored.loc[scores['id']].reset_index(), scores)
+    assert rescored['confidence'].is_monotonic_decreasing
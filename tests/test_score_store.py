@@ -0,0 +1,112 @@
+"""
+The score store must resume from committed scores, and detect input files that changed since they were scored.
+Structures that fail to be scored again must not be output with stale scores, nor stored with partial scores.
+"""
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from src.benchmark_scoring import generate_library
+from src.score_store import ScoreStore, file_fingerprint
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_resume(tmp_path):
+    db_path = tmp_path / 'scores.db'
+    store = ScoreStore(db_path, batch_size=2)
+    for i in range(3):
+        store.add(f'complex_{i}', f'fingerprint_{i}', {'id': f'complex_{i}', 'dockq': i / 10})
+    # Killed before close: only the first full batch is committed
+    store.conn.close()
+
+    with ScoreStore(db_path) as store:
+        assert store.load_fingerprints() == {'complex_0': 'fingerprint_0', 'complex_1': 'fingerprint_1'}
+        store.add('complex_2', 'fingerprint_2', {'id': 'complex_2', 'dockq': 0.2})
+
+    with ScoreStore(db_path) as store:
+        assert len(store.load_fingerprints()) == 3
+        ids = ['complex_2', 'missing', 'complex_0']
+        assert [scores['id'] for scores in store.iter_scores(ids)] == ['complex_2', 'complex_0']
+        assert [scores['id'] for scores in store.iter_scores()] == ['complex_0', 'complex_1', 'complex_2']
+
+
+def test_fingerprint_invalidation(tmp_path):
+    path = tmp_path / 'scores.json'
+    path.write_text('{"iptm": 0.5}')
+    fingerprint = file_fingerprint([path])
+    hash_fingerprint = file_fingerprint([path], content_hash=True)
+    assert file_fingerprint([path]) == fingerprint
+
+    # Same content, other modification time: only the content hash is unchanged
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert file_fingerprint([path]) != fingerprint
+    assert file_fingerprint([path], content_hash=True) == hash_fingerprint
+
+    path.write_text('{"iptm": 0.6}')
+    assert file_fingerprint([path], content_hash=True) != hash_fingerprint
+
+    # Scores stored with other scoring options must be computed again
+    assert file_fingerprint([path], options=['all_models']) != file_fingerprint([path])
+    assert file_fingerprint([path], options=['a', 'b']) == file_fingerprint([path], options=['b', 'a'])
+
+    with ScoreStore(tmp_path / 'scores.db') as store:
+        store.add('complex_0', fingerprint, {'id': 'complex_0'})
+    with ScoreStore(tmp_path / 'scores.db') as store:
+        assert store.load_fingerprints()['complex_0'] != file_fingerprint([path])
+
+
+def test_delete(tmp_path):
+    with ScoreStore(tmp_path / 'scores.db') as store:
+        store.add('complex_0', 'fingerprint_0', {'id': 'complex_0'})
+        store.add('complex_1', 'fingerprint_1', {'id': 'complex_1'})
+        store.delete('complex_0')
+        store.delete('missing')
+        assert store.load_fingerprints() == {'complex_1': 'fingerprint_1'}
+
+
+def run_script(module, *args):
+    cmd = [sys.executable, '-m', module, *(str(a) for a in args)]
+    result = subprocess.run(cmd, cwd=REPO_ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result
+
+
+def test_failed_rescoring_drops_stale_scores(tmp_path):
+    generate_library(tmp_path, n_complexes=3, n_chains=2, chain_length=30, rng=np.random.default_rng(0))
+    db_path, output_path = tmp_path / 'scores.db', tmp_path / 'scores.csv'
+    run_script('src.score_protein_complex', '-i', tmp_path, '-o', output_path, '--store_path', db_path)
+    assert len(pd.read_csv(output_path)) == 3
+
+    # Changed files that cannot be scored: the complex is neither output with its old scores nor kept in the store
+    scores_path = next(tmp_path.glob('BAIT000001__TARGET000001_scores_*.json'))
+    scores_path.write_text('{"truncated": ')
+    run_script('src.score_protein_complex', '-i', tmp_path, '-o', output_path, '--store_path', db_path)
+    assert sorted(pd.read_csv(output_path)['id']) == ['BAIT000000__TARGET000000', 'BAIT000002__TARGET000002']
+    with ScoreStore(db_path) as store:
+        assert 'BAIT000001__TARGET000001' not in store.load_fingerprints()
+
+
+def test_partial_af3_scores_are_not_stored(tmp_path):
+    generate_library(tmp_path, n_complexes=2, n_chains=2, chain_length=30, rng=np.random.default_rng(0))
+    af3_folder, db_path, output_path = tmp_path / 'af3', tmp_path / 'scores.db', tmp_path / 'scores.csv'
+    run_script('src.score_af3', '-i', af3_folder, '-o', output_path, '--store_path', db_path, '--dockq')
+    assert pd.read_csv(output_path)['dockq'].notna().all()
+
+    # DockQ fails: the row is output without DockQ, and scored again on the next run
+    (af3_folder / 'bait000000__target000000' / 'bait000000__target000000_model.cif').write_text('data_broken\n')
+    for _ in range(2):
+        result = run_script('src.score_af3', '-i', af3_folder, '-o', output_path, '--store_path', db_path, '--dockq')
+        assert 'Number of results to score: 1' in result.stderr
+        scores = pd.read_csv(output_path).set_index('id')
+        assert len(scores) == 2
+        assert pd.isna(scores.loc['bait000000__target000000', 'dockq'])
+        assert pd.notna(scores.loc['bait000001__target000001', 'dockq'])
+        with ScoreStore(db_path) as store:
+            assert list(store.load_fingerprints()) == ['bait000001__target000001']